@@ -0,0 +1,318 @@
+"""Collector Benchmarks
+
+This script measures the collectors against the mock Cloud One API, see
+mock_api.py, so their performance can be compared without a live tenant.
+For every collector and for a full CustomCollector.collect() run with
+all of them, it reports the wall time of each run, the peak resident
+memory and the API requests sent.
+
+    python3 bench/benchmark.py --computers 100000 --events 1000000 --latency 0.05 --repeat 3
+    python3 bench/benchmark.py --output results.json ws_ips cs_rsps
+
+Every target runs in a fresh process with an empty cache directory, so
+the first run is a cold start, e.g. downloading the IPS rule catalogue,
+and the further runs show the steady state. The peak memory is the one
+of that process, isolated collectors running in worker processes are not
+included. The api-collector's environment variables, e.g.
+API_COLLECTOR_WORKERS or API_COLLECTOR_WS_SEARCH_STREAM, apply to the
+benchmarks as well.
+
+Instead of the mock, a recording of a real account can be replayed, see
+the http_replay module, and the results compared to a stored baseline.
+The script then fails if a target got slower or needs more memory than
+the tolerance allows, or sends more requests.
+
+    python3 bench/benchmark.py --replay fixtures/ --output baseline.json
+    python3 bench/benchmark.py --replay fixtures/ --baseline baseline.json --tolerance 0.25
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+import urllib.request
+import mock_api
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CODE_DIR = os.path.join(_ROOT, 'code')
+_COLLECTOR_DIRS = (os.path.join(_ROOT, 'collectors-enabled'), os.path.join(_ROOT, 'collectors-available'))
+
+# Collectors requiring other APIs than Cloud One
+_EXCLUDED = ('astroweather',)
+
+# Target of the full CustomCollector.collect() run
+FULL_RUN = 'all'
+
+# Cloud One endpoint the collectors are configured with, the requests
+# are redirected to the mock
+_C1_URL = 'cloudone.mock'
+
+def collector_paths() -> dict:
+    """Returns the paths of the collector scripts by their name"""
+
+    paths = {}
+    for directory in reversed(_COLLECTOR_DIRS):
+        for path in glob.glob(os.path.join(directory, '*.py')):
+            paths[os.path.splitext(os.path.basename(path))[0]] = path
+    return paths
+
+def _peak_rss() -> int:
+    """Returns the peak resident memory of this process in bytes"""
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def _served_requests(mock_url) -> dict:
+    """Returns and resets the requests served by the mock or the replay"""
+
+    if mock_url is None:
+        import http_replay
+        return http_replay.get_player().stats(reset=True)
+    with urllib.request.urlopen(mock_url + '/_mock/requests?reset=1') as response:
+        return json.load(response)
+
+def _count_series(families) -> int:
+    return sum(len(family.samples) for family in families)
+
+def run_target(target, workdir, mock_url, repeat, log_level, conn):
+    """
+    Runs the benchmark of a target in this process and sends it's result
+
+    Parameters
+    ----------
+    target
+        Name of the collector or FULL_RUN
+    workdir
+        Working directory with the collectors to load in ./collectors
+    mock_url
+        URL of the mock API, to read it's request counts, None when
+        replaying
+    repeat
+        Number of runs
+    log_level
+        Level of the api-collector's logging
+    conn
+        Connection the result is sent to
+    """
+
+    import logging
+    os.chdir(workdir)
+    sys.path[:0] = [_CODE_DIR, workdir]
+
+    import collector
+    import http_client
+    logging.getLogger().setLevel(log_level)
+
+    result = {"target": target, "runs": [], "error": None}
+    try:
+        plugins = collector.PLUGINS.refresh()
+        _served_requests(mock_url)
+        for _ in range(repeat):
+            start = time.monotonic()
+            if target == FULL_RUN:
+                families = list(collector.CustomCollector().collect())
+            else:
+                with http_client.get_client().coalescing():
+                    families = [collector.call_collector(plugins[0]).family]
+            seconds = time.monotonic() - start
+            requests = _served_requests(mock_url)
+            result['runs'].append({
+                "seconds": seconds,
+                "requests": requests['requests'],
+                "throttled": requests['throttled'],
+                "bytes": requests['bytes'],
+                "series": _count_series(families),
+            })
+    except BaseException as err:
+        result['error'] = "{}: {}".format(type(err).__name__, err)
+    result['peak_rss'] = _peak_rss()
+    conn.send(result)
+
+def benchmark(target, paths, mock_url, repeat, log_level) -> dict:
+    """
+    Runs the benchmark of a target in a fresh process
+
+    Parameters
+    ----------
+    target
+        Name of the collector or FULL_RUN
+    paths
+        Paths of the collector scripts to load
+    mock_url
+        URL of the mock API, None to replay API_COLLECTOR_HTTP_REPLAY
+    repeat
+        Number of runs
+    log_level
+        Level of the api-collector's logging
+
+    Returns
+    -------
+    The result of the benchmark
+    """
+
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='api-collector-bench-') as workdir:
+        credentials = os.path.join(workdir, 'credentials')
+        os.makedirs(credentials)
+        for name, value in (('c1_url', _C1_URL), ('api_key', 'mock-api-key'), ('ws_key', 'mock-ws-key')):
+            with open(os.path.join(credentials, name), 'w') as file:
+                file.write(value)
+        os.makedirs(os.path.join(workdir, 'collectors'))
+        for path in paths:
+            shutil.copy(path, os.path.join(workdir, 'collectors'))
+
+        # the environment is inherited by the process, before it imports
+        # the api-collector's modules
+        if mock_url is not None:
+            os.environ['API_COLLECTOR_HTTP_REDIRECT'] = mock_url
+        os.environ.update({
+            'API_COLLECTOR_CREDENTIALS_DIR': credentials,
+            'API_COLLECTOR_CACHE_DIR': os.path.join(workdir, 'cache'),
+            'API_COLLECTOR_RELOAD_INTERVAL': '0',
+        })
+
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=run_target, name=target,
+                                  args=(target, workdir, mock_url, repeat, log_level, sender))
+        process.start()
+        sender.close()
+        try:
+            result = receiver.recv()
+        except EOFError:
+            result = {"target": target, "runs": [], "peak_rss": 0,
+                      "error": "Process exited with {}".format(process.exitcode)}
+        process.join()
+        return result
+
+def _median(result) -> float:
+    """Returns the median seconds of the runs after the first one"""
+
+    runs = result['runs']
+    return statistics.median(run['seconds'] for run in runs[1:] or runs)
+
+def report(results):
+    """Prints the results as table"""
+
+    print("{:<16} {:>5} {:>9} {:>9} {:>9} {:>10} {:>9} {:>9}  {}".format(
+        'target', 'runs', 'first s', 'median s', 'requests', 'MB recv', 'series', 'MB rss', 'error'))
+    for result in results:
+        runs = result['runs']
+        print("{:<16} {:>5} {:>9} {:>9} {:>9} {:>10} {:>9} {:>9.1f}  {}".format(
+            result['target'], len(runs),
+            "{:.3f}".format(runs[0]['seconds']) if runs else '-',
+            "{:.3f}".format(_median(result)) if runs else '-',
+            runs[0]['requests'] if runs else '-',
+            "{:.1f}".format(runs[0]['bytes'] / 1024 / 1024) if runs else '-',
+            runs[-1]['series'] if runs else '-',
+            result['peak_rss'] / 1024 / 1024, result['error'] or ''))
+
+def compare(results, baseline, tolerance) -> list:
+    """
+    Compares the results to a baseline
+
+    Parameters
+    ----------
+    results
+        The results of the benchmarks
+    baseline
+        The results of an earlier run, as written by --output
+    tolerance
+        Share the median time and peak memory may exceed the baseline
+
+    Returns
+    -------
+    List of the regressions found, as text
+    """
+
+    regressions = []
+    previous = {result['target']: result for result in baseline['results']}
+    for result in results:
+        base = previous.get(result['target'])
+        if base is None or not base['runs']:
+            continue
+        if not result['runs'] or result['error']:
+            regressions.append("{} failed: {}".format(result['target'], result['error']))
+            continue
+
+        checks = (
+            ("median seconds", _median(result), _median(base) * (1 + tolerance)),
+            ("peak RSS MB", result['peak_rss'] / 1024 / 1024, base['peak_rss'] / 1024 / 1024 * (1 + tolerance)),
+            ("requests", result['runs'][0]['requests'], base['runs'][0]['requests']),
+        )
+        for name, value, limit in checks:
+            if value > limit:
+                regressions.append("{} {} {:.4g} exceeds {:.4g}".format(result['target'], name, value, limit))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the collectors against the mock Cloud One API "
+                                                 "or a recording")
+    parser.add_argument('targets', nargs='*',
+                        help="Collectors to benchmark, defaults to all Cloud One collectors, "
+                             "and '{}' for a full run".format(FULL_RUN))
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per target")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--log-level', default='WARNING', help="Level of the api-collector's logging")
+    parser.add_argument('--replay', help="Replay the recording in this directory instead of using the mock")
+    parser.add_argument('--replay-timing', choices=('original', 'fast'), default='fast',
+                        help="Delay the replayed responses by their recorded time or not")
+    parser.add_argument('--baseline', help="Fail if the results regressed against this earlier --output")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Share the median time and peak memory may exceed the baseline")
+    mock_api.add_arguments(parser)
+    args = parser.parse_args()
+
+    paths = collector_paths()
+    targets = args.targets or sorted(name for name in paths if name not in _EXCLUDED) + [FULL_RUN]
+    unknown = [target for target in targets if target != FULL_RUN and target not in paths]
+    if unknown:
+        parser.error("Unknown collectors: {}".format(", ".join(unknown)))
+    full_run = [paths[target] for target in targets if target != FULL_RUN] \
+        or [path for name, path in paths.items() if name not in _EXCLUDED]
+
+    server, mock_url = None, None
+    if args.replay:
+        os.environ['API_COLLECTOR_HTTP_REPLAY'] = os.path.abspath(args.replay)
+        os.environ['API_COLLECTOR_HTTP_REPLAY_TIMING'] = args.replay_timing
+    else:
+        context = multiprocessing.get_context('spawn')
+        ready = context.SimpleQueue()
+        server = context.Process(target=mock_api.serve, args=(args, 0, ready), name='mock_api', daemon=True)
+        server.start()
+        mock_url = "http://127.0.0.1:{}".format(ready.get())
+
+    try:
+        results = []
+        for target in targets:
+            print("Benchmarking {}".format(target), file=sys.stderr)
+            target_paths = full_run if target == FULL_RUN else [paths[target]]
+            results.append(benchmark(target, target_paths, mock_url, args.repeat, args.log_level))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    report(results)
+    if args.output:
+        options = {name: value for name, value in vars(args).items()
+                   if name not in ('targets', 'output', 'baseline')}
+        with open(args.output, 'w') as file:
+            json.dump({"options": options, "results": results}, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
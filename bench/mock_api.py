@@ -0,0 +1,493 @@
+"""Mock Cloud One API
+
+This module serves a synthetic Cloud One account, so the collectors can
+be measured without a live tenant. The account is generated from a seed
+at a configurable scale, e.g. 100k computers or 1M events, and the same
+seed always yields the same account. The following endpoints are served:
+
+POST /api/computers/search, /api/intrusionpreventionrules/search
+    Workload Security searches, paged by their ID criteria and maxItems
+GET /api/computers, /api/intrusionpreventionrules
+    All computers or IPS rules at once
+GET /api/events/evaluations, /api/events/sensors
+    Container Security events between fromTime and toTime, paged by the
+    next cursor and limit
+GET /api/statistics/scans, /api/stacks
+    File Storage Security statistics and stacks
+GET /accounts/groups
+    Application Security groups
+GET /_mock/requests
+    The requests served so far by path, ?reset=1 resets them
+
+The events occur at a constant rate, --events within every 5 minutes,
+so consecutive time windows overlap consistently. Every request can be
+delayed by an injected latency, and requests exceeding --rate per second
+are throttled with a 429 and a Retry-After.
+
+The api-collector sends it's requests to the mock if the environment
+variable API_COLLECTOR_HTTP_REDIRECT is set to it's URL, see
+benchmark.py. The mock can be run on it's own as well:
+
+    python3 bench/mock_api.py --port 8780 --computers 100000 --latency 0.05
+"""
+
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import functools
+from collections import Counter
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Length of the time window --events occur in
+EVENT_WINDOW_SECONDS = 300
+
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+_PLATFORMS = ("Amazon Linux 2 (64 bit) (4.14.256-197.484.amzn2.x86_64)",
+              "Ubuntu Linux 20.04 (64 bit) (5.11.0-1022-aws)",
+              "Red Hat Enterprise 8 (64 bit) (4.18.0-348.el8.x86_64)",
+              "Microsoft Windows Server 2019 (64 bit) Build 17763")
+_AGENT_VERSIONS = ("20.0.0-3771", "20.0.0-3445", "20.0.0-2971", "12.0.0-1908")
+_AGENT_STATUS = ("active", "active", "active", "warning", "error", "inactive")
+_UPDATE_STATUS = ("Up to date", "Up to date", "Out of date", "Update in progress")
+_CLOUDS = ("ec2VirtualMachineSummary", "azureARMVirtualMachineSummary", "gcpVirtualMachineSummary", None)
+_ROLES = ("web", "api", "db", "cache", "worker", "batch", "gateway")
+_REGIONS = ("eu-central-1", "us-east-1", "us-west-2", "ap-southeast-1")
+_SEVERITIES = ("low", "medium", "medium", "high", "critical")
+_RULE_TYPES = ("vulnerability", "exploit", "smart", "policy")
+_CLUSTERS = ("playground", "staging", "production-eu", "production-us")
+_POLICIES = ("relaxed", "default", "strict")
+_NAMESPACES = ("default", "kube-system", "payments", "checkout", "search", "monitoring")
+_KINDS = ("Pod", "Deployment", "ReplicaSet", "DaemonSet", "Job")
+_OPERATIONS = ("create", "update")
+_DECISIONS = ("allow", "deny")
+_MITIGATIONS = ("log", "isolate", "terminate")
+_REASONS = ("unscannedImage", "vulnerabilities", "malware", "secrets", "privileged", "runAsRoot")
+_SENSOR_RULES = (("TM-00000001", "Terminal in container"), ("TM-00000006", "Write below etc"),
+                 ("TM-00000010", "Launch package management process in container"),
+                 ("TM-00000024", "Contact K8S API server from container"))
+_SETTINGS = ("credential_stuffing", "file_access", "ip_protection", "malicious_file_upload",
+             "malicious_payload", "rce", "redirect", "sqli")
+
+def _mix(value) -> int:
+    """Returns a well mixed 64 bit hash of an integer (splitmix64)"""
+
+    value = (value + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return value ^ (value >> 31)
+
+def _pick(choices, value, shift):
+    return choices[(value >> shift) % len(choices)]
+
+class Tenant():
+    """
+    This class represents the synthetic Cloud One account
+
+    Methods
+    -------
+    search
+        Returns a page of a Workload Security search
+    events
+        Returns a page of Container Security events
+    statistics, stacks, groups
+        Return the File Storage and Application Security responses
+    """
+
+    def __init__(self, computers=1000, rules=5000, rules_per_computer=100, events=10000,
+                 pods=500, stacks=10, groups=10, seed=0):
+        """
+        Parameters
+        ----------
+        computers
+            Number of Workload Security computers
+        rules
+            Number of IPS rules
+        rules_per_computer
+            Average number of IPS rules assigned to a computer
+        events
+            Events of each kind within every 5 minutes
+        pods
+            Number of distinct pods the events originate from
+        stacks
+            Number of File Storage Security stacks
+        groups
+            Number of Application Security groups
+        seed
+            Seed the account is generated from
+        """
+
+        self.computers = computers
+        self.rules = rules
+        self.rules_per_computer = rules_per_computer
+        self.rate = events / EVENT_WINDOW_SECONDS
+        self.stacks_count = stacks
+        self.groups_count = groups
+        self.seed = seed
+        self.created = int(time.time() * 1000)
+
+        rng = random.Random(seed)
+        self.pods = tuple("{}-{}-{:x}-{}".format(
+            rng.choice(_ROLES), rng.choice(("frontend", "backend", "consumer", "exporter")),
+            rng.getrandbits(36), "".join(rng.choice("bcdfghjklmnpqrstvwxz2456789") for _ in range(5)))
+            for _ in range(max(pods, 1)))
+
+    @functools.lru_cache(maxsize=None)
+    def computer(self, computer_id) -> bytes:
+        """Returns a computer as encoded JSON"""
+
+        rng = random.Random(self.seed * 1000003 + computer_id)
+        computer = {
+            "ID": computer_id,
+            "hostName": "ip-10-{}-{}-{}.internal".format(computer_id >> 16 & 255, computer_id >> 8 & 255,
+                                                         computer_id & 255),
+            "displayName": "{}-{}-{:06d}".format(rng.choice(_ROLES), rng.choice(_REGIONS), computer_id),
+            "platform": rng.choice(_PLATFORMS),
+            "agentVersion": rng.choice(_AGENT_VERSIONS),
+            "lastIPUsed": "10.{}.{}.{}".format(computer_id >> 16 & 255, computer_id >> 8 & 255, computer_id & 255),
+            "computerStatus": {"agentStatus": rng.choice(_AGENT_STATUS)},
+            "intrusionPrevention": {"state": rng.choice(("prevent", "prevent", "detect", "off"))},
+        }
+        if rng.random() < 0.8:
+            computer['securityUpdates'] = {"updateStatus": {"statusMessage": rng.choice(_UPDATE_STATUS)}}
+        cloud = rng.choice(_CLOUDS)
+        if cloud is not None:
+            computer[cloud] = {"state": rng.choice(("running", "running", "stopped"))}
+        if computer['intrusionPrevention']['state'] != "off" and self.rules > 0:
+            count = min(self.rules, rng.randint(0, 2 * self.rules_per_computer))
+            computer['intrusionPrevention']['ruleIDs'] = sorted(rng.sample(range(1, self.rules + 1), count))
+        return json.dumps(computer).encode('utf-8')
+
+    @functools.lru_cache(maxsize=None)
+    def rule(self, rule_id) -> bytes:
+        """Returns an IPS rule as encoded JSON"""
+
+        value = _mix(self.seed * 1000003 + rule_id)
+        rule = {
+            "ID": rule_id,
+            "name": "{:07d} - Synthetic Rule {}".format(1000000 + rule_id, rule_id),
+            "priority": _pick(("lowest", "low", "normal", "high", "highest"), value, 0),
+            "severity": _pick(_SEVERITIES, value, 8),
+            "type": _pick(_RULE_TYPES, value, 16),
+            "detectOnly": value >> 24 & 1 == 1,
+            "lastUpdated": self.created,
+        }
+        return json.dumps(rule).encode('utf-8')
+
+    def search(self, resource, criteria=(), max_items=5000) -> bytes:
+        """
+        Returns a page of a Workload Security search as encoded JSON
+
+        Parameters
+        ----------
+        resource
+            computers or intrusionpreventionrules
+        criteria
+            The searchCriteria, only ID and lastUpdated criteria are
+            evaluated
+        max_items
+            Items per page
+        """
+
+        if resource == 'computers':
+            key, count, item = 'computers', self.computers, self.computer
+        else:
+            key, count, item = 'intrusionPreventionRules', self.rules, self.rule
+
+        first, last = 1, count
+        for criterion in criteria:
+            if criterion.get('fieldName') == 'ID':
+                if criterion.get('idTest') == 'greater-than':
+                    first = max(first, int(criterion['idValue']) + 1)
+                elif criterion.get('idTest') == 'less-than':
+                    last = min(last, int(criterion['idValue']) - 1)
+            elif criterion.get('fieldName') == 'lastUpdated' and resource != 'computers':
+                # the rules were last updated when the account was created
+                if criterion.get('firstDate', 0) > self.created:
+                    last = 0
+
+        ids = range(first, min(last, first + max_items - 1) + 1)
+        return b'{"' + key.encode('utf-8') + b'": [' + b','.join(item(i) for i in ids) + b']}'
+
+    def events(self, kind, from_time, to_time, cursor='', limit=25) -> dict:
+        """
+        Returns a page of Container Security events
+
+        Parameters
+        ----------
+        kind
+            evaluations or sensors
+        from_time, to_time
+            Time range of the events as seconds since the epoch
+        cursor
+            Cursor of the page, empty for the first one
+        limit
+            Events per page
+        """
+
+        # the events are numbered by their time, event i occurs at i / rate
+        end = math.ceil(to_time * self.rate)
+        first = int(cursor) if cursor else math.ceil(from_time * self.rate)
+        last = min(end, first + max(limit, 1))
+
+        events = [self._event(kind, index) for index in range(first, last)]
+        return {"events": events, "next": str(last) if last < end else ""}
+
+    def _event(self, kind, index) -> dict:
+        value = _mix(self.seed * 1000003 + index)
+        timestamp = datetime.fromtimestamp(index / self.rate, timezone.utc)
+        event = {
+            "timestamp": timestamp.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(timestamp.microsecond // 1000),
+            "clusterName": _pick(_CLUSTERS, value, 0),
+            "policyName": _pick(_POLICIES, value, 4),
+            "mitigation": _pick(_MITIGATIONS, value, 8),
+        }
+        if kind == 'sensors':
+            rule_id, name = _pick(_SENSOR_RULES, value, 12)
+            # a few pods cause most of the events
+            pod = self.pods[int(len(self.pods) * ((value >> 20 & 0xFFFF) / 0x10000) ** 3)]
+            event.update({
+                "k8s.pod.name": pod,
+                "k8s.ns.name": _pick(_NAMESPACES, value, 40),
+                "name": name,
+                "ruleID": rule_id,
+                "severity": _pick(("low", "medium", "high", "critical"), value, 44),
+            })
+        else:
+            event.update({
+                "operation": _pick(_OPERATIONS, value, 12),
+                "kind": _pick(_KINDS, value, 16),
+                "namespace": _pick(_NAMESPACES, value, 20),
+                "decision": _pick(_DECISIONS, value, 24),
+                "reasons": [{"type": _pick(_REASONS, value, 28 + 4 * i)} for i in range((value >> 48 & 3) % 3)],
+            })
+        return event
+
+    def statistics(self) -> dict:
+        rng = random.Random(self.seed)
+        return {"statistics": [{"scans": rng.randint(0, 10000), "detections": rng.randint(0, 10)}
+                               for _ in range(24)]}
+
+    def stacks(self) -> dict:
+        return {"stacks": [{"stackID": "stack-{}".format(i), "type": ("scanner", "storage")[i % 2]}
+                           for i in range(self.stacks_count)]}
+
+    def groups(self) -> list:
+        rng = random.Random(self.seed)
+        return [{"name": "group-{}".format(i),
+                 "settings": {setting: rng.choice(("disable", "report", "mitigate")) for setting in _SETTINGS}}
+                for i in range(self.groups_count)]
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    This class represents the request handler of the mock API
+
+    The tenant, latency and throttling are set on the MockServer.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # the headers and body are written separately, with Nagle's algorithm
+    # every response on a kept alive connection would wait for an ACK
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self._handle()
+
+    def do_POST(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = self.rfile.read(length) if length else b''
+
+        if url.path == '/_mock/requests':
+            self._send(200, self.server.stats(query.get('reset') == '1'))
+            return
+
+        if not self.server.admit():
+            self._send(429, {"message": "Too many requests"}, {'Retry-After': '1'})
+            return
+        self.server.delay()
+
+        tenant = self.server.tenant
+        try:
+            if url.path in ('/api/computers/search', '/api/intrusionpreventionrules/search'):
+                data = json.loads(body or b'{}')
+                output = tenant.search(url.path.split('/')[2], data.get('searchCriteria', ()),
+                                       int(data.get('maxItems', 5000)))
+            elif url.path in ('/api/computers', '/api/intrusionpreventionrules'):
+                output = tenant.search(url.path.split('/')[2], max_items=tenant.computers + tenant.rules)
+            elif url.path in ('/api/events/evaluations', '/api/events/sensors'):
+                output = tenant.events(url.path.split('/')[3], _timestamp(query['fromTime']),
+                                       _timestamp(query['toTime']), query.get('next', ''),
+                                       int(query.get('limit', 25)))
+            elif url.path == '/api/statistics/scans':
+                output = tenant.statistics()
+            elif url.path == '/api/stacks':
+                output = tenant.stacks()
+            elif url.path == '/accounts/groups':
+                output = tenant.groups()
+            else:
+                self._send(404, {"message": "Not found"})
+                return
+        except (KeyError, ValueError) as err:
+            self._send(400, {"message": "Bad request: {}".format(err)})
+            return
+
+        size = self._send(200, output)
+        self.server.count(url.path, size)
+
+    def _send(self, status, output, headers=None) -> int:
+        if not isinstance(output, bytes):
+            output = json.dumps(output).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(output)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(output)
+        return len(output)
+
+    def log_message(self, format, *args):
+        """Log nothing."""
+
+def _timestamp(value) -> float:
+    return datetime.strptime(value, _TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+class MockServer(ThreadingHTTPServer):
+    """
+    This class represents the mock API server
+
+    Methods
+    -------
+    admit
+        Tells if a request is within the rate, otherwise it is throttled
+    delay
+        Waits for the injected latency
+    count
+        Counts a served request
+    stats
+        Returns the requests served so far
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, tenant, latency=0.0, jitter=0.0, rate=0.0):
+        """
+        Parameters
+        ----------
+        address
+            (host, port) to listen on, port 0 for any free one
+        tenant
+            The Tenant served
+        latency
+            Seconds every request is delayed
+        jitter
+            Seconds every request is delayed additionally at most
+        rate
+            Requests per second served at most, 0 for unlimited
+        """
+
+        super().__init__(address, MockHandler)
+        self.tenant = tenant
+        self._latency = latency
+        self._jitter = jitter
+        self._rate = rate
+        self._allowance = rate
+        self._updated = time.monotonic()
+        self._requests = Counter()
+        self._throttled = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def admit(self) -> bool:
+        if self._rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(max(self._rate, 1), self._allowance + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._allowance < 1:
+                self._throttled += 1
+                return False
+            self._allowance -= 1
+            return True
+
+    def delay(self):
+        seconds = self._latency + random.uniform(0, self._jitter)
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def count(self, path, size):
+        with self._lock:
+            self._requests[path] += 1
+            self._bytes += size
+
+    def stats(self, reset=False) -> dict:
+        with self._lock:
+            stats = {
+                "requests": sum(self._requests.values()),
+                "throttled": self._throttled,
+                "bytes": self._bytes,
+                "paths": dict(self._requests),
+            }
+            if reset:
+                self._requests.clear()
+                self._throttled = 0
+                self._bytes = 0
+            return stats
+
+def add_arguments(parser):
+    """Adds the options of the mock API to an ArgumentParser"""
+
+    group = parser.add_argument_group('mock API')
+    group.add_argument('--computers', type=int, default=1000, help="Workload Security computers")
+    group.add_argument('--rules', type=int, default=5000, help="IPS rules")
+    group.add_argument('--rules-per-computer', type=int, default=100, help="IPS rules assigned per computer on average")
+    group.add_argument('--events', type=int, default=10000, help="Container Security events of each kind per 5 minutes")
+    group.add_argument('--pods', type=int, default=500, help="Pods the events originate from")
+    group.add_argument('--stacks', type=int, default=10, help="File Storage Security stacks")
+    group.add_argument('--groups', type=int, default=10, help="Application Security groups")
+    group.add_argument('--seed', type=int, default=0, help="Seed the account is generated from")
+    group.add_argument('--latency', type=float, default=0.0, help="Seconds every request is delayed")
+    group.add_argument('--jitter', type=float, default=0.0, help="Seconds every request is delayed additionally at most")
+    group.add_argument('--rate', type=float, default=0.0, help="Requests per second before throttling, 0 for unlimited")
+
+def serve(args, port=0, ready=None):
+    """
+    Runs the mock API server until the process is terminated
+
+    Parameters
+    ----------
+    args
+        The options parsed by add_arguments
+    port
+        Port to listen on, 0 for any free one
+    ready
+        Optional queue the port is put into once the server listens
+    """
+
+    tenant = Tenant(args.computers, args.rules, args.rules_per_computer, args.events,
+                    args.pods, args.stacks, args.groups, args.seed)
+    server = MockServer(('127.0.0.1', port), tenant, args.latency, args.jitter, args.rate)
+    if ready is not None:
+        ready.put(server.server_address[1])
+    server.serve_forever()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves a synthetic Cloud One account")
+    parser.add_argument('--port', type=int, default=8780, help="Port to listen on")
+    add_arguments(parser)
+    args = parser.parse_args()
+    print("Serving the mock API on http://127.0.0.1:{}".format(args.port))
+    serve(args, args.port)
@@ -0,0 +1,89 @@
+"""Redaction Check
+
+This script checks the sanitizing of recorded responses, see the
+http_replay module, on a sample Workload Security computer. It fails if
+any of the host names, addresses or account and instance IDs of the
+computer is written to the recording, or if values the collectors count
+by, like the platform or agent version, are changed.
+
+    python3 bench/redaction.py
+
+The names to pseudonymize are taken from API_COLLECTOR_HTTP_RECORD_REDACT
+like when recording.
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import http_replay
+
+COMPUTER = {
+    "hostName": "ip-10-0-12-34.eu-central-1.compute.internal",
+    "displayName": "payment-gateway-1",
+    "description": "Payment gateway of acme.example.com",
+    "lastIPUsed": "10.0.12.34",
+    "platform": "Amazon Linux 2 (64 bit) (4.14.256-197.484.amzn2.x86_64)",
+    "agentVersion": "20.0.0-3771",
+    "policyID": 12,
+    "ID": 4711,
+    "computerStatus": {"agentStatus": "active", "agentStatusMessages": ["Managed (Online)"]},
+    "ec2VirtualMachineSummary": {
+        "accountID": "123456789012",
+        "instanceID": "i-0a1b2c3d4e5f60718",
+        "amiID": "ami-0abcdef1234567890",
+        "region": "eu-central-1",
+        "availabilityZone": "eu-central-1a",
+        "publicIPAddress": "3.120.45.67",
+        "privateIPAddress": "10.0.12.34",
+        "publicDNSName": "ec2-3-120-45-67.eu-central-1.compute.amazonaws.com",
+        "privateDNSName": "ip-10-0-12-34.eu-central-1.compute.internal",
+    },
+    "interfaces": {
+        "interfaces": [
+            {"name": "eth0", "MAC": "02:42:ac:11:00:02", "IPs": ["10.0.12.34", "fe80::42:acff:fe11:2/64"]},
+            {"name": "eth1", "MAC": "02:42:ac:11:00:03", "IPs": ["172.31.5.6/20"]},
+        ],
+    },
+}
+
+# values which must not be recorded
+SENSITIVE = (
+    "ip-10-0-12-34", "payment-gateway-1", "acme.example.com", "10.0.12.34", "123456789012",
+    "i-0a1b2c3d4e5f60718", "3.120.45.67", "ec2-3-120-45-67", "fe80::42:acff:fe11:2", "172.31.5.6",
+    "02:42:ac:11:00:02",
+)
+
+# values the collectors count by, which must be recorded unchanged
+KEPT = (
+    ("platform",), ("agentVersion",), ("policyID",), ("ID",), ("computerStatus", "agentStatus"),
+    ("ec2VirtualMachineSummary", "region"),
+)
+
+def main():
+    with tempfile.TemporaryDirectory(prefix='api-collector-redaction-') as directory:
+        recorder = http_replay.Recorder(directory)
+        body = json.dumps({"computers": [COMPUTER]}).encode('utf-8')
+        recorded = recorder._sanitize(body, 'application/json').decode('utf-8')
+
+    errors = ["{} recorded".format(value) for value in SENSITIVE if value in recorded]
+    computer = json.loads(recorded)['computers'][0]
+    for path in KEPT:
+        original, value = COMPUTER, computer
+        for name in path:
+            original, value = original[name], value[name]
+        if value != original:
+            errors.append("{} changed from {} to {}".format('.'.join(path), original, value))
+
+    print(json.dumps(computer, indent=2))
+    for error in errors:
+        print("Failed: {}".format(error))
+    if errors:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
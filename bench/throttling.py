@@ -0,0 +1,111 @@
+"""Throttling Check
+
+This script checks the adaptive rate control of the shared HTTP client,
+see the rate_limit module, against the mock Cloud One API throttling the
+requests exceeding a rate with a 429 and a Retry-After. Concurrent
+requests are sent through the client while the limit of requests in
+flight to the mock is sampled.
+
+    python3 bench/throttling.py --rate 20 --latency 0.05 --requests 400 --threads 20
+
+The check fails unless
+
+    - every request succeeded, the throttled ones within their retries
+    - the limit adapted, i.e. dropped below the configured concurrency
+    - the limit settled, i.e. in the second half of the run it stayed
+      within the band additive increase and halving keep it in, the mock
+      throttled few of the requests and served at least half of it's rate
+
+The client is configured by the api-collector's environment variables,
+e.g. API_COLLECTOR_HTTP_CONCURRENCY or API_COLLECTOR_HTTP_RETRIES.
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import mock_api
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import http_client
+
+def sample(server, controller, interval, stopped, samples):
+    """Appends (seconds, limit, served, throttled) to samples until stopped"""
+
+    start = time.monotonic()
+    while not stopped.wait(interval):
+        stats = server.stats()
+        samples.append((time.monotonic() - start, controller.limit, stats['requests'], stats['throttled']))
+
+def main():
+    parser = argparse.ArgumentParser(description="Checks the adaptive rate control against a throttling mock API")
+    parser.add_argument('--rate', type=float, default=20, help="Requests per second the mock serves")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds every request is delayed")
+    parser.add_argument('--requests', type=int, default=400, help="Requests sent")
+    parser.add_argument('--threads', type=int, default=20, help="Threads sending the requests")
+    parser.add_argument('--max-throttled', type=float, default=0.15,
+                        help="Share of the requests the mock may throttle in the second half of the run")
+    args = parser.parse_args()
+
+    tenant = mock_api.Tenant(computers=10, rules=10, rules_per_computer=1, events=10,
+                             pods=1, stacks=1, groups=1, seed=0)
+    server = mock_api.MockServer(('127.0.0.1', 0), tenant, args.latency, 0.0, args.rate)
+    threading.Thread(target=server.serve_forever, name='mock_api', daemon=True).start()
+    url = "http://127.0.0.1:{}/api/stacks".format(server.server_address[1])
+
+    client = http_client.get_client()
+    controller = client.controller(url)
+    concurrency = controller.limit
+
+    samples, stopped = [], threading.Event()
+    sampler = threading.Thread(target=sample, args=(server, controller, 0.1, stopped, samples), daemon=True)
+    sampler.start()
+
+    def send(_):
+        try:
+            return client.get(url).status_code
+        except Exception as err:
+            return "{}: {}".format(type(err).__name__, err)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(args.threads) as executor:
+        results = list(executor.map(send, range(args.requests)))
+    seconds = time.monotonic() - start
+    stopped.set()
+    sampler.join()
+    server.shutdown()
+
+    failed = [result for result in results if result != 200]
+    half = [entry for entry in samples if entry[0] >= samples[-1][0] / 2] or samples[-1:]
+    served = half[-1][2] - half[0][2]
+    throttled = half[-1][3] - half[0][3]
+    elapsed = max(half[-1][0] - half[0][0], 1e-9)
+    limits = [entry[1] for entry in half]
+
+    print("{} requests in {:.1f}s, {} throttled in total".format(args.requests, seconds, samples[-1][3]))
+    print("second half: {:.1f} requests/s served, {} throttled, limit between {:.1f} and {:.1f} of {:.0f}".format(
+        served / elapsed, throttled, min(limits), max(limits), concurrency))
+
+    errors = []
+    if failed:
+        errors.append("{} requests failed, e.g. {}".format(len(failed), failed[0]))
+    if min(entry[1] for entry in samples) >= concurrency:
+        errors.append("the limit never dropped below {:.0f}".format(concurrency))
+    if max(limits) > 2.5 * min(limits):
+        errors.append("the limit varied between {:.1f} and {:.1f} in the second half".format(min(limits), max(limits)))
+    if throttled > args.max_throttled * (served + throttled):
+        errors.append("{} of {} requests throttled in the second half".format(throttled, served + throttled))
+    if served / elapsed < args.rate / 2:
+        errors.append("only {:.1f} requests/s served in the second half".format(served / elapsed))
+
+    for error in errors:
+        print("Failed: {}".format(error))
+    if errors:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
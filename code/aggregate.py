@@ -0,0 +1,180 @@
+"""Group-By Aggregation
+
+This module counts items, e.g. API events, grouped by their label values.
+The groups are keyed by tuples of the label values, so label values may
+contain any character, and the counts are handed to the api-collector
+column by column without converting them to label lists first.
+
+Batches of label tuples are counted by collections.Counter, which hashes
+the tuples in C. Alternatively, large batches can be counted with NumPy,
+if it is installed. The label values are then encoded column by column
+into integer codes and the distinct rows of codes are counted in one pass.
+The environment variable API_COLLECTOR_NUMPY_BATCH sets the size of a
+batch from which on NumPy is used. It defaults to 0, which disables NumPy,
+since encoding string labels costs more than counting their tuples
+directly. It pays off for label values which are already numeric.
+"""
+
+import os
+import itertools
+from collections import Counter
+import columnar
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_NUMPY_BATCH = int(os.environ.get('API_COLLECTOR_NUMPY_BATCH', 0))
+
+class GroupCounter():
+    """
+    This class represents the counts of items grouped by their labels
+
+    Methods
+    -------
+    add
+        Counts a label tuple
+    update
+        Counts a batch of label tuples
+    feed
+        Counts items by the label tuples extracted from them
+    merge
+        Adds the counts of another GroupCounter
+    items
+        Returns the label tuples and their counts
+    columns
+        Returns the counts as label columns and values
+    to_result
+        Stores the counts as the Columns and Values of a collector result
+    """
+
+    def __init__(self, labels=None):
+        """
+        Parameters
+        ----------
+        labels
+            Optional Callable(item) returning the label tuples an item is
+            counted for, used by feed()
+        """
+
+        self._labels = labels
+        self._counts = Counter()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __getitem__(self, key):
+        return self._counts[key]
+
+    def add(self, key, count=1):
+        self._counts[key] += count
+
+    def update(self, keys):
+        """Counts a batch of label tuples
+
+        Parameters
+        ----------
+        keys
+            Iterable of label tuples of the same length
+        """
+
+        if numpy is not None and _NUMPY_BATCH > 0 and hasattr(keys, '__len__') \
+                and len(keys) >= _NUMPY_BATCH:
+            self._update_numpy(keys)
+        else:
+            self._counts.update(keys)
+
+    def feed(self, items, labels=None):
+        """Counts items by the label tuples extracted from them
+
+        Parameters
+        ----------
+        items
+            Iterable of items, e.g. events
+        labels
+            Callable(item) returning the label tuples of an item, defaults
+            to the one given to the constructor
+        """
+
+        labels = labels or self._labels
+        self.update(list(itertools.chain.from_iterable(map(labels, items))))
+
+    def merge(self, other):
+        self._counts.update(other._counts)
+
+    def items(self):
+        return self._counts.items()
+
+    def columns(self, width) -> tuple:
+        """Returns the counts as label columns and values
+
+        Parameters
+        ----------
+        width
+            Number of labels
+
+        Returns
+        -------
+        (one tuple of label values per label, tuple of counts)
+        """
+
+        if not self._counts:
+            return [() for _ in range(width)], ()
+
+        keys, values = zip(*self._counts.items())
+        return list(zip(*keys)), values
+
+    def to_result(self, result) -> dict:
+        """Stores the counts as the Columns and Values of a collector result
+
+        Parameters
+        ----------
+        result
+            The dictionary returned by the collector, holding the label
+            names of the metric family
+
+        Returns
+        -------
+        The result
+        """
+
+        result['Columns'], result['Values'] = self.columns(len(result['CounterMetricFamilyLabels']))
+        result.pop('Metrics', None)
+        return result
+
+    def _update_numpy(self, keys):
+        # encode every column into integer codes of it's distinct values
+        tables = []
+        codes = numpy.empty((len(keys), len(keys[0])), dtype=numpy.int64)
+        for index, column in enumerate(zip(*keys)):
+            table = {}
+            codes[:, index] = numpy.fromiter(
+                (table.setdefault(value, len(table)) for value in column),
+                dtype=numpy.int64, count=len(keys))
+            tables.append(list(table))
+
+        rows, counts = numpy.unique(codes, axis=0, return_counts=True)
+        for key, count in zip(zip(*(columnar.Interned(table, rows[:, index].tolist())
+                                    for index, table in enumerate(tables))), counts.tolist()):
+            self._counts[key] += count
+
+def count(items, labels) -> GroupCounter:
+    """
+    Counts items grouped by their labels
+
+    Parameters
+    ----------
+    items
+        Iterable of items, e.g. events
+    labels
+        Callable(item) returning the label tuples an item is counted for
+
+    Returns
+    -------
+    The GroupCounter holding the counts
+    """
+
+    counter = GroupCounter(labels)
+    counter.feed(items)
+    return counter
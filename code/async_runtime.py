@@ -0,0 +1,206 @@
+"""Asyncio Collector Runtime
+
+This module runs collectors implementing an async collect() function on
+an event loop shared by all of them. Such a collector can overlap many
+independent API requests, e.g. with asyncio.gather(), instead of waiting
+for each one in turn.
+
+The async HTTP client sends the requests on asyncio streams, see the
+async_transport module, so a collector can have hundreds of requests in
+flight without a thread for each of them. They go through the hooks of
+the shared HttpClient, so they are coalesced with the other requests of
+the run, rate controlled, subject to the circuit breakers and recorded by
+the instrumentation like all others. The requests in flight per host are
+limited by it's RateController, API_COLLECTOR_HTTP_CONCURRENCY, the
+further ones wait as coroutines.
+
+Native async clients like aiohttp or httpx are not used, they would
+bypass these hooks and add a dependency. The requests the async
+transport doesn't cover, e.g. streamed ones, ones through a proxy or all
+of them while recording or replaying, are sent by the shared HttpClient
+on a pool of threads, sized by the environment variable
+API_COLLECTOR_ASYNC_HTTP_WORKERS (default 32).
+"""
+
+import os
+import asyncio
+import functools
+import contextvars
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+import http_replay
+import deadline
+from async_transport import AsyncTransport
+
+_LOGGER = logging.getLogger(__name__)
+
+_HTTP_WORKERS = int(os.environ.get('API_COLLECTOR_ASYNC_HTTP_WORKERS', 32))
+
+class EventLoopThread():
+    """
+    This class represents an event loop running in it's own thread
+
+    Methods
+    -------
+    run
+        Runs a coroutine on the loop and waits for it's result
+    is_alive
+        Tells if the loop is still running
+    stop
+        Stops the loop
+    """
+
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='event_loop', daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine, timeout=None):
+        """Runs a coroutine on the loop and waits for it's result
+
+        Parameters
+        ----------
+        coroutine
+            The coroutine to run
+        timeout
+            Seconds to wait for the result, the coroutine is cancelled
+            if it doesn't complete in time
+
+        Returns
+        -------
+        The result of the coroutine
+        """
+
+        future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        try:
+            return future.result(timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+class AsyncHttpClient():
+    """
+    This class represents the HTTP client for async collectors
+
+    The methods take the same arguments as their counterparts of the
+    HttpClient and return a requests.Response.
+
+    Methods
+    -------
+    request
+        Sends a request
+    get
+        Sends a GET request
+    post
+        Sends a POST request
+    """
+
+    def __init__(self, client, workers=_HTTP_WORKERS):
+        """
+        Parameters
+        ----------
+        client
+            The HttpClient to send the requests with
+        workers
+            Number of threads sending the requests the async transport
+            doesn't cover
+        """
+
+        self._client = client
+        self._transport = AsyncTransport(client.pool_size)
+        # the recording and replay are transport adapters of the client
+        self._native = not (http_replay.RECORD or http_replay.REPLAY)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='async_http')
+
+    async def request(self, method, url, coalesce=None, **kwargs):
+        if self._native and self._transport.supports(http_client.redirect(url), kwargs):
+            return await self._client.request_async(self._send, method, url, coalesce, **kwargs)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, deadline.bind(
+            functools.partial(self._client.request, method, url, coalesce, **kwargs)))
+
+    async def _send(self, method, url, **kwargs):
+        return await self._transport.send(method, http_client.redirect(url), **kwargs)
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+_LOOP = None
+_ASYNC_CLIENT = None
+_LOCK = threading.Lock()
+
+def run(coroutine, timeout=None):
+    """
+    Runs a coroutine on the shared event loop and waits for it's result
+
+    Parameters
+    ----------
+    coroutine
+        The coroutine to run, e.g. the one returned by an async collect()
+    timeout
+        Seconds to wait for the result, at most until the deadline
+
+    Returns
+    -------
+    The result of the coroutine
+    """
+
+    global _LOOP
+    if _LOOP is None or not _LOOP.is_alive():
+        with _LOCK:
+            if _LOOP is None or not _LOOP.is_alive():
+                _LOOP = EventLoopThread()
+
+    # the coroutine is cancelled at the deadline, it's requests are
+    # shortened to it
+    left = deadline.remaining()
+    if left is not None:
+        timeout = left if timeout is None else min(timeout, left)
+    return _LOOP.run(_within(coroutine, contextvars.copy_context()), timeout)
+
+async def _within(coroutine, context):
+    """Runs the coroutine with the context variables of the caller, like
+    the deadline
+
+    A SystemExit or other BaseException raised by the coroutine is turned
+    into a RuntimeError. asyncio would re-raise it out of the loop, which
+    stops the loop shared by all async collectors.
+    """
+
+    for variable, value in context.items():
+        variable.set(value)
+    try:
+        return await coroutine
+    except (Exception, asyncio.CancelledError):
+        raise
+    except BaseException as err:
+        raise RuntimeError(f"Unexpected {err=}, {type(err)=}") from err
+
+def get_async_client() -> AsyncHttpClient:
+    """
+    Returns the AsyncHttpClient shared by all async collectors
+
+    Returns
+    -------
+    The shared AsyncHttpClient, created on first use
+    """
+
+    global _ASYNC_CLIENT
+    if _ASYNC_CLIENT is None:
+        with _LOCK:
+            if _ASYNC_CLIENT is None:
+                _ASYNC_CLIENT = AsyncHttpClient(http_client.get_client())
+    return _ASYNC_CLIENT
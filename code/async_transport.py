@@ -0,0 +1,337 @@
+"""Async HTTP Transport
+
+This module sends HTTP/1.1 requests on asyncio streams, so async
+collectors can have many requests in flight without a thread for each of
+them. The connections are kept alive and pooled per host like the ones
+of the shared HttpClient. The requests are prepared by requests, and the
+responses are returned as requests.Response, so collectors handle them
+like the ones of the shared client.
+
+The transport covers what the Cloud One APIs need: plain and TLS
+connections, Content-Length and chunked bodies, gzip and deflate content
+encodings and redirects. Requests it doesn't cover, e.g. streamed ones
+or ones to be sent through a proxy, are told by supports() and are to be
+sent by the shared HttpClient instead.
+"""
+
+import os
+import ssl
+import zlib
+import asyncio
+import datetime
+import logging
+from urllib.parse import urlsplit, urljoin
+import requests
+from requests.structures import CaseInsensitiveDict
+
+_LOGGER = logging.getLogger(__name__)
+
+# Keyword arguments of requests.request() the transport handles
+SUPPORTED = frozenset(('params', 'data', 'json', 'headers', 'timeout', 'verify', 'allow_redirects'))
+
+# Redirects followed at most, like requests
+MAX_REDIRECTS = 30
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+
+# Bytes a line of the status or the headers may have at most
+_LINE_LIMIT = 65536
+
+class AsyncTransport():
+    """
+    This class represents a pool of keep-alive connections on asyncio
+    streams
+
+    The connections belong to the event loop they were opened on, the
+    transport is to be used from a single loop.
+
+    Methods
+    -------
+    supports
+        Tells if the transport can send a request
+    send
+        Sends a request and returns it's response
+    """
+
+    def __init__(self, pool_size=10):
+        """
+        Parameters
+        ----------
+        pool_size
+            Idle connections kept per host
+        """
+
+        self._pool_size = pool_size
+        self._session = requests.Session()
+        self._idle = {}
+        self._loop = None
+        self._contexts = {}
+
+    def supports(self, url, kwargs) -> bool:
+        """Tells if the transport can send a request
+
+        Parameters
+        ----------
+        url
+            URL of the request
+        kwargs
+            Keyword arguments of the request, as for requests.request()
+        """
+
+        if not SUPPORTED.issuperset(kwargs):
+            return False
+        if urlsplit(url).scheme not in ('http', 'https'):
+            return False
+        proxies = requests.utils.get_environ_proxies(url)
+        return requests.utils.select_proxy(url, proxies) is None
+
+    async def send(self, method, url, timeout=None, verify=True, allow_redirects=None, **kwargs) -> requests.Response:
+        """Sends a request and returns it's response
+
+        Parameters
+        ----------
+        method
+            The HTTP method
+        url
+            URL of the request
+        timeout
+            Timeout in seconds or tuple of the connect and read timeout
+        verify
+            Verify the TLS certificate, or path of the CA bundle to verify
+            it with
+        allow_redirects
+            Follow redirects, defaults to all methods but HEAD
+        kwargs
+            params, data, json and headers, as for requests.request()
+
+        Raises
+        ------
+        requests.exceptions.ConnectTimeout, ReadTimeout, ConnectionError
+            Like the requests sent by requests
+        """
+
+        if allow_redirects is None:
+            allow_redirects = method != 'HEAD'
+        prepared = self._session.prepare_request(requests.Request(method, url, **kwargs))
+        settings = self._session.merge_environment_settings(prepared.url, {}, False, verify, None)
+
+        history = []
+        while True:
+            response = await self._send(prepared, timeout, settings['verify'])
+            if not (allow_redirects and response.status_code in _REDIRECTS and 'Location' in response.headers):
+                break
+            if len(history) >= MAX_REDIRECTS:
+                raise requests.exceptions.TooManyRedirects(
+                    "Exceeded {} redirects".format(MAX_REDIRECTS), response=response)
+            history.append(response)
+            prepared = self._redirect(prepared, response)
+
+        response.history = history
+        return response
+
+    def _redirect(self, prepared, response) -> requests.PreparedRequest:
+        redirected = prepared.copy()
+        redirected.prepare_url(urljoin(prepared.url, response.headers['Location']), None)
+
+        # like requests, a 303 and a redirected POST turn into a GET
+        status = response.status_code
+        if status == 303 and prepared.method != 'HEAD' or status in (301, 302) and prepared.method == 'POST':
+            redirected.method = 'GET'
+            redirected.body = None
+            for name in ('Content-Length', 'Content-Type', 'Transfer-Encoding'):
+                redirected.headers.pop(name, None)
+        if urlsplit(redirected.url).hostname != urlsplit(prepared.url).hostname:
+            redirected.headers.pop('Authorization', None)
+        return redirected
+
+    async def _send(self, prepared, timeout, verify) -> requests.Response:
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        url = urlsplit(prepared.url)
+        key = (url.scheme, url.hostname, url.port or (443 if url.scheme == 'https' else 80),
+               verify if url.scheme == 'https' else None)
+        target = (url.path or '/') + ('?' + url.query if url.query else '')
+
+        body = prepared.body
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        lines = ["{} {} HTTP/1.1".format(prepared.method, target), "Host: {}".format(url.netloc)]
+        lines.extend("{}: {}".format(name, value) for name, value in prepared.headers.items()
+                     if name.lower() != 'host')
+        message = ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + (body or b'')
+
+        start = datetime.datetime.now()
+        reused, reader, writer = await self._connection(key, connect_timeout)
+        try:
+            try:
+                writer.write(message)
+                await _within(writer.drain(), read_timeout)
+                status_line = await _within(reader.readline(), read_timeout)
+                if not status_line:
+                    raise ConnectionResetError("Connection closed by the server")
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if not reused:
+                    raise
+                # the server closed the idle connection, retry on a new one
+                writer.close()
+                reused, reader, writer = await self._connection(key, connect_timeout, reuse=False)
+                writer.write(message)
+                await _within(writer.drain(), read_timeout)
+                status_line = await _within(reader.readline(), read_timeout)
+
+            version, status, reason, headers = await self._read_head(reader, status_line, read_timeout)
+            while status == 100:
+                version, status, reason, headers = await self._read_head(
+                    reader, await _within(reader.readline(), read_timeout), read_timeout)
+            content, keep_alive = await self._read_body(reader, prepared.method, status, headers, read_timeout)
+        except asyncio.TimeoutError as err:
+            writer.close()
+            raise requests.exceptions.ReadTimeout(
+                "Read timed out after {}s: {}".format(read_timeout, prepared.url), request=prepared) from err
+        except (OSError, asyncio.IncompleteReadError, ValueError) as err:
+            writer.close()
+            raise requests.exceptions.ConnectionError(
+                "Connection to {} failed: {}".format(url.netloc, err), request=prepared) from err
+        except BaseException:
+            # cancelled, the response is left unread on the connection
+            writer.close()
+            raise
+
+        keep_alive = keep_alive and version == 'HTTP/1.1' \
+            and headers.get('Connection', '').lower() != 'close'
+        if keep_alive:
+            self._release(key, reader, writer)
+        else:
+            writer.close()
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = headers
+        response._content = _decode(content, headers.get('Content-Encoding', ''))
+        response.url = prepared.url
+        response.request = prepared
+        response.encoding = requests.utils.get_encoding_from_headers(headers)
+        response.elapsed = datetime.datetime.now() - start
+        return response
+
+    async def _connection(self, key, timeout, reuse=True) -> tuple:
+        """Returns (reused, reader, writer) of an idle or a new connection"""
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # the connections of another loop can't be used
+            self._idle = {}
+            self._loop = loop
+
+        idle = self._idle.get(key, [])
+        while reuse and idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return True, reader, writer
+            writer.close()
+
+        scheme, host, port, verify = key
+        try:
+            reader, writer = await _within(asyncio.open_connection(
+                host, port, ssl=self._context(verify) if scheme == 'https' else None,
+                server_hostname=host if scheme == 'https' else None, limit=_LINE_LIMIT), timeout)
+        except asyncio.TimeoutError as err:
+            raise requests.exceptions.ConnectTimeout(
+                "Connection to {}:{} timed out after {}s".format(host, port, timeout)) from err
+        except ssl.SSLError as err:
+            raise requests.exceptions.SSLError("TLS connection to {}:{} failed: {}".format(host, port, err)) from err
+        except OSError as err:
+            raise requests.exceptions.ConnectionError(
+                "Connection to {}:{} failed: {}".format(host, port, err)) from err
+        return False, reader, writer
+
+    def _release(self, key, reader, writer):
+        idle = self._idle.setdefault(key, [])
+        if len(idle) < self._pool_size:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def _context(self, verify) -> ssl.SSLContext:
+        context = self._contexts.get(verify)
+        if context is None:
+            if verify is False:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            elif verify is True:
+                context = ssl.create_default_context(cafile=requests.utils.DEFAULT_CA_BUNDLE_PATH)
+            elif os.path.isdir(verify):
+                context = ssl.create_default_context(capath=verify)
+            else:
+                context = ssl.create_default_context(cafile=verify)
+            self._contexts[verify] = context
+        return context
+
+    async def _read_head(self, reader, status_line, timeout) -> tuple:
+        """Returns the version, status, reason and headers of a response"""
+
+        version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+        if not version.startswith('HTTP/'):
+            raise ValueError("Invalid status line {!r}".format(status_line[:100]))
+
+        headers = CaseInsensitiveDict()
+        while True:
+            line = await _within(reader.readline(), timeout)
+            if line in (b'\r\n', b'\n'):
+                break
+            if not line:
+                raise asyncio.IncompleteReadError(b'', None)
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip(), value.strip()
+            headers[name] = headers[name] + ', ' + value if name in headers else value
+        return version, int(status), reason, headers
+
+    async def _read_body(self, reader, method, status, headers, timeout) -> tuple:
+        """Returns the body of a response and if the connection may be
+        kept alive"""
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            return b'', True
+
+        if 'chunked' in headers.get('Transfer-Encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await _within(reader.readline(), timeout)).split(b';', 1)[0].strip(), 16)
+                if size == 0:
+                    break
+                chunks.append(await _within(reader.readexactly(size), timeout))
+                await _within(reader.readexactly(2), timeout)
+            # skip the trailers
+            while (await _within(reader.readline(), timeout)) not in (b'\r\n', b'\n', b''):
+                pass
+            return b''.join(chunks), True
+
+        length = headers.get('Content-Length')
+        if length is not None:
+            return await _within(reader.readexactly(int(length)), timeout), True
+
+        # delimited by the end of the connection
+        return await _within(reader.read(), timeout), False
+
+async def _within(awaitable, timeout):
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+def _decode(content, encoding) -> bytes:
+    encoding = encoding.lower()
+    if not content or encoding in ('', 'identity'):
+        return content
+    try:
+        if encoding == 'gzip':
+            return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        if encoding == 'deflate':
+            try:
+                return zlib.decompress(content)
+            except zlib.error:
+                return zlib.decompress(content, -zlib.MAX_WBITS)
+    except zlib.error as err:
+        raise requests.exceptions.ContentDecodingError(
+            "Failed to decode the {} encoded body: {}".format(encoding, err)) from err
+    return content
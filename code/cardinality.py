@@ -0,0 +1,144 @@
+"""Cardinality Budget
+
+This module limits the number of series a collector produces. A label
+like the name of a pod or of a computer creates a series for every value,
+in busy environments tens of thousands of short lived ones. The values of
+such labels are ranked by a space-saving sketch, which finds the heaviest
+label combinations in a single pass with a bounded number of counters.
+The top combinations keep their own series, all others are folded into
+series with the label values "other", summing up their values.
+
+Only collectors opting in are folded. A collector declares the labels to
+fold by a module level CARDINALITY_LABELS and may override the budget of
+label combinations set by the environment variable
+API_COLLECTOR_CARDINALITY_BUDGET (default 10000, 0 disables it) by a
+module level CARDINALITY_BUDGET. A collector declaring only the budget
+folds all of it's labels.
+"""
+
+import os
+import heapq
+import itertools
+from aggregate import GroupCounter
+import columnar
+
+CARDINALITY_BUDGET = int(os.environ.get('API_COLLECTOR_CARDINALITY_BUDGET', 10000))
+
+OTHER = "other"
+
+class SpaceSaving():
+    """
+    This class represents a space-saving sketch of the heaviest keys
+
+    The sketch monitors at most k keys. A key which is not monitored
+    replaces the lightest monitored one, inheriting it's count as error.
+    Every key heavier than the total weight divided by k is guaranteed to
+    be monitored.
+
+    Methods
+    -------
+    offer
+        Adds the weight of a key
+    top
+        Returns the monitored keys, heaviest first
+    """
+
+    def __init__(self, k):
+        """
+        Parameters
+        ----------
+        k
+            Number of keys monitored
+        """
+
+        self._k = k
+        self._counts = {}
+        # min-heap of (count, sequence, key), entries outdated by later
+        # offers are skipped when popped
+        self._heap = []
+        self._sequence = itertools.count()
+        self.evicted = 0
+
+    def offer(self, key, weight=1):
+        count = self._counts.get(key)
+        if count is None and len(self._counts) >= self._k:
+            count = self._pop_min()
+            self.evicted += 1
+
+        count = (count or 0) + weight
+        self._counts[key] = count
+        heapq.heappush(self._heap, (count, next(self._sequence), key))
+
+        # drop the outdated entries once they dominate the heap
+        if len(self._heap) > 4 * self._k:
+            self._heap = [(count, next(self._sequence), key) for key, count in self._counts.items()]
+            heapq.heapify(self._heap)
+
+    def top(self) -> list:
+        return sorted(self._counts, key=self._counts.get, reverse=True)
+
+    def _pop_min(self):
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            if self._counts.get(key) == count:
+                del self._counts[key]
+                return count
+
+def apply(response, budget, labels=None) -> tuple:
+    """
+    Folds the series of a collector response exceeding the budget
+
+    Parameters
+    ----------
+    response
+        The dictionary returned by the collector, in either format
+    budget
+        Number of label combinations kept, 0 keeps all
+    labels
+        Names of the labels to fold, defaults to all labels
+
+    Returns
+    -------
+    (the response, number of series folded). If series were folded, the
+    response is a new one holding it's metrics column by column.
+    """
+
+    if budget <= 0 or columnar.size(response) <= budget:
+        return response, 0
+
+    names = response['CounterMetricFamilyLabels']
+    fold = [index for index, name in enumerate(names) if labels is None or name in labels]
+    if not fold:
+        return response, 0
+
+    # rank the combinations of the folded labels by their total value
+    sketch = SpaceSaving(budget)
+    for row, value in columnar.rows(response):
+        sketch.offer(tuple(row[index] for index in fold), abs(value))
+    if not sketch.evicted:
+        return response, 0
+    kept = set(sketch.top())
+
+    folding = set(fold)
+    counter = GroupCounter()
+    folded = 0
+    for row, value in columnar.rows(response):
+        row = tuple(row)
+        if tuple(row[index] for index in fold) not in kept:
+            row = tuple(OTHER if index in folding else label for index, label in enumerate(row))
+            folded += 1
+        counter.add(row, value)
+
+    result = {key: value for key, value in response.items() if key not in ('Metrics', 'Columns', 'Values')}
+    return counter.to_result(result), folded
+
+def budget_of(module) -> int:
+    """Returns the cardinality budget of a collector module
+
+    Collectors declaring neither CARDINALITY_LABELS nor CARDINALITY_BUDGET
+    are not folded, their budget is 0.
+    """
+
+    if not hasattr(module, 'CARDINALITY_LABELS') and not hasattr(module, 'CARDINALITY_BUDGET'):
+        return 0
+    return getattr(module, 'CARDINALITY_BUDGET', CARDINALITY_BUDGET)
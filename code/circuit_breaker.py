@@ -0,0 +1,115 @@
+"""Circuit Breaker
+
+This module stops calling an endpoint which keeps failing. After a number
+of consecutive failures the circuit opens and calls fail fast, without
+waiting for the endpoint to fail again. Once the reset timeout passed,
+the circuit is half open and a single call probes the endpoint. If it
+succeeds, the circuit closes again, otherwise it stays open for another
+reset timeout.
+
+The circuit breakers are configured by environment variables:
+
+API_COLLECTOR_BREAKER_FAILURES
+    Consecutive failures opening a circuit, default 3, 0 disables them
+API_COLLECTOR_BREAKER_RESET
+    Seconds a circuit stays open before it is probed, default 60
+"""
+
+import os
+import time
+import threading
+import logging
+import requests
+
+_LOGGER = logging.getLogger(__name__)
+
+BREAKER_FAILURES = int(os.environ.get('API_COLLECTOR_BREAKER_FAILURES', 3))
+BREAKER_RESET = float(os.environ.get('API_COLLECTOR_BREAKER_RESET', 60))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised for a call failing fast on an open circuit"""
+
+class CircuitBreaker():
+    """
+    This class represents the circuit breaker of an endpoint
+
+    Methods
+    -------
+    allow
+        Tells if a call may be made
+    success
+        Reports a successful call
+    failure
+        Reports a failed call
+    release
+        Reports a call which tells nothing about the endpoint
+    """
+
+    def __init__(self, name, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        """
+        Parameters
+        ----------
+        name
+            Name of the endpoint, used for logging
+        failures
+            Consecutive failures opening the circuit, 0 never opens it
+        reset
+            Seconds the circuit stays open before it is probed
+        """
+
+        self.name = name
+        self.state = CLOSED
+        self._failures = failures
+        self._reset = reset
+        self._count = 0
+        self._opened = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Tells if a call may be made
+
+        While the circuit is half open, only a single probing call is
+        allowed at a time.
+        """
+
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened >= self._reset:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                _LOGGER.info("Closing circuit of {}".format(self.name))
+            self.state = CLOSED
+            self._count = 0
+            self._probing = False
+
+    def release(self):
+        """Reports a call which tells nothing about the endpoint, e.g. one
+        cut short by a deadline. A probing call may be made again.
+        """
+
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self._failures > 0 and self._count >= self._failures):
+                if self.state != OPEN:
+                    _LOGGER.warning("Opening circuit of {} after {} failures".format(self.name, self._count))
+                self.state = OPEN
+                self._opened = time.monotonic()
@@ -5,22 +5,34 @@ available APIs. It uses dependency injection to dynamically add and
 remove metrics collectors located in ./collectors. It uses the
 Prometheus python client for the interaction with Prometheus.
 
-It creates an http server on port 8000, which enables Prometheus to
-scrape the produced metrics.
+It creates an http server on port 8000 (API_COLLECTOR_PORT), which enables Prometheus to
+scrape the produced metrics. With the background scheduler, the output is
+rendered once per snapshot and cached, see the exposition module.
 """
 
 import time
 import os
-import glob
-import inspect
-import importlib
 import ssl
 import requests
+import http_client
+import async_runtime
+import columnar
+import cardinality
+import isolation
+import deadline
+import instrumentation
+import profiling
+from circuit_breaker import CircuitBreaker, CircuitOpenError
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily, REGISTRY
-from prometheus_client import start_http_server
-from prometheus_client import Summary
+from prometheus_client import Summary, Gauge
+from scheduler import CollectorScheduler, CollectorResult
+from plugins import PluginRegistry
+from sharding import Shard
+from exposition import ExpositionCache, start_http_server
+from services import SERVICES, get_service_instance
 
 _LOGGER = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
@@ -31,72 +43,348 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("prometheus_client").setLevel(logging.DEBUG)
 
 COLLECTOR_RUN_TIME = Summary('api_collector_collect_seconds', 'Full collector run seconds')
+COLLECTOR_STALE_SECONDS = Gauge('api_collector_stale_seconds',
+                                'Age of the last good result served for a failing collector, 0 if fresh',
+                                ['collector'])
+COLLECTOR_FOLDED_SERIES = Gauge('api_collector_folded_series',
+                                'Series folded into "other" by the cardinality budget', ['collector'])
 
-class CustomCollector():
+# Size of the worker pool running the collectors concurrently. A value of 1
+# runs the collectors one after the other.
+COLLECTOR_WORKERS = int(os.environ.get('API_COLLECTOR_WORKERS', 4))
+
+# Seconds between two collector runs of the background scheduler. With 0,
+# the collectors are run on every scrape.
+COLLECTOR_INTERVAL = float(os.environ.get('API_COLLECTOR_INTERVAL', 0))
+
+# Seconds between two checks of the collectors directory for added, changed
+# or removed collectors. With 0, the collectors are only loaded once.
+COLLECTOR_RELOAD_INTERVAL = float(os.environ.get('API_COLLECTOR_RELOAD_INTERVAL', 10))
+
+# Seconds a collector run may take at most. Scrapes are limited by the
+# scrape timeout sent by Prometheus as well. With 0, only the latter.
+COLLECTOR_TIMEOUT = float(os.environ.get('API_COLLECTOR_TIMEOUT', 0))
+
+# Port the metrics are served on
+COLLECTOR_PORT = int(os.environ.get('API_COLLECTOR_PORT', 8000))
+
+PLUGINS = PluginRegistry('collectors', 'collectors', COLLECTOR_RELOAD_INTERVAL)
+
+# Collectors assigned to this replica, see the sharding module
+SHARD = Shard()
+
+# Latest result of each collector, used to honour their REFRESH_INTERVAL
+# and served while the collector fails
+_RESULTS = {}
+
+# Circuit breaker of each collector
+_BREAKERS = {}
+
+def run_collector(plugin) -> CollectorResult:
     """
-    This class represents the CustomCollector for Prometheus
+    Call the collect() function of a collector module
 
-    Methods
+    The collect() function may be a coroutine function, it is then run on
+    the shared event loop. A collector module may declare a module level
+    REFRESH_INTERVAL in seconds. It's collect() function is then only
+    called again after the interval has passed, in between the cached
+    result is returned. Collectors declaring CARDINALITY_LABELS or
+    CARDINALITY_BUDGET have the series exceeding their budget folded, see
+    the cardinality module.
+
+    If the collector fails, it's last good result is served instead.
+    After repeated failures, it's circuit opens and the last good result
+    is served without running the collector until a probing run of it
+    succeeds.
+
+    Parameters
+    ----------
+    plugin
+        The Plugin of the collector module
+
+    Returns
     -------
-    collect
-        The collector which injects the custom metrics generators
-        located inside the collectors namespace
+    The CollectorResult holding the metric family of the collector
     """
 
-    def __init__(self):
-        pass
+    collector = plugin.path
+    module = plugin.module
 
-    @COLLECTOR_RUN_TIME.time()
-    def collect(self):
-        """Creates the metrics for Prometheus
+    cached = _RESULTS.get(collector)
+    refresh_interval = getattr(module, 'REFRESH_INTERVAL', 0)
+    if cached is not None and cached.timestamp >= plugin.loaded \
+            and time.time() - cached.timestamp < refresh_interval:
+        _LOGGER.info("Using cached result of collector {}".format(collector))
+        return cached
 
-        Injects the custom metrics generators and provides the metrics
-        via the http server to Prometheus
-        """
+    # fail fast while the circuit of the collector is open
+    breaker = _BREAKERS.setdefault(collector, CircuitBreaker(collector))
+    if not breaker.allow():
+        if cached is None:
+            raise CircuitOpenError("Circuit of {} is open".format(collector))
+        return stale_result(cached)
 
-        _LOGGER.info("Starting Collector Run")
+    _LOGGER.info("Running collector {}".format(collector))
+    try:
+        with instrumentation.collector_run(collector):
+            result = call_collector(plugin)
+    except BaseException as err:
+        left = deadline.remaining()
+        if isinstance(err, deadline.DeadlineExceeded) or (left is not None and left <= 0):
+            # a run cut short by the scrape deadline says nothing about
+            # the collector
+            breaker.release()
+        else:
+            breaker.failure()
+        if cached is None:
+            raise
+        _LOGGER.error(f"Unexpected {err=}, {type(err)=} in {collector}")
+        return stale_result(cached)
+
+    breaker.success()
+    instrumentation.series(collector, len(result.family.samples))
+    COLLECTOR_STALE_SECONDS.labels(collector).set(0)
+    _RESULTS[collector] = result
+    return result
+
+def stale_result(result) -> CollectorResult:
+    """
+    Returns the last good result of a failing collector
+
+    The age of the result is reported by the api_collector_stale_seconds
+    gauge.
+    """
+
+    age = time.time() - result.timestamp
+    _LOGGER.warning("Serving {:.0f}s old result of collector {}".format(age, result.collector))
+    COLLECTOR_STALE_SECONDS.labels(result.collector).set(age)
+    return result
+
+def call_collector(plugin) -> CollectorResult:
+    """
+    Call the collect() function of a collector module and build the
+    metric family of it's response
+
+    Parameters
+    ----------
+    plugin
+        The Plugin of the collector module
+
+    Returns
+    -------
+    The CollectorResult holding the metric family of the collector
+    """
+
+    collector = plugin.path
+    module = plugin.module
 
-        for collector in glob.glob("collectors/*.py"):
-            try:
-                # convert the script file name into it's module name
-                # (hoping it doesn't contain any spaces or dash characters)
-                module_name = "." + os.path.basename(collector).replace('.py', '')
+    # construct a dictionary with the parameter names as keys and the
+    # instance of the service registered by that name, as the value
+    kwargs = {}
+    for name in plugin.parameters:
+        kwargs[name] = get_service_instance(name)
 
-                _LOGGER.info("Running collector {}".format(collector))
+    # call module.collect and build the metric family of it's response.
+    # async collectors are run on the shared event loop, isolated ones in
+    # a worker process
+    timestamp = time.time()
+    if isolation.isolated(plugin):
+        response = isolation.get_pool().run(plugin)
+    elif plugin.coroutine:
+        response = async_runtime.run(module.collect(**kwargs))
+    else:
+        response = module.collect(**kwargs)
 
-                # import the module of that name
-                module = importlib.import_module(module_name, 'collectors')
+    # fold the series exceeding the cardinality budget of the collector
+    response, folded = cardinality.apply(response, cardinality.budget_of(module),
+                                         getattr(module, 'CARDINALITY_LABELS', None))
+    COLLECTOR_FOLDED_SERIES.labels(collector).set(folded)
+    if folded:
+        _LOGGER.info("Folded {} series of collector {}".format(folded, collector))
 
-                # get it's parameter names
-                args = inspect.signature(module.collect).parameters
+    return CollectorResult(collector, build_metric_family(collector, response), timestamp)
 
-                # construct a dictionary with these names as keys and the
-                # instance of the API abstraction class, as the value
-                kwargs = {}
-                for name in args:
-                    kwargs[name] = get_service_instance(name)
+def build_metric_family(collector, response) -> CounterMetricFamily:
+    """
+    Create the CounterMetricFamily from a collector response
 
-                # call module.collect and store the return value in response
-                response = module.collect(**kwargs)
+    Parameters
+    ----------
+    collector
+        Path to the collector script, used for logging
+    response
+        The dictionary returned by the collector, holding it's metrics
+        either as rows in Metrics or as Columns and Values
 
-                cmf = CounterMetricFamily(response['CounterMetricFamilyName'],
-                                        response['CounterMetricFamilyHelpText'],
-                                        labels=response['CounterMetricFamilyLabels'])
+    Returns
+    -------
+    The populated CounterMetricFamily
+    """
 
-                _LOGGER.info("Metrics from collector {} received: {} ".format(collector, len(response["Metrics"])))
+    cmf = CounterMetricFamily(response['CounterMetricFamilyName'],
+                            response['CounterMetricFamilyHelpText'],
+                            labels=response['CounterMetricFamilyLabels'])
 
-                # loop over the the metrics reported
-                for metric in response["Metrics"]:
-                    cmf.add_metric(metric[0], metric[1])
+    _LOGGER.info("Metrics from collector {} received: {} ".format(collector, columnar.size(response)))
+
+    # columnar results are added in bulk
+    if columnar.is_columnar(response):
+        columnar.add_columns(cmf, response['CounterMetricFamilyLabels'],
+                             response['Columns'], response['Values'])
+        return cmf
+
+    # loop over the the metrics reported
+    for metric in response["Metrics"]:
+        cmf.add_metric(metric[0], metric[1])
+
+    return cmf
+
+def run_collectors():
+    """
+    Run all collectors concurrently within a bounded worker pool
 
-                yield cmf
-            except BaseException as err:
-                _LOGGER.error(f"Unexpected {err=}, {type(err)=}")
+    A run takes about as long as the slowest collector. Identical API
+    requests of the collectors are coalesced within the run. Failing
+    collectors are logged and skipped. With multiple replicas, only the
+    collectors assigned to this replica are run.
+
+    The run ends at the deadline of the scrape or the COLLECTOR_TIMEOUT.
+    The requests of the collectors are timed out by then. Collectors
+    still running are abandoned, their last good result is returned if
+    there is one, otherwise they are left out.
+
+    Returns
+    -------
+    Generator of CollectorResults in the order the collectors complete
+    """
+
+    timeout = deadline.remaining()
+    if COLLECTOR_TIMEOUT > 0:
+        timeout = COLLECTOR_TIMEOUT if timeout is None else min(timeout, COLLECTOR_TIMEOUT)
+
+    with COLLECTOR_RUN_TIME.time(), http_client.get_client().coalescing():
+        _LOGGER.info("Starting Collector Run")
+
+        # run only the collectors assigned to this replica
+        plugins = [plugin for plugin in PLUGINS.plugins()
+                   if SHARD.owns(os.path.splitext(os.path.basename(plugin.path))[0])]
+        workers = max(1, min(COLLECTOR_WORKERS, len(plugins)))
+
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='collector')
+        futures = {executor.submit(deadline.bind(run_collector, timeout), plugin): plugin
+                   for plugin in plugins}
+        pending = set(futures)
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                pending.discard(future)
+                collector = futures[future].path
+                try:
+                    yield future.result()
+                except BaseException as err:
+                    _LOGGER.error(f"Unexpected {err=}, {type(err)=} in {collector}")
+        except TimeoutError:
+            for future in pending:
+                plugin = futures[future]
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    yield future.result()
+                    continue
+                future.cancel()
+                cached = _RESULTS.get(plugin.path)
+                if cached is None:
+                    _LOGGER.error("Collector {} missed the deadline".format(plugin.path))
+                else:
+                    _LOGGER.error("Collector {} missed the deadline, using it's last good result".format(plugin.path))
+                    yield stale_result(cached)
+        finally:
+            # don't wait for abandoned collectors
+            executor.shutdown(wait=False, cancel_futures=True)
 
         _LOGGER.info("Collector Run finished")
 
+def profile_collector(name, cpu=True, memory=False, top=25) -> str:
+    """
+    Run a single collector under the profilers
+
+    The run bypasses the cached result and the circuit breaker of the
+    collector and doesn't change them. It is limited by the
+    COLLECTOR_TIMEOUT.
+
+    Parameters
+    ----------
+    name
+        Name of the collector, e.g. ws_ips
+
+    Raises
+    ------
+    KeyError
+        Unknown collector
+
+    Returns
+    -------
+    The report of the profilers, see profiling.profile
+    """
+
+    for plugin in PLUGINS.plugins():
+        if os.path.splitext(os.path.basename(plugin.path))[0] == name:
+            _LOGGER.info("Profiling collector {}".format(plugin.path))
+            with deadline.scope(COLLECTOR_TIMEOUT if COLLECTOR_TIMEOUT > 0 else None):
+                return profiling.profile(lambda: call_collector(plugin), cpu, memory, top)
+    raise KeyError(name)
+
+class CustomCollector():
+    """
+    This class represents the CustomCollector for Prometheus
+
+    Methods
+    -------
+    collect
+        The collector which injects the custom metrics generators
+        located inside the collectors namespace
+    """
+
+    def __init__(self, scheduler=None):
+        """
+        Parameters
+        ----------
+        scheduler
+            Optional CollectorScheduler. If given, scrapes are served from
+            it's latest snapshot instead of running the collectors.
+        """
+
+        self._scheduler = scheduler
+
+    def collect(self):
+        """Creates the metrics for Prometheus
+
+        Injects the custom metrics generators and provides the metrics
+        via the http server to Prometheus. With a background scheduler,
+        only the latest snapshot of the metrics is served.
+        """
+
+        if self._scheduler is not None:
+            yield from self._scheduler.snapshot().collect()
+            return
+
+        for result in run_collectors():
+            yield result.family
+
 if __name__ == '__main__':
-    start_http_server(8000)
-    REGISTRY.register(CustomCollector())
+    _LOGGER.info("Running as {}".format(SHARD))
+    SERVICES.build()
+    PLUGINS.refresh()
+    PLUGINS.start()
+
+    # with the scheduler, the output is rendered once per snapshot
+    collector = CustomCollector()
+    exposition = ExpositionCache(REGISTRY)
+    if COLLECTOR_INTERVAL > 0:
+        scheduler = CollectorScheduler(run_collectors, COLLECTOR_INTERVAL)
+        scheduler.start()
+        collector = CustomCollector(scheduler)
+        exposition = ExpositionCache(REGISTRY, lambda: scheduler.snapshot().generation,
+                                     COLLECTOR_INTERVAL)
+
+    start_http_server(COLLECTOR_PORT, exposition, profile=profile_collector)
+    REGISTRY.register(collector)
     while True:
         time.sleep(1)
@@ -0,0 +1,100 @@
+"""Columnar Collector Results
+
+Besides the list of [labels, value] rows in "Metrics", a collector may
+return it's metrics column by column:
+
+    "Columns": [<LABEL 1 COLUMN>, <LABEL 2 COLUMN>, ...],
+    "Values": [<VALUE 1>, <VALUE 2>, ...]
+
+A column holds the value of it's label for every metric, e.g. as a tuple.
+A column repeating few distinct values may be given interned, as an
+Interned of the distinct values and the index of the value per metric.
+The metric family is then populated in bulk, without a label list per
+metric and a call of add_metric() for each of them.
+"""
+
+from collections import namedtuple
+from prometheus_client.samples import Sample
+
+class Interned(namedtuple('Interned', ['values', 'codes'])):
+    """
+    This class represents an interned label column
+
+    Attributes
+    ----------
+    values
+        The distinct label values
+    codes
+        The index into values for every metric
+    """
+
+    __slots__ = ()
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return map(self.values.__getitem__, self.codes)
+
+def is_columnar(response) -> bool:
+    """Tells if a collector response holds it's metrics column by column"""
+
+    return "Columns" in response
+
+def size(response) -> int:
+    """Returns the number of metrics of a collector response"""
+
+    if is_columnar(response):
+        return len(response["Values"])
+    return len(response["Metrics"])
+
+def rows(response):
+    """
+    Returns the metrics of a collector response row by row
+
+    Parameters
+    ----------
+    response
+        The dictionary returned by the collector, in either format
+
+    Returns
+    -------
+    Iterable of (label values, value) pairs
+    """
+
+    if is_columnar(response):
+        return zip(zip(*(iter(column) for column in response["Columns"])), response["Values"])
+    return ((metric[0], metric[1]) for metric in response["Metrics"])
+
+def add_columns(family, labels, columns, values):
+    """
+    Adds the metrics given by columns to a metric family
+
+    Parameters
+    ----------
+    family
+        The CounterMetricFamily to populate
+    labels
+        The label names of the family
+    columns
+        One column of label values per label name
+    values
+        The metric values
+
+    Raises
+    ------
+    ValueError
+        The columns don't match the label names or the values
+    """
+
+    if len(columns) != len(labels):
+        raise ValueError("Expected {} label columns, got {}".format(len(labels), len(columns)))
+    for label, column in zip(labels, columns):
+        if len(column) != len(values):
+            raise ValueError("Label column {} has {} values, expected {}".format(
+                label, len(column), len(values)))
+
+    name = family.name + '_total'
+    family.samples.extend(
+        Sample(name, dict(zip(labels, row)), value)
+        for row, value in zip(zip(*(iter(column) for column in columns)), values))
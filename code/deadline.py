@@ -0,0 +1,100 @@
+"""Scrape Deadlines
+
+This module passes the deadline of a scrape down to the collectors and
+their API requests. Prometheus sends it's scrape timeout with every
+scrape in the X-Prometheus-Scrape-Timeout-Seconds header. The deadline
+derived from it is kept in a context variable, which the HTTP client
+reads to shorten the timeouts of the requests, so a collector gives up
+in time instead of making the whole scrape time out.
+
+Threads started for a collector don't inherit the context variables,
+their functions are to be wrapped by bind().
+"""
+
+import time
+import contextvars
+from contextlib import contextmanager
+import requests
+
+_DEADLINE = contextvars.ContextVar('deadline', default=None)
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """Raised for a request which can't complete before the deadline"""
+
+def current():
+    """Returns the deadline as time.monotonic() value, None if there is none"""
+
+    return _DEADLINE.get()
+
+def remaining():
+    """Returns the seconds left until the deadline, None if there is none"""
+
+    deadline = _DEADLINE.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+def check():
+    """
+    Raises
+    ------
+    DeadlineExceeded
+        The deadline passed
+    """
+
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("Deadline exceeded by {:.1f}s".format(-left))
+
+def _earliest(timeout):
+    """Returns the earlier of the current deadline and the one in timeout seconds"""
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    outer = _DEADLINE.get()
+    if outer is not None and (deadline is None or outer < deadline):
+        deadline = outer
+    return deadline
+
+@contextmanager
+def scope(timeout):
+    """
+    Sets the deadline while the context is active
+
+    Parameters
+    ----------
+    timeout
+        Seconds from now until the deadline, None for no deadline. An
+        earlier deadline already set is kept.
+    """
+
+    deadline = _earliest(timeout)
+    token = _DEADLINE.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _DEADLINE.reset(token)
+
+def bind(function, timeout=None):
+    """
+    Returns a function bound to the current context, including the
+    deadline, e.g. to run it in another thread
+
+    Parameters
+    ----------
+    function
+        The function to bind
+    timeout
+        Optional seconds from now until the deadline. An earlier deadline
+        already set is kept.
+    """
+
+    deadline = _earliest(timeout)
+    context = contextvars.copy_context()
+
+    def call(*args, **kwargs):
+        _DEADLINE.set(deadline)
+        return function(*args, **kwargs)
+
+    # every call runs in it's own copy, a context can't be entered by
+    # multiple threads at once
+    return lambda *args, **kwargs: context.copy().run(call, *args, **kwargs)
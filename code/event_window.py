@@ -0,0 +1,275 @@
+"""Incremental Event Window
+
+This module ingests events incrementally into a rolling time window. Only
+the events newer than the last ingestion are fetched, they are counted
+into a ring of per-minute buckets. The counts for the whole window are
+computed from the buckets, so consecutive collector runs don't download
+the overlapping part of their windows again.
+
+The buckets keep per-second counts as well. The oldest bucket is usually
+covered only partially by the window, only it's seconds within the window
+are counted, so the window is exact to the second of the event
+timestamps.
+
+Every ingestion counts the events of the half-open range [from, to) of
+their timestamps, so events in the boundary second are counted once,
+whether the API treats the bounds as inclusive or not.
+
+The API may index an event after the second of it's timestamp has been
+ingested already. The next ingestion therefore fetches the overlap before
+the end of the last one again, one bucket by default. The events of the
+overlap are told apart by a digest of their content, the ones counted
+before are skipped. Identical events are told apart by their number, an
+event fetched more often than before is counted the additional times.
+Events indexed later than the overlap are still missed, a longer overlap
+catches them at the cost of fetching it's events again on every update.
+
+The time range and cursor of an ingestion are remembered after every
+page. If an ingestion fails, the next one resumes where it stopped
+without counting an event twice.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from aggregate import GroupCounter
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds before the end of the last ingestion fetched again by the next
+OVERLAP = timedelta(seconds=int(os.environ.get('API_COLLECTOR_EVENT_OVERLAP', 60)))
+
+def _parse_time(value):
+    """Parses an API timestamp like 2022-01-31T12:00:00.123Z"""
+
+    try:
+        return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+    except (TypeError, ValueError):
+        return None
+
+def _digest(event) -> bytes:
+    """Returns the digest of the content of an event"""
+
+    return hashlib.blake2b(json.dumps(event, sort_keys=True, separators=(',', ':')).encode('utf-8'),
+                           digest_size=8).digest()
+
+class EventWindow():
+    """
+    This class represents the rolling window of counted events
+
+    Methods
+    -------
+    update
+        Fetches and counts the events since the last update
+    counts
+        Returns the counts of the events within the window
+    """
+
+    def __init__(self, window=timedelta(minutes=5), bucket=timedelta(minutes=1), clock=None, overlap=None):
+        """
+        Parameters
+        ----------
+        window
+            Length of the window
+        bucket
+            Length of the buckets the window is composed of
+        clock
+            Callable returning the current UTC time, defaults to
+            datetime.utcnow
+        overlap
+            Length of the range before the end of the last ingestion
+            fetched again, defaults to OVERLAP
+        """
+
+        self._window = window
+        self._overlap = OVERLAP if overlap is None else overlap
+        self._bucket = bucket
+        self._clock = clock or datetime.utcnow
+        self._lock = threading.Lock()
+
+        # ring of (bucket start, GroupCounter, {second: GroupCounter}),
+        # oldest first
+        self._buckets = deque()
+
+        # end of the last completed ingestion and the (from, to, cursor)
+        # of an incomplete one
+        self._last_to = None
+        self._pending = None
+        # {digest: (number, second)} of the events counted within the
+        # overlap, and of the ones fetched by an incomplete ingestion
+        self._seen = {}
+        self._fetched = {}
+        # end of the window of the last update
+        self._now = None
+
+    def update(self, fetch_page, labels, now=None):
+        """Fetches and counts the events since the last update
+
+        Parameters
+        ----------
+        fetch_page
+            Callable(from_time, to_time, cursor) returning a tuple of the
+            list of events and the cursor of the next page, which is empty
+            for the last page
+        labels
+            Callable(event) returning the label tuples the event is
+            counted for
+        now
+            End of the window, defaults to the current time
+        """
+
+        now = (now or self._clock()).replace(microsecond=0)
+
+        with self._lock:
+            if self._pending is not None:
+                from_time, to_time, cursor = self._pending
+                _LOGGER.debug("Resuming ingestion of {} to {}".format(from_time, to_time))
+                self._ingest(fetch_page, labels, from_time, to_time, cursor)
+
+            from_time = now - self._window
+            if self._last_to is not None:
+                from_time = max(from_time, self._last_to - self._overlap)
+            if from_time < now:
+                self._ingest(fetch_page, labels, from_time, now, "")
+
+            self._evict(now)
+            self._now = now
+
+    def counts(self, now=None) -> GroupCounter:
+        """Returns the counts of the events within the window
+
+        Parameters
+        ----------
+        now
+            End of the window, defaults to the end of the last update
+
+        Returns
+        -------
+        GroupCounter of the counts by label tuple
+        """
+
+        start = (now or self._now or self._clock()).replace(microsecond=0) - self._window
+
+        with self._lock:
+            counts = GroupCounter()
+            for bucket_start, bucket, seconds in self._buckets:
+                if bucket_start >= start:
+                    counts.merge(bucket)
+                elif bucket_start + self._bucket > start:
+                    # partially covered, count the seconds within the window
+                    for second, second_counts in seconds.items():
+                        if second >= start:
+                            counts.merge(second_counts)
+            return counts
+
+    def _ingest(self, fetch_page, labels, from_time, to_time, cursor):
+        # events of seconds ingested before may have been counted already,
+        # the ones of the overlap before to_time are fetched again next
+        counted_before = self._last_to
+        keep_from = to_time - self._overlap
+        while True:
+            events, cursor = fetch_page(from_time, to_time, cursor)
+
+            # group the events of the page by their second first, so each
+            # second counts it's events as one batch. Events outside of
+            # [from_time, to_time) belong to the previous or next ingestion.
+            batches = {}
+            for event in events:
+                parsed = _parse_time(event.get('timestamp'))
+                timestamp = parsed or to_time - timedelta(seconds=1)
+                if not from_time <= timestamp < to_time:
+                    continue
+                if parsed is None or timestamp >= keep_from \
+                        or counted_before is not None and timestamp < counted_before:
+                    digest = _digest(event)
+                    fetched = self._fetched.setdefault(digest, [0, timestamp])
+                    fetched[0] += 1
+                    if fetched[0] <= self._seen.get(digest, (0, None))[0]:
+                        continue
+                batches.setdefault(timestamp, []).append(event)
+            for second, batch in batches.items():
+                batch_counts = GroupCounter(labels)
+                batch_counts.feed(batch)
+                bucket, seconds = self._bucket_for(self._bucket_start(second))
+                bucket.merge(batch_counts)
+                if second in seconds:
+                    seconds[second].merge(batch_counts)
+                else:
+                    seconds[second] = batch_counts
+
+            if cursor == "":
+                break
+            # remember the progress, the events of this page are counted
+            self._pending = (from_time, to_time, cursor)
+
+        # remember the events of the overlap, merged with the ones counted
+        # before as the number of identical events fetched
+        seen = {digest: entry for digest, entry in self._seen.items() if entry[1] >= keep_from}
+        for digest, (number, second) in self._fetched.items():
+            if second >= keep_from:
+                seen[digest] = (max(number, seen.get(digest, (0, None))[0]), second)
+        self._seen = seen
+        self._fetched = {}
+
+        self._pending = None
+        self._last_to = to_time
+
+    def _bucket_start(self, timestamp) -> datetime:
+        return timestamp - (timestamp - datetime.min) % self._bucket
+
+    def _bucket_for(self, start) -> tuple:
+
+        # events mostly arrive in order, search from the newest bucket
+        for index in range(len(self._buckets) - 1, -1, -1):
+            bucket_start, bucket, seconds = self._buckets[index]
+            if bucket_start == start:
+                return bucket, seconds
+            if bucket_start < start:
+                bucket, seconds = GroupCounter(), {}
+                self._buckets.insert(index + 1, (start, bucket, seconds))
+                return bucket, seconds
+
+        bucket, seconds = GroupCounter(), {}
+        self._buckets.appendleft((start, bucket, seconds))
+        return bucket, seconds
+
+    def _evict(self, now):
+        start = now - self._window
+        while self._buckets and self._buckets[0][0] + self._bucket <= start:
+            self._buckets.popleft()
+
+_WINDOWS = {}
+_WINDOWS_LOCK = threading.Lock()
+
+def get_window(name, window=timedelta(minutes=5), bucket=timedelta(minutes=1), clock=None) -> EventWindow:
+    """
+    Returns the EventWindow of the given name
+
+    The windows are kept across collector runs and reloads of the
+    collector modules.
+
+    Parameters
+    ----------
+    name
+        Name of the window, e.g. the collector and endpoint
+    window
+        Length of the window, used when it is created
+    bucket
+        Length of the buckets, used when it is created
+    clock
+        Callable returning the current UTC time, used when it is created
+
+    Returns
+    -------
+    The EventWindow, created on first use
+    """
+
+    with _WINDOWS_LOCK:
+        event_window = _WINDOWS.get(name)
+        if event_window is None:
+            event_window = _WINDOWS[name] = EventWindow(window, bucket, clock)
+        return event_window
@@ -0,0 +1,211 @@
+"""Cached Metrics Exposition
+
+This module serves the metrics to Prometheus. With the background
+scheduler, the output only changes with the snapshot generation. It is
+therefore rendered once per generation and kept both plain and gzip
+compressed. Every scrape of the same generation, e.g. of multiple
+Prometheus replicas, is answered with the cached bytes. The ETag of the
+output lets clients sending If-None-Match skip unchanged output.
+
+The output is rendered again after max_age seconds even within the same
+generation, so the age of the snapshot reported by it stays accurate if
+the scheduler falls behind. Without the scheduler, the output is rendered
+on every scrape, within the scrape timeout Prometheus sends in the
+X-Prometheus-Scrape-Timeout-Seconds header less a margin of
+API_COLLECTOR_SCRAPE_TIMEOUT_MARGIN seconds (default 0.5).
+"""
+
+import os
+import time
+import gzip
+import hashlib
+import threading
+import logging
+from collections import namedtuple
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import REGISTRY
+import deadline
+import profiling
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds reserved of the scrape timeout for rendering and sending
+_SCRAPE_TIMEOUT_MARGIN = float(os.environ.get('API_COLLECTOR_SCRAPE_TIMEOUT_MARGIN', 0.5))
+
+# Rendered output of a generation, in plain and gzip compressed
+Exposition = namedtuple('Exposition', ['generation', 'plain', 'gzip', 'etag', 'timestamp'])
+
+class ExpositionCache():
+    """
+    This class represents the output of the registry, cached per generation
+
+    Methods
+    -------
+    get
+        Returns the output of the current generation
+    """
+
+    def __init__(self, registry=REGISTRY, generation=None, max_age=60):
+        """
+        Parameters
+        ----------
+        registry
+            The registry to render
+        generation
+            Optional Callable() returning the current generation of the
+            output. Without it, the output is rendered on every call.
+        max_age
+            Seconds the output of a generation is served at most
+        """
+
+        self._registry = registry
+        self._generation = generation
+        self._max_age = max_age
+        self._exposition = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Exposition:
+        """Returns the output of the current generation
+
+        Concurrent calls for a new generation render it only once.
+        """
+
+        if self._generation is None:
+            return self._render(None)
+
+        generation = self._generation()
+        exposition = self._exposition
+        if self._current(exposition, generation):
+            return exposition
+
+        with self._lock:
+            exposition = self._exposition
+            if not self._current(exposition, generation):
+                exposition = self._exposition = self._render(generation)
+                _LOGGER.debug("Rendered generation {}: {} bytes, {} compressed".format(
+                    generation, len(exposition.plain), len(exposition.gzip)))
+            return exposition
+
+    def _current(self, exposition, generation) -> bool:
+        return exposition is not None and exposition.generation == generation \
+            and time.time() - exposition.timestamp < self._max_age
+
+    def _render(self, generation) -> Exposition:
+        plain = generate_latest(self._registry)
+        etag = '"{}"'.format(hashlib.sha1(plain).hexdigest()[:16])
+        return Exposition(generation, plain, gzip.compress(plain, compresslevel=6), etag, time.time())
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    This class represents the HTTP handler serving the cached output
+
+    Methods
+    -------
+    do_GET
+        Sends the output, compressed if the client accepts gzip, within
+        the scrape timeout. Sends the profile of a collector run on
+        /debug/profile.
+    """
+
+    cache = None
+    profile = None
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/debug/profile':
+            self._send_profile(parse_qs(url.query))
+            return
+
+        with deadline.scope(self._scrape_timeout()):
+            exposition = self.cache.get()
+
+        if exposition.etag in self.headers.get('If-None-Match', ''):
+            self.send_response(304)
+            self.send_header('ETag', exposition.etag)
+            self.end_headers()
+            return
+
+        output = exposition.plain
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            output = exposition.gzip
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE_LATEST)
+        self.send_header('Content-Length', str(len(output)))
+        self.send_header('ETag', exposition.etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+        self.wfile.write(output)
+
+    def _send_profile(self, query):
+        """Sends the profile of a collector run, if profiling is enabled"""
+
+        if self.profile is None or not profiling.PROFILING:
+            self.send_error(404)
+            return
+
+        def flag(name, default):
+            return query.get(name, [default])[0] == '1'
+
+        try:
+            status, output = 200, self.profile(query.get('collector', [''])[0],
+                                               cpu=flag('cpu', '1'), memory=flag('memory', '0'),
+                                               top=int(query.get('top', ['25'])[0]))
+        except KeyError as err:
+            status, output = 404, "Unknown collector {}\n".format(err)
+        except ValueError as err:
+            status, output = 400, "{}\n".format(err)
+        except profiling.ProfilingBusy as err:
+            status, output = 409, "{}\n".format(err)
+
+        output = output.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(output)))
+        self.end_headers()
+        self.wfile.write(output)
+
+    def _scrape_timeout(self):
+        """Returns the seconds until the scrape times out, None if unknown"""
+
+        try:
+            return float(self.headers['X-Prometheus-Scrape-Timeout-Seconds']) - _SCRAPE_TIMEOUT_MARGIN
+        except (TypeError, ValueError):
+            return None
+
+    def log_message(self, format, *args):
+        """Log nothing."""
+
+def start_http_server(port, cache, addr='', profile=None):
+    """
+    Starts the HTTP server for the metrics as a daemon thread
+
+    Parameters
+    ----------
+    port
+        Port to listen on
+    cache
+        The ExpositionCache to serve
+    addr
+        Address to listen on, defaults to all
+    profile
+        Optional Callable(collector, cpu, memory, top) returning the
+        profile of a collector run, served on /debug/profile if profiling
+        is enabled
+
+    Returns
+    -------
+    The ThreadingHTTPServer
+    """
+
+    handler = type('MetricsHandler', (MetricsHandler,), {'cache': cache, 'profile': staticmethod(profile)})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='http_server', daemon=True)
+    thread.start()
+    return server
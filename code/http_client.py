@@ -0,0 +1,587 @@
+"""Shared HTTP Client
+
+This module provides one HTTP client shared by all collectors. It keeps
+the connections to the Cloud One services alive within per-host
+connection pools, so paging through an API does not pay for a new TCP
+and TLS handshake on every request. Requests without an explicit timeout
+get a default one.
+
+While a collection run is active, identical requests of it's collectors
+are coalesced: the first one is sent, all others wait for it and share
+the same response, including it's parsed JSON. GET requests are coalesced
+by default, other methods when passing coalesce=True. The shared parsed
+JSON must not be modified by the collectors. Every run has it's own
+table of requests in flight, kept in a context variable, so overlapping
+runs, e.g. concurrent scrapes, never share responses with each other.
+
+The requests to each host are rate controlled, see the rate_limit module.
+A request throttled by the API with a 429 or 503 is retried after the
+time given by it's Retry-After header. A host which keeps failing with
+errors or 5xx responses gets it's circuit opened, requests to it then
+fail fast with a CircuitOpenError, see the circuit_breaker module.
+Within a scrape deadline, the timeouts are shortened to the time left,
+see the deadline module. Every request is recorded by the
+instrumentation module.
+
+Coroutines send their requests by request_async() with an async
+transport, see the async_runtime module. They are coalesced with the
+other requests of the run, rate controlled and recorded the same way,
+but wait without blocking a thread.
+
+The client is configured by environment variables:
+
+API_COLLECTOR_HTTP_POOL_SIZE
+    Connections kept per host, default 10
+API_COLLECTOR_HTTP_POOL_SIZE_<SERVICE>
+    Connections kept per host of a Cloud One service, e.g.
+    API_COLLECTOR_HTTP_POOL_SIZE_WORKLOAD, defaults to the above
+API_COLLECTOR_HTTP_CONNECT_TIMEOUT
+    Default connect timeout in seconds, default 5
+API_COLLECTOR_HTTP_READ_TIMEOUT
+    Default read timeout in seconds, default 30
+API_COLLECTOR_HTTP_COALESCE
+    Coalesce identical requests within a collection run, default 1
+API_COLLECTOR_HTTP_RATE
+    Requests per second per host, default 0 for unlimited
+API_COLLECTOR_HTTP_BURST
+    Requests sent at once per host after an idle period, default 10
+API_COLLECTOR_HTTP_CONCURRENCY
+    Requests in flight per host at most, defaults to the pool size
+API_COLLECTOR_HTTP_RETRIES
+    Retries of a throttled request, default 3
+API_COLLECTOR_HTTP_REDIRECT
+    Base URL all HTTPS requests are sent to instead of their hosts, e.g.
+    http://127.0.0.1:8780 for the mock API of the benchmarks, see
+    bench/mock_api.py
+
+The responses to the HTTPS requests can be recorded and replayed, see
+the http_replay module.
+"""
+
+import os
+import time
+import json
+import asyncio
+import threading
+import contextvars
+import logging
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+import requests
+from requests.adapters import HTTPAdapter
+import rate_limit
+import deadline
+import instrumentation
+import http_replay
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+_LOGGER = logging.getLogger(__name__)
+
+# Cloud One services which get their own connection pools
+SERVICES = ('workload', 'container', 'filestorage', 'application')
+
+_POOL_SIZE = int(os.environ.get('API_COLLECTOR_HTTP_POOL_SIZE', 10))
+_CONNECT_TIMEOUT = float(os.environ.get('API_COLLECTOR_HTTP_CONNECT_TIMEOUT', 5))
+_READ_TIMEOUT = float(os.environ.get('API_COLLECTOR_HTTP_READ_TIMEOUT', 30))
+_COALESCE = os.environ.get('API_COLLECTOR_HTTP_COALESCE', '1') == '1'
+_RATE = float(os.environ.get('API_COLLECTOR_HTTP_RATE', 0))
+_BURST = int(os.environ.get('API_COLLECTOR_HTTP_BURST', 10))
+_CONCURRENCY = int(os.environ.get('API_COLLECTOR_HTTP_CONCURRENCY', _POOL_SIZE))
+_RETRIES = int(os.environ.get('API_COLLECTOR_HTTP_RETRIES', 3))
+_REDIRECT = os.environ.get('API_COLLECTOR_HTTP_REDIRECT', '')
+
+_UNSET = object()
+
+# Requests in flight of the active collection run, by their key
+_FLIGHTS = contextvars.ContextVar('flights', default=None)
+
+class SharedResponse():
+    """
+    This class represents a response shared by coalesced requests
+
+    It behaves like the wrapped requests.Response, but parses the JSON
+    body only once for all requests sharing it.
+    """
+
+    def __init__(self, response):
+        object.__setattr__(self, '_response', response)
+        object.__setattr__(self, '_json', _UNSET)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def json(self, **kwargs):
+        if kwargs:
+            return self._response.json(**kwargs)
+        with self._lock:
+            if self._json is _UNSET:
+                object.__setattr__(self, '_json', self._response.json())
+        return self._json
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._response, name, value)
+
+class _Flight():
+    """A request in flight, shared by all identical requests"""
+
+    __slots__ = ('done', 'response', 'error', 'listeners')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        # callables notified once it is done, for waiting coroutines
+        self.listeners = []
+
+class RedirectAdapter(HTTPAdapter):
+    """
+    This class represents a transport adapter sending the requests to
+    another base URL, keeping their paths and queries
+    """
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self._base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        request.url = _redirect_url(self._base, request.url)
+        return super().send(request, **kwargs)
+
+def _redirect_url(base, url) -> str:
+    url = urlsplit(url)
+    return urlunsplit((base.scheme, base.netloc, base.path.rstrip('/') + url.path, url.query, ''))
+
+def redirect(url) -> str:
+    """Returns the URL a request is sent to, see API_COLLECTOR_HTTP_REDIRECT"""
+
+    if not _REDIRECT or urlsplit(url).scheme != 'https':
+        return url
+    return _redirect_url(urlsplit(_REDIRECT), url)
+
+def _waker(loop, event):
+    """Returns a listener setting an asyncio.Event from any thread"""
+
+    def listener():
+        try:
+            loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            # the loop was closed meanwhile
+            pass
+    return listener
+
+def _adapter(pool_size):
+    if _REDIRECT:
+        return http_replay.adapter(RedirectAdapter(_REDIRECT, pool_maxsize=pool_size))
+    return http_replay.adapter(HTTPAdapter(pool_maxsize=pool_size))
+
+def _request_key(method, url, kwargs):
+    headers = kwargs.get('headers') or {}
+    return (method, url,
+            json.dumps(kwargs.get('params'), sort_keys=True, default=str),
+            kwargs.get('data'),
+            json.dumps(kwargs.get('json'), sort_keys=True, default=str),
+            tuple(sorted((str(k).lower(), str(v)) for k, v in headers.items())))
+
+class HttpClient():
+    """
+    This class represents the HTTP client shared by the collectors
+
+    The methods take the same arguments as their counterparts of the
+    requests module and return a requests.Response.
+
+    Methods
+    -------
+    coalescing
+        Context manager coalescing identical requests while it is active
+    controller
+        Returns the RateController of a host
+    breaker
+        Returns the CircuitBreaker of a host
+    request
+        Sends a request using the pooled connections
+    request_async
+        Sends a request of a coroutine with an async transport
+    get
+        Sends a GET request
+    post
+        Sends a POST request
+    close
+        Closes all pooled connections
+    """
+
+    def __init__(self, pool_size=_POOL_SIZE, timeout=(_CONNECT_TIMEOUT, _READ_TIMEOUT), coalesce=_COALESCE):
+        """
+        Parameters
+        ----------
+        pool_size
+            Connections kept per host, unless configured for a service
+        timeout
+            Default (connect, read) timeout in seconds
+        coalesce
+            Coalesce identical requests while a collection run is active
+        """
+
+        self.pool_size = pool_size
+        self._timeout = timeout
+        self._coalesce = coalesce
+        self._controllers = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._session = requests.Session()
+
+        self._session.mount("https://", _adapter(pool_size))
+        self._session.mount("http://", HTTPAdapter(pool_maxsize=pool_size))
+        for service in SERVICES:
+            size = int(os.environ.get('API_COLLECTOR_HTTP_POOL_SIZE_' + service.upper(), pool_size))
+            self._session.mount("https://" + service + ".", _adapter(size))
+
+    @contextmanager
+    def coalescing(self):
+        """Coalesces identical requests of a run while the context is active
+
+        The requests are coalesced within the context only, including the
+        threads it starts with functions bound by deadline.bind(). The
+        shared responses are released when it exits.
+        """
+
+        flights = {}
+        token = _FLIGHTS.set(flights)
+        try:
+            yield self
+        finally:
+            _FLIGHTS.reset(token)
+            with self._lock:
+                flights.clear()
+
+    def request(self, method, url, coalesce=None, **kwargs) -> requests.Response:
+        timeout = kwargs.get('timeout', self._timeout)
+        kwargs['timeout'] = self._deadline_timeout(timeout)
+        # a timeout shortened to the deadline says nothing about the host
+        limited = kwargs['timeout'] != timeout
+
+        joined = self._join(method, url, coalesce, kwargs)
+        if joined is None:
+            return self._send(method, url, limited, **kwargs)
+
+        flights, key, flight, leader = joined
+        if leader:
+            try:
+                response = self._send(method, url, limited, **kwargs)
+            except BaseException as err:
+                self._land(flights, key, flight, error=err)
+                raise
+            self._land(flights, key, flight, response)
+        else:
+            _LOGGER.debug("Coalescing {} {}".format(method, url))
+            if not flight.done.wait(deadline.remaining()):
+                raise deadline.DeadlineExceeded("Deadline exceeded waiting for {} {}".format(method, url))
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    async def request_async(self, send, method, url, coalesce=None, **kwargs) -> requests.Response:
+        """Sends a request of a coroutine with an async transport
+
+        Like request(), but waiting for the rate control and coalesced
+        requests without blocking the thread.
+
+        Parameters
+        ----------
+        send
+            Coroutine function send(method, url, **kwargs) returning the
+            requests.Response, e.g. AsyncTransport.send
+        """
+
+        timeout = kwargs.get('timeout', self._timeout)
+        kwargs['timeout'] = self._deadline_timeout(timeout)
+        limited = kwargs['timeout'] != timeout
+
+        joined = self._join(method, url, coalesce, kwargs)
+        if joined is None:
+            return await self._send_async(send, method, url, limited, **kwargs)
+
+        flights, key, flight, leader = joined
+        if leader:
+            try:
+                response = await self._send_async(send, method, url, limited, **kwargs)
+            except asyncio.CancelledError:
+                # the coalesced requests, maybe of other threads, fail
+                self._land(flights, key, flight, error=deadline.DeadlineExceeded(
+                    "Cancelled {} {}".format(method, url)))
+                raise
+            except BaseException as err:
+                self._land(flights, key, flight, error=err)
+                raise
+            self._land(flights, key, flight, response)
+        else:
+            _LOGGER.debug("Coalescing {} {}".format(method, url))
+            landed = asyncio.Event()
+            if self._listen(flight, _waker(asyncio.get_running_loop(), landed)):
+                try:
+                    await asyncio.wait_for(landed.wait(), deadline.remaining())
+                except asyncio.TimeoutError:
+                    raise deadline.DeadlineExceeded("Deadline exceeded waiting for {} {}".format(method, url))
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.response
+
+    def _join(self, method, url, coalesce, kwargs):
+        """Joins the identical request in flight, or becomes it's leader
+
+        Returns
+        -------
+        (flights, key, flight, leader), None if the request isn't
+        coalesced
+        """
+
+        if coalesce is None:
+            coalesce = method in ('GET', 'HEAD')
+        flights = _FLIGHTS.get()
+        if not (coalesce and self._coalesce and flights is not None) or kwargs.get('stream'):
+            return None
+
+        key = _request_key(method, url, kwargs)
+        with self._lock:
+            flight = flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = flights[key] = _Flight()
+        return flights, key, flight, leader
+
+    def _land(self, flights, key, flight, response=None, error=None):
+        """Completes a flight with the response or error of it's leader"""
+
+        if error is None:
+            flight.response = SharedResponse(response)
+        flight.error = error
+        with self._lock:
+            if error is not None:
+                # let later requests retry
+                flights.pop(key, None)
+            flight.done.set()
+            listeners, flight.listeners = flight.listeners, []
+        for listener in listeners:
+            listener()
+
+    def _listen(self, flight, listener) -> bool:
+        """Registers a listener of a flight, False if it is done already"""
+
+        with self._lock:
+            if flight.done.is_set():
+                return False
+            flight.listeners.append(listener)
+            return True
+
+    def controller(self, url) -> rate_limit.RateController:
+        """Returns the RateController of the host of an URL"""
+
+        return self._per_host(self._controllers, url, lambda host: rate_limit.RateController(
+            host, _RATE, _BURST, _CONCURRENCY))
+
+    def breaker(self, url) -> CircuitBreaker:
+        """Returns the CircuitBreaker of the host of an URL"""
+
+        return self._per_host(self._breakers, url, CircuitBreaker)
+
+    def _per_host(self, instances, url, factory):
+        host = urlsplit(url).netloc
+        instance = instances.get(host)
+        if instance is None:
+            with self._lock:
+                instance = instances.get(host)
+                if instance is None:
+                    instance = instances[host] = factory(host)
+        return instance
+
+    def _deadline_timeout(self, timeout):
+        """Shortens a timeout to the time left until the deadline
+
+        Raises
+        ------
+        DeadlineExceeded
+            The deadline passed
+        """
+
+        left = deadline.remaining()
+        if left is None:
+            return timeout
+        deadline.check()
+        if timeout is None:
+            return left
+        if isinstance(timeout, tuple):
+            return tuple(left if part is None else min(part, left) for part in timeout)
+        return min(timeout, left)
+
+    def _send(self, method, url, limited=False, **kwargs) -> requests.Response:
+        """Sends a request under the rate control of it's host
+
+        Throttled requests are retried after the time the API asks for.
+        Requests to a host with an open circuit fail fast. Timeouts
+        caused by the deadline, because it shortened the timeout or
+        passed, don't count as failures of the host.
+
+        Parameters
+        ----------
+        limited
+            The timeout was shortened to the deadline
+
+        Raises
+        ------
+        CircuitOpenError
+            The circuit of the host is open
+        DeadlineExceeded
+            The deadline passed while waiting to send the request
+        """
+
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError("Circuit of {} is open".format(breaker.name))
+
+        failed = True
+        try:
+            response = self._send_throttled(method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except requests.exceptions.Timeout as err:
+            if _cut_by_deadline(err, limited):
+                failed = None
+            raise
+        finally:
+            _report(breaker, failed)
+
+    def _send_throttled(self, method, url, **kwargs) -> requests.Response:
+        controller = self.controller(url)
+        for attempt in range(_RETRIES + 1):
+            if not controller.acquire(deadline.remaining()):
+                raise deadline.DeadlineExceeded("Deadline exceeded waiting for {}".format(controller.host))
+            response, status, pause = None, None, 0.0
+            start = time.monotonic()
+            try:
+                response = self._session.request(method, url, **kwargs)
+                status = response.status_code
+                if status in rate_limit.THROTTLED:
+                    pause = rate_limit.retry_after(response, default=2 ** attempt)
+            finally:
+                controller.release(status, pause)
+                instrumentation.http_request(url, response, time.monotonic() - start, kwargs.get('stream', False))
+
+            left = deadline.remaining()
+            if status not in rate_limit.THROTTLED or attempt == _RETRIES \
+                    or (left is not None and left <= pause):
+                return response
+
+            _LOGGER.debug("Retrying {} {} after {:.1f}s".format(method, url, pause))
+            response.close()
+
+    async def _send_async(self, send, method, url, limited=False, **kwargs) -> requests.Response:
+        """Sends a request of a coroutine like _send()"""
+
+        breaker = self.breaker(url)
+        if not breaker.allow():
+            raise CircuitOpenError("Circuit of {} is open".format(breaker.name))
+
+        failed = True
+        try:
+            response = await self._send_throttled_async(send, method, url, **kwargs)
+            failed = response.status_code >= 500
+            return response
+        except requests.exceptions.Timeout as err:
+            if _cut_by_deadline(err, limited):
+                failed = None
+            raise
+        except asyncio.CancelledError:
+            failed = None
+            raise
+        finally:
+            _report(breaker, failed)
+
+    async def _send_throttled_async(self, send, method, url, **kwargs) -> requests.Response:
+        controller = self.controller(url)
+        for attempt in range(_RETRIES + 1):
+            await self._acquire_async(controller)
+            response, status, pause = None, None, 0.0
+            start = time.monotonic()
+            try:
+                response = await send(method, url, **kwargs)
+                status = response.status_code
+                if status in rate_limit.THROTTLED:
+                    pause = rate_limit.retry_after(response, default=2 ** attempt)
+            finally:
+                controller.release(status, pause)
+                instrumentation.http_request(url, response, time.monotonic() - start)
+
+            left = deadline.remaining()
+            if status not in rate_limit.THROTTLED or attempt == _RETRIES \
+                    or (left is not None and left <= pause):
+                return response
+
+            _LOGGER.debug("Retrying {} {} after {:.1f}s".format(method, url, pause))
+            response.close()
+
+    async def _acquire_async(self, controller):
+        """Waits until the controller lets a request be sent, like
+        RateController.acquire() bounded by the deadline"""
+
+        loop = asyncio.get_running_loop()
+        while True:
+            released = asyncio.Event()
+            wait = controller.try_acquire(_waker(loop, released))
+            if wait == 0:
+                return
+            left = deadline.remaining()
+            if left is not None and left <= 0:
+                raise deadline.DeadlineExceeded("Deadline exceeded waiting for {}".format(controller.host))
+            waits = [seconds for seconds in (wait, left) if seconds is not None]
+            try:
+                await asyncio.wait_for(released.wait(), min(waits) if waits else None)
+            except asyncio.TimeoutError:
+                pass
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self._session.close()
+
+def _cut_by_deadline(err, limited) -> bool:
+    """Tells if a timeout was caused by the deadline, because it shortened
+    the timeout or passed"""
+
+    left = deadline.remaining()
+    return limited or isinstance(err, deadline.DeadlineExceeded) or (left is not None and left <= 0)
+
+def _report(breaker, failed):
+    """Reports the outcome of a request to the breaker of it's host, None
+    for one telling nothing about the host"""
+
+    if failed is None:
+        breaker.release()
+    elif failed:
+        breaker.failure()
+    else:
+        breaker.success()
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+def get_client() -> HttpClient:
+    """
+    Returns the HttpClient shared by all collectors
+
+    Returns
+    -------
+    The shared HttpClient, created on first use
+    """
+
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = HttpClient()
+    return _CLIENT
@@ -0,0 +1,519 @@
+"""HTTP Record and Replay
+
+This module records the API responses received by the shared HTTP client
+to disk and replays them later, so a scrape of a real account can be
+captured once and run again, e.g. by the benchmarks in CI, without the
+account. Synthetic data doesn't reproduce the shape of real accounts,
+like uneven rule assignments, long pod names or bursts of events.
+
+The responses are sanitized before they are written. Request headers,
+including the API keys, are not recorded at all, the host names are
+reduced to the Cloud One service and the values of the JSON members
+listed in API_COLLECTOR_HTTP_RECORD_REDACT are replaced by pseudonyms of
+the same length and shape. So are all strings looking like an IP address
+or a DNS name, whatever member holds them. The same value gets the same
+pseudonym within a recording process, so the cardinality of the labels
+is kept.
+
+A recording is a directory holding exchanges.jsonl, a line per request
+and response, and the gzip compressed bodies in bodies/. A replayed
+request is matched to the recorded ones by it's method, service, path,
+query and body, ignoring timestamps like the time range of an event
+query. Responses to the same request are served in their recorded order,
+and from the first again once all were served. Requests which weren't
+recorded are answered with a 404.
+
+The recorded timestamps are served unchanged. So that the time windows of
+the collectors, see the event_window module, land on the recorded events,
+their clock is recorded and replayed as well: every reading of a window's
+clock is written to clock.jsonl and returned again in the same order when
+replaying. A window thereby queries the same time ranges as when it was
+recorded, however fast or late the recording is replayed. A recording
+should cover as many collector runs as are replayed, further readings
+continue the recorded ones shifted by their span.
+
+The recording and replay are configured by environment variables:
+
+API_COLLECTOR_HTTP_RECORD
+    Directory the responses are recorded to
+API_COLLECTOR_HTTP_REPLAY
+    Directory the responses are replayed from
+API_COLLECTOR_HTTP_REPLAY_TIMING
+    original to delay every response by the time it originally took,
+    fast to serve them as fast as possible, default original
+API_COLLECTOR_HTTP_RECORD_REDACT
+    Comma separated names of the JSON members to pseudonymize, defaults
+    to the names of hosts, addresses, accounts, instances, clusters,
+    namespaces and pods
+"""
+
+import os
+import re
+import io
+import gzip
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qsl
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD = os.environ.get('API_COLLECTOR_HTTP_RECORD', '')
+REPLAY = os.environ.get('API_COLLECTOR_HTTP_REPLAY', '')
+REPLAY_TIMING = os.environ.get('API_COLLECTOR_HTTP_REPLAY_TIMING', 'original')
+REDACT = [name.strip() for name in os.environ.get(
+    'API_COLLECTOR_HTTP_RECORD_REDACT',
+    'hostName,displayName,description,lastIPUsed,publicIP,privateIP,'
+    'publicIPAddress,privateIPAddress,publicDNSName,privateDNSName,IPs,accountID,instanceID,'
+    'clusterName,namespace,k8s.ns.name,k8s.pod.name,k8s.pod.id,podName,containerName,image'
+).split(',') if name.strip()]
+
+_EXCHANGES = 'exchanges.jsonl'
+_CLOCK = 'clock.jsonl'
+_BODIES = 'bodies'
+
+# Response headers kept, all others are dropped
+_HEADERS = ('Content-Type', 'Retry-After')
+
+# ISO timestamps and milliseconds since the epoch, ignored when matching
+_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}')
+_EPOCH_MILLIS = range(10 ** 12, 10 ** 13)
+
+# IPv4 and IPv6 addresses, optionally with a prefix length, and DNS names,
+# pseudonymized wherever they occur. The IPv6 pattern matches MAC addresses
+# as well.
+_ADDRESS = re.compile(r'^(\d{1,3}(\.\d{1,3}){3}|(?=[0-9a-fA-F:]*(::|(:[0-9a-fA-F]*){3}))[0-9a-fA-F:]+)(/\d{1,3})?$'
+                      r'|^(?=.{4,253}$)([A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+[A-Za-z]{2,63}\.?$')
+
+def _normalize(value):
+    """Replaces the timestamps within a query or JSON value"""
+
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, str):
+        if _TIMESTAMP.match(value) or (value.isdigit() and int(value) in _EPOCH_MILLIS):
+            return '*'
+    elif isinstance(value, int) and not isinstance(value, bool) and value in _EPOCH_MILLIS:
+        return '*'
+    return value
+
+def request_key(method, url, body=None) -> str:
+    """
+    Returns the key a request is matched by
+
+    Parameters
+    ----------
+    method
+        HTTP method
+    url
+        URL of the request, only the first label of the host is used
+    body
+        Body of the request as bytes or str, if any
+
+    Returns
+    -------
+    The key as hex digest
+    """
+
+    url = urlsplit(url)
+    service = url.hostname.split('.', 1)[0] if url.hostname else ''
+    query = sorted((name, _normalize(value)) for name, value in parse_qsl(url.query, keep_blank_values=True))
+
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    try:
+        body = _normalize(json.loads(body)) if body else None
+    except ValueError:
+        body = hashlib.sha256(body).hexdigest()
+
+    key = json.dumps([method, service, url.path, query, body], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class Recorder():
+    """
+    This class represents a recording of the API responses
+
+    Methods
+    -------
+    record
+        Records a request and it's response
+    record_clock
+        Records a reading of a clock
+    """
+
+    def __init__(self, directory, redact=REDACT):
+        """
+        Parameters
+        ----------
+        directory
+            Directory the recording is written to, appended to if it
+            exists
+        redact
+            Names of the JSON members to pseudonymize
+        """
+
+        self._directory = directory
+        self._redact = frozenset(redact)
+        self._salt = os.urandom(16)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, _BODIES), exist_ok=True)
+
+    def record(self, request, response, seconds):
+        """
+        Records a request and it's response
+
+        Parameters
+        ----------
+        request
+            The requests.PreparedRequest
+        response
+            The requests.Response, it's body is read
+        seconds
+            Seconds until the body was received
+        """
+
+        url = urlsplit(request.url)
+        service = url.hostname.split('.', 1)[0] if url.hostname else ''
+        body = self._sanitize(response.content, response.headers.get('Content-Type', ''))
+        digest = hashlib.sha256(body).hexdigest()
+        self._write_body(digest, body)
+
+        exchange = {
+            "key": request_key(request.method, request.url, request.body),
+            "method": request.method,
+            "url": "https://{}{}{}".format(service, url.path, '?' + url.query if url.query else ''),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {name: response.headers[name] for name in _HEADERS if name in response.headers},
+            "seconds": round(seconds, 6),
+            "body": digest,
+        }
+        with self._lock:
+            # a single write per line, so concurrent processes recording
+            # to the same directory don't mix their lines
+            with open(os.path.join(self._directory, _EXCHANGES), 'a') as file:
+                file.write(json.dumps(exchange) + '\n')
+
+    def record_clock(self, name, now):
+        """
+        Records a reading of a clock
+
+        Parameters
+        ----------
+        name
+            Name of the clock, e.g. the collector
+        now
+            The datetime read
+        """
+
+        with self._lock:
+            with open(os.path.join(self._directory, _CLOCK), 'a') as file:
+                file.write(json.dumps({"name": name, "time": now.isoformat()}) + '\n')
+
+    def _sanitize(self, body, content_type) -> bytes:
+        if 'json' not in content_type or not self._redact:
+            return body
+        try:
+            value = json.loads(body)
+        except ValueError:
+            return body
+        return json.dumps(self._redact_value(value), separators=(',', ':')).encode('utf-8')
+
+    def _redact_value(self, value, redact=False):
+        if isinstance(value, dict):
+            return {key: self._redact_value(item, key in self._redact) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self._redact_value(item, redact) for item in value]
+        if isinstance(value, str) and (redact or _ADDRESS.match(value)):
+            return self._pseudonym(value)
+        if redact and isinstance(value, int) and not isinstance(value, bool):
+            # e.g. an account ID sent as number
+            return int(self._pseudonym(str(value)))
+        return value
+
+    def _pseudonym(self, value) -> str:
+        """Returns a pseudonym of the same length, keeping the separators
+
+        Letters are replaced by letters and digits by digits, so e.g. an
+        address stays recognizable as one.
+        """
+
+        digest = b''
+        counter = 0
+        while len(digest) < len(value):
+            digest += hashlib.blake2b(value.encode('utf-8'), key=self._salt,
+                                      salt=counter.to_bytes(16, 'little')).digest()
+            counter += 1
+
+        pseudonym = []
+        for char, byte in zip(value, digest):
+            if char.isdigit():
+                pseudonym.append(chr(ord('0') + byte % 10))
+            elif char.isalpha():
+                pseudonym.append(chr(ord('a') + byte % 26))
+            else:
+                pseudonym.append(char)
+        return ''.join(pseudonym)
+
+    def _write_body(self, digest, body):
+        path = os.path.join(self._directory, _BODIES, digest + '.gz')
+        if os.path.exists(path):
+            return
+        temp = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+        with gzip.open(temp, 'wb') as file:
+            file.write(body)
+        os.replace(temp, path)
+
+class Player():
+    """
+    This class represents the replay of a recording
+
+    Methods
+    -------
+    response
+        Returns the next recorded response to a request
+    clock
+        Returns the next recorded reading of a clock
+    stats
+        Returns the requests replayed so far
+    """
+
+    def __init__(self, directory, timing=REPLAY_TIMING):
+        """
+        Parameters
+        ----------
+        directory
+            Directory of the recording
+        timing
+            original to delay the responses by their recorded time, fast
+            to serve them immediately
+        """
+
+        self._directory = directory
+        self._fast = timing == 'fast'
+        self._exchanges = {}
+        self._served = Counter()
+        self._clocks = {}
+        self._ticks = Counter()
+        self._requests = Counter()
+        self._throttled = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        with open(os.path.join(directory, _EXCHANGES), 'r') as file:
+            for line in file:
+                if line.strip():
+                    exchange = json.loads(line)
+                    self._exchanges.setdefault(exchange['key'], []).append(exchange)
+        _LOGGER.info("Replaying {} recorded responses from {}".format(
+            sum(len(exchanges) for exchanges in self._exchanges.values()), directory))
+
+        path = os.path.join(directory, _CLOCK)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                for line in file:
+                    if line.strip():
+                        reading = json.loads(line)
+                        self._clocks.setdefault(reading['name'], []).append(datetime.fromisoformat(reading['time']))
+
+    def response(self, request) -> requests.Response:
+        """Returns the next recorded response to a request, a 404 if
+        there is none
+        """
+
+        key = request_key(request.method, request.url, request.body)
+        with self._lock:
+            exchanges = self._exchanges.get(key)
+            if exchanges is not None:
+                exchange = exchanges[self._served[key] % len(exchanges)]
+                self._served[key] += 1
+
+        if exchanges is None:
+            _LOGGER.warning("No recorded response to {} {}".format(request.method, request.url))
+            return self._build(request, 404, 'Not Found', {'Content-Type': 'application/json'},
+                               b'{"message": "No recorded response"}', 0.0)
+
+        with gzip.open(os.path.join(self._directory, _BODIES, exchange['body'] + '.gz'), 'rb') as file:
+            body = file.read()
+        if not self._fast:
+            time.sleep(exchange['seconds'])
+
+        with self._lock:
+            self._requests[urlsplit(request.url).path] += 1
+            self._bytes += len(body)
+            if exchange['status'] in (429, 503):
+                self._throttled += 1
+        return self._build(request, exchange['status'], exchange['reason'], exchange['headers'],
+                           body, exchange['seconds'])
+
+    def clock(self, name):
+        """Returns the next recorded reading of a clock
+
+        Once all readings were returned, they are returned again shifted
+        by their span, so the clock keeps advancing.
+
+        Returns
+        -------
+        The datetime read, None if the clock wasn't recorded
+        """
+
+        readings = self._clocks.get(name)
+        if not readings:
+            return None
+
+        with self._lock:
+            tick = self._ticks[name]
+            self._ticks[name] += 1
+        cycle, index = divmod(tick, len(readings))
+        if cycle == 0:
+            return readings[index]
+
+        if index == 0:
+            _LOGGER.warning("Replaying the clock of {} beyond the {} recorded readings".format(name, len(readings)))
+        step = (readings[-1] - readings[0]) / (len(readings) - 1) if len(readings) > 1 else timedelta(minutes=1)
+        return readings[index] + cycle * (readings[-1] - readings[0] + step)
+
+    def stats(self, reset=False) -> dict:
+        """Returns the requests replayed so far by path, in the format of
+        the mock API of the benchmarks
+        """
+
+        with self._lock:
+            stats = {
+                "requests": sum(self._requests.values()),
+                "throttled": self._throttled,
+                "bytes": self._bytes,
+                "paths": dict(self._requests),
+            }
+            if reset:
+                self._requests.clear()
+                self._throttled = 0
+                self._bytes = 0
+            return stats
+
+    def _build(self, request, status, reason, headers, body, seconds) -> requests.Response:
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(headers)
+        response.headers['Content-Length'] = str(len(body))
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.elapsed = timedelta(seconds=seconds)
+        return response
+
+class RecordingAdapter(BaseAdapter):
+    """
+    This class represents a transport adapter recording the responses of
+    another one
+    """
+
+    def __init__(self, adapter, recorder):
+        super().__init__()
+        self._adapter = adapter
+        self._recorder = recorder
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        # the inner adapter may change the URL, e.g. redirect it
+        response = self._adapter.send(request.copy(), **kwargs)
+        try:
+            # the body is read completely, even for a streamed response
+            response.content
+            self._recorder.record(request, response, time.monotonic() - start)
+        except (OSError, requests.exceptions.RequestException) as err:
+            _LOGGER.warning(f"Unable to record {request.method} {request.url}: {err=}")
+        return response
+
+    def close(self):
+        self._adapter.close()
+
+class ReplayAdapter(BaseAdapter):
+    """
+    This class represents a transport adapter serving recorded responses
+    """
+
+    def __init__(self, player):
+        super().__init__()
+        self._player = player
+
+    def send(self, request, **kwargs):
+        return self._player.response(request)
+
+    def close(self):
+        pass
+
+_RECORDER = None
+_PLAYER = None
+_LOCK = threading.Lock()
+
+def get_recorder() -> Recorder:
+    """Returns the Recorder to API_COLLECTOR_HTTP_RECORD, created on first use"""
+
+    global _RECORDER
+    with _LOCK:
+        if _RECORDER is None:
+            _RECORDER = Recorder(RECORD)
+        return _RECORDER
+
+def get_player() -> Player:
+    """Returns the Player of API_COLLECTOR_HTTP_REPLAY, created on first use"""
+
+    global _PLAYER
+    with _LOCK:
+        if _PLAYER is None:
+            _PLAYER = Player(REPLAY)
+        return _PLAYER
+
+def clock(name) -> datetime:
+    """
+    Returns the current UTC time of a named clock, recorded or replayed
+    as configured
+
+    Parameters
+    ----------
+    name
+        Name of the clock, e.g. the collector reading it
+
+    Returns
+    -------
+    The recorded time when replaying a recording of the clock, the
+    current time otherwise
+    """
+
+    if REPLAY:
+        now = get_player().clock(name)
+        if now is not None:
+            return now
+    now = datetime.utcnow()
+    if RECORD:
+        get_recorder().record_clock(name, now)
+    return now
+
+def adapter(inner) -> BaseAdapter:
+    """
+    Returns the transport adapter to mount, recording or replaying as
+    configured
+
+    Parameters
+    ----------
+    inner
+        The adapter sending the requests to the API
+    """
+
+    if REPLAY:
+        return ReplayAdapter(get_player())
+    if RECORD:
+        return RecordingAdapter(inner, get_recorder())
+    return inner
@@ -0,0 +1,95 @@
+"""Self Instrumentation
+
+This module holds the metrics the api-collector reports about itself.
+The runtime records the runs of every collector, the shared HTTP client
+every API request. The requests are attributed to the collector sending
+them by a context variable set for the collector's run, so the collectors
+need no code for their instrumentation.
+
+Collectors running in worker processes, see the isolation module, report
+their runs only, their API requests are sent by the worker process.
+"""
+
+import time
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from prometheus_client import Counter, Gauge, Histogram
+
+_COLLECTOR = contextvars.ContextVar('collector', default='')
+
+RUN_SECONDS = Histogram('api_collector_run_seconds', 'Seconds a collector run took',
+                        ['collector'], buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120))
+RUNS = Counter('api_collector_runs', 'Completed collector runs', ['collector'])
+ERRORS = Counter('api_collector_errors', 'Failed collector runs', ['collector', 'exception'])
+SERIES = Gauge('api_collector_series', 'Series emitted by the last run of a collector', ['collector'])
+
+HTTP_SECONDS = Histogram('api_collector_http_request_seconds', 'Seconds until the response of an API request',
+                         ['host'], buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+HTTP_REQUESTS = Counter('api_collector_http_requests', 'API requests sent, e.g. pages fetched',
+                        ['collector', 'host', 'status'])
+HTTP_BYTES = Counter('api_collector_http_downloaded_bytes', 'Bytes downloaded from the APIs',
+                     ['collector', 'host'])
+
+@contextmanager
+def collector_run(collector):
+    """
+    Records a collector run while the context is active
+
+    Parameters
+    ----------
+    collector
+        Path to the collector script
+
+    Raises
+    ------
+    Any exception of the run, after counting it as error
+    """
+
+    token = _COLLECTOR.set(collector)
+    start = time.monotonic()
+    try:
+        yield
+    except BaseException as err:
+        ERRORS.labels(collector, type(err).__name__).inc()
+        raise
+    else:
+        RUNS.labels(collector).inc()
+    finally:
+        RUN_SECONDS.labels(collector).observe(time.monotonic() - start)
+        _COLLECTOR.reset(token)
+
+def series(collector, count):
+    """Records the number of series emitted by a collector"""
+
+    SERIES.labels(collector).set(count)
+
+def http_request(url, response, seconds, stream=False):
+    """
+    Records an API request
+
+    Parameters
+    ----------
+    url
+        URL of the request
+    response
+        The requests.Response, None if the request failed
+    seconds
+        Seconds until the response or failure
+    stream
+        If the body is streamed, it's size is taken from the headers
+    """
+
+    host = urlsplit(url).netloc
+    HTTP_SECONDS.labels(host).observe(seconds)
+
+    status = 'error' if response is None else str(response.status_code)
+    HTTP_REQUESTS.labels(_COLLECTOR.get(), host, status).inc()
+    if response is None:
+        return
+
+    if stream:
+        size = int(response.headers.get('Content-Length', 0) or 0)
+    else:
+        size = len(response.content)
+    HTTP_BYTES.labels(_COLLECTOR.get(), host).inc(size)
@@ -0,0 +1,285 @@
+"""Process Isolated Collectors
+
+This module runs collectors in a pool of worker processes instead of the
+api-collector's own interpreter. A CPU heavy collector then doesn't hold
+the GIL of the process serving the scrapes, and the memory it leaks is
+returned when it's worker is recycled. A worker is replaced after it ran
+a number of collectors or when it's resident memory exceeds a threshold.
+
+Results are returned column by column, with every label column encoded
+as it's distinct values and an array of their indices, which keeps the
+data to serialize small even for collectors with many metrics.
+
+The collectors to isolate are selected by the environment variable
+API_COLLECTOR_ISOLATE, either "all" or a comma separated list of
+collector names like "ws_ips,ws_ips_rules", or by a module level
+ISOLATED = True of the collector. As every worker has it's own memory,
+collectors keeping state between their runs in memory, like an event
+window, should not be isolated.
+"""
+
+import os
+import sys
+import queue
+import pickle
+import asyncio
+import inspect
+import importlib
+import threading
+import multiprocessing
+import logging
+from array import array
+import columnar
+import deadline
+
+_LOGGER = logging.getLogger(__name__)
+
+ISOLATE = [name.strip() for name in os.environ.get('API_COLLECTOR_ISOLATE', '').split(',') if name.strip()]
+PROCESS_WORKERS = int(os.environ.get('API_COLLECTOR_PROCESS_WORKERS', 2))
+PROCESS_MAX_RUNS = int(os.environ.get('API_COLLECTOR_PROCESS_MAX_RUNS', 50))
+PROCESS_MAX_MEMORY = int(os.environ.get('API_COLLECTOR_PROCESS_MAX_MEMORY_MB', 512)) * 1024 * 1024
+
+class CollectorProcessError(Exception):
+    """Raised if an isolated collector failed in it's worker process"""
+
+def encode(response) -> dict:
+    """
+    Encodes a collector response into the compact columnar format
+
+    Parameters
+    ----------
+    response
+        The dictionary returned by the collector, in either format
+
+    Returns
+    -------
+    The response holding Columns of (distinct values, array of indices)
+    and an array of Values
+    """
+
+    width = len(response['CounterMetricFamilyLabels'])
+    tables = [{} for _ in range(width)]
+    codes = [array('l') for _ in range(width)]
+    values = []
+
+    for row, value in columnar.rows(response):
+        for table, column, label in zip(tables, codes, row):
+            column.append(table.setdefault(label, len(table)))
+        values.append(value)
+
+    try:
+        values = array('d', values)
+    except TypeError:
+        pass
+
+    encoded = {key: value for key, value in response.items() if key not in ('Metrics', 'Columns', 'Values')}
+    encoded['Columns'] = [(list(table), column) for table, column in zip(tables, codes)]
+    encoded['Values'] = values
+    return encoded
+
+def decode(encoded) -> dict:
+    """Decodes an encoded response into a columnar collector response"""
+
+    encoded['Columns'] = [columnar.Interned(table, column) for table, column in encoded['Columns']]
+    return encoded
+
+def _rss() -> int:
+    """Returns the resident memory of this process in bytes"""
+
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _worker_main(conn):
+    """Runs collectors on request of the api-collector until it's pipe closes"""
+
+    import services
+
+    versions = {}
+    while True:
+        try:
+            name, version, timeout = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+
+        try:
+            # import the collector, or reload it if it changed on disk
+            module = sys.modules.get(name)
+            if module is None:
+                module = importlib.import_module(name)
+            elif versions.get(name) != version:
+                module = importlib.reload(module)
+            versions[name] = version
+
+            kwargs = services.inject(module.collect)
+            with deadline.scope(timeout):
+                if inspect.iscoroutinefunction(module.collect):
+                    response = asyncio.run(module.collect(**kwargs))
+                else:
+                    response = module.collect(**kwargs)
+
+            reply = ('ok', encode(response), _rss())
+        except BaseException as err:
+            reply = ('error', f"{err=}, {type(err)=}", _rss())
+
+        conn.send_bytes(pickle.dumps(reply, protocol=pickle.HIGHEST_PROTOCOL))
+
+class WorkerProcess():
+    """
+    This class represents a worker process running isolated collectors
+
+    Methods
+    -------
+    run
+        Runs a collector in the worker and returns it's response
+    expired
+        Tells if the worker needs to be recycled
+    stop
+        Stops the worker
+    """
+
+    def __init__(self, context, max_runs, max_memory):
+        self._conn, child = context.Pipe()
+        self._process = context.Process(target=_worker_main, args=(child,),
+                                        name='collector_worker', daemon=True)
+        self._process.start()
+        child.close()
+        self._max_runs = max_runs
+        self._max_memory = max_memory
+        self.runs = 0
+        self.rss = 0
+        self._broken = False
+
+    def run(self, name, version) -> dict:
+        self.runs += 1
+        timeout = deadline.remaining()
+        try:
+            self._conn.send((name, version, timeout))
+            ready = self._conn.poll(timeout)
+            if ready:
+                status, payload, self.rss = pickle.loads(self._conn.recv_bytes())
+        except (EOFError, OSError) as err:
+            self._broken = True
+            raise CollectorProcessError("Worker process running {} died: {}".format(name, err))
+
+        if not ready:
+            # cancel the collector by recycling it's worker
+            self._broken = True
+            raise deadline.DeadlineExceeded("Worker process running {} missed the deadline".format(name))
+        if status != 'ok':
+            raise CollectorProcessError(payload)
+        return decode(payload)
+
+    def expired(self) -> bool:
+        return self._broken or not self._process.is_alive() \
+            or (self._max_runs > 0 and self.runs >= self._max_runs) \
+            or (self._max_memory > 0 and self.rss >= self._max_memory)
+
+    def stop(self):
+        self._conn.close()
+        self._process.join(0 if self._broken else 5)
+        if self._process.is_alive():
+            self._process.kill()
+            self._process.join()
+
+class WorkerPool():
+    """
+    This class represents the pool of worker processes
+
+    Workers are started on demand and replaced when they expired or
+    failed.
+
+    Methods
+    -------
+    run
+        Runs a collector in an idle worker and returns it's response
+    stop
+        Stops all workers
+    """
+
+    def __init__(self, workers=PROCESS_WORKERS, max_runs=PROCESS_MAX_RUNS, max_memory=PROCESS_MAX_MEMORY):
+        """
+        Parameters
+        ----------
+        workers
+            Number of worker processes
+        max_runs
+            Collector runs after which a worker is replaced, 0 for never
+        max_memory
+            Resident bytes above which a worker is replaced, 0 for never
+        """
+
+        # the api-collector runs several threads, forking it could copy
+        # locks held by them into the workers
+        self._context = multiprocessing.get_context('spawn')
+        self._max_runs = max_runs
+        self._max_memory = max_memory
+        self._slots = threading.BoundedSemaphore(workers)
+        self._idle = queue.SimpleQueue()
+
+    def run(self, plugin) -> dict:
+        """Runs a collector in an idle worker and returns it's response
+
+        Parameters
+        ----------
+        plugin
+            The Plugin of the collector module
+
+        Raises
+        ------
+        CollectorProcessError
+            The collector failed or it's worker died
+        DeadlineExceeded
+            The collector didn't complete before the deadline
+        """
+
+        with self._slots:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                worker = WorkerProcess(self._context, self._max_runs, self._max_memory)
+
+            try:
+                return worker.run(plugin.module.__name__, plugin.version)
+            finally:
+                if worker.expired():
+                    _LOGGER.info("Recycling worker process after {} runs, {} MB resident".format(
+                        worker.runs, worker.rss // (1024 * 1024)))
+                    worker.stop()
+                else:
+                    self._idle.put(worker)
+
+    def stop(self):
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+def isolated(plugin) -> bool:
+    """Tells if a collector is to be run in a worker process"""
+
+    name = plugin.module.__name__.rsplit('.', 1)[-1]
+    return getattr(plugin.module, 'ISOLATED', False) or 'all' in ISOLATE or name in ISOLATE
+
+_POOL = None
+_LOCK = threading.Lock()
+
+def get_pool() -> WorkerPool:
+    """
+    Returns the WorkerPool shared by all isolated collectors
+
+    Returns
+    -------
+    The shared WorkerPool, created on first use
+    """
+
+    global _POOL
+    if _POOL is None:
+        with _LOCK:
+            if _POOL is None:
+                _POOL = WorkerPool()
+    return _POOL
@@ -0,0 +1,163 @@
+"""Streaming JSON Parsing
+
+This module parses a JSON response incrementally while it is downloaded.
+The items of the list holding the result set, e.g. the computers of a
+Workload Security search, are handed out one at a time. Only the item
+currently parsed needs to be held in memory, not the whole response, so
+the memory required stays flat independent of the size of the result.
+
+The response needs to be requested with stream=True.
+"""
+
+import json
+import codecs
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+class JsonStream():
+    """
+    This class represents a JSON object parsed while it is downloaded
+
+    Attributes
+    ----------
+    fields
+        The other members of the object, e.g. an error message. Complete
+        once the items are exhausted.
+
+    Methods
+    -------
+    items
+        Yields the items of the list of the given member
+    """
+
+    def __init__(self, response, key, chunk_size=65536):
+        """
+        Parameters
+        ----------
+        response
+            The requests.Response, requested with stream=True
+        key
+            Name of the member holding the list of items, e.g. computers
+        chunk_size
+            Bytes read from the response at once
+        """
+
+        self.fields = {}
+        self._response = response
+        self._key = key
+        self._chunks = response.iter_content(chunk_size)
+        self._decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def items(self):
+        """Yields the items of the list of the given member
+
+        Raises
+        ------
+        ValueError
+            The response is not a JSON object
+        """
+
+        try:
+            self._expect('{')
+            if self._peek() == '}':
+                return
+
+            while True:
+                name = self._value()
+                self._expect(':')
+
+                if name == self._key and self._peek() == '[':
+                    self._pos += 1
+                    if self._peek() == ']':
+                        self._pos += 1
+                    else:
+                        while True:
+                            yield self._value()
+                            if self._peek() == ']':
+                                self._pos += 1
+                                break
+                            self._expect(',')
+                else:
+                    self.fields[name] = self._value()
+
+                if self._peek() == '}':
+                    return
+                self._expect(',')
+        finally:
+            self._response.close()
+
+    def _fill(self, minimum=1):
+        """Reads at least minimum characters from the response"""
+
+        # drop the consumed part of the buffer
+        if self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+
+        read = 0
+        while read < minimum and not self._eof:
+            try:
+                text = self._decoder.decode(next(self._chunks))
+            except StopIteration:
+                text = self._decoder.decode(b'', final=True)
+                self._eof = True
+            self._buffer += text
+            read += len(text)
+
+    def _peek(self) -> str:
+        """Returns the next non whitespace character without consuming it"""
+
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                raise ValueError("Unexpected end of JSON response")
+            self._fill()
+
+    def _expect(self, char):
+        found = self._peek()
+        self._pos += 1
+        if found != char:
+            raise ValueError("Expected '{}' in JSON response, found '{}'".format(char, found))
+
+    def _value(self):
+        """Parses the next JSON value, reading from the response as needed"""
+
+        self._peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+                # a number might continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # read at least as much as is buffered, so a large value is
+            # re-parsed a logarithmic number of times only
+            self._fill(max(len(self._buffer) - self._pos, 1))
+
+def iter_items(response, key):
+    """
+    Yields the items of a list member of a streamed JSON response
+
+    Parameters
+    ----------
+    response
+        The requests.Response, requested with stream=True
+    key
+        Name of the member holding the list of items, e.g. computers
+
+    Returns
+    -------
+    Generator of the items
+    """
+
+    return JsonStream(response, key).items()
@@ -0,0 +1,192 @@
+"""Collector Plugin Registry
+
+This module discovers the collector modules located in ./collectors once
+and caches the modules together with the resolved parameters of their
+collect() functions. A background thread polls the modification times of
+the collector scripts and reloads only the modules which changed, while
+the api-collector keeps running. Updated collectors mounted from a
+ConfigMap therefore become effective without restarting the pod.
+"""
+
+import os
+import sys
+import time
+import glob
+import inspect
+import importlib
+import importlib.util
+import threading
+import logging
+from collections import namedtuple
+
+_LOGGER = logging.getLogger(__name__)
+
+# A loaded collector module. coroutine tells if it's collect() is async,
+# version identifies the state of the script on disk, loaded is the time
+# the module was (re)loaded.
+Plugin = namedtuple('Plugin', ['path', 'module', 'parameters', 'coroutine', 'version', 'loaded'])
+
+def _version(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+class PluginRegistry():
+    """
+    This class represents the registry of the collector modules
+
+    Methods
+    -------
+    plugins
+        Returns the currently loaded plugins
+    refresh
+        Scans the collectors directory and (re)loads changed modules
+    start
+        Starts the background thread polling for changes
+    stop
+        Stops the background thread
+    """
+
+    def __init__(self, directory='collectors', package='collectors', poll_interval=10):
+        """
+        Parameters
+        ----------
+        directory
+            Directory containing the collector scripts
+        package
+            Package name the collector modules are imported into
+        poll_interval
+            Seconds between two scans of the directory. With 0, the
+            directory is only scanned once.
+        """
+
+        self._directory = directory
+        self._package = package
+        self._poll_interval = poll_interval
+        self._plugins = None
+        self._failed = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='plugins', daemon=True)
+
+    def plugins(self) -> tuple:
+        """Returns the currently loaded plugins
+
+        The directory is scanned on the first call only, afterwards the
+        cached plugins are returned.
+
+        Returns
+        -------
+        Tuple of Plugins sorted by their path
+        """
+
+        plugins = self._plugins
+        if plugins is None:
+            plugins = self.refresh()
+        return plugins
+
+    def refresh(self) -> tuple:
+        """Scans the collectors directory and (re)loads changed modules
+
+        New scripts are imported, changed ones reloaded and removed ones
+        dropped. A script which fails to load is retried only after it
+        changed again, a previously loaded version of it stays in use.
+
+        Returns
+        -------
+        Tuple of Plugins sorted by their path
+        """
+
+        with self._lock:
+            current = {plugin.path: plugin for plugin in (self._plugins or ())}
+            plugins = {}
+
+            paths = sorted(glob.glob(os.path.join(self._directory, "*.py")))
+            if len(paths) != len(current) or any(path not in current for path in paths):
+                # let the import system see newly added files
+                importlib.invalidate_caches()
+
+            for path in paths:
+                try:
+                    version = _version(path)
+                except OSError:
+                    # removed while scanning
+                    continue
+
+                plugin = current.get(path)
+                if plugin is not None and plugin.version == version:
+                    plugins[path] = plugin
+                    continue
+                if self._failed.get(path) == version:
+                    if plugin is not None:
+                        plugins[path] = plugin
+                    continue
+
+                try:
+                    plugins[path] = self._load(path, version, plugin)
+                    self._failed.pop(path, None)
+                except BaseException as err:
+                    _LOGGER.error(f"Unexpected {err=}, {type(err)=} loading {path}")
+                    self._failed[path] = version
+                    if plugin is not None:
+                        plugins[path] = plugin
+
+            for path in current.keys() - plugins.keys():
+                _LOGGER.info("Removing collector {}".format(path))
+                sys.modules.pop(self._module_name(path), None)
+
+            self._plugins = tuple(plugins[path] for path in sorted(plugins))
+            return self._plugins
+
+    def start(self):
+        if self._poll_interval > 0:
+            _LOGGER.info("Watching {} for changes every {}s".format(self._directory, self._poll_interval))
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _module_name(self, path):
+        # convert the script file name into it's module name
+        # (hoping it doesn't contain any spaces or dash characters)
+        return self._package + "." + os.path.basename(path).replace('.py', '')
+
+    def _load(self, path, version, plugin) -> Plugin:
+        if plugin is None:
+            _LOGGER.info("Loading collector {}".format(path))
+        else:
+            _LOGGER.info("Reloading collector {}".format(path))
+
+        # execute the script in a fresh module instead of reloading the
+        # loaded one in place, a failing script would leave that one half
+        # updated. The module is only registered if it executed completely.
+        name = self._module_name(path)
+        package = importlib.import_module(self._package)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        previous = sys.modules.get(name)
+        sys.modules[name] = module
+        try:
+            spec.loader.exec_module(module)
+
+            # get it's parameter names
+            parameters = tuple(inspect.signature(module.collect).parameters)
+            coroutine = inspect.iscoroutinefunction(module.collect)
+        except BaseException:
+            if previous is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = previous
+            raise
+
+        setattr(package, name.rpartition('.')[2], module)
+
+        return Plugin(path, module, parameters, coroutine, version, time.time())
+
+    def _loop(self):
+        while not self._stopped.wait(self._poll_interval):
+            try:
+                self.refresh()
+            except Exception as err:
+                _LOGGER.error(f"Unexpected {err=}, {type(err)=}")
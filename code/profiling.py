@@ -0,0 +1,106 @@
+"""Collector Profiling
+
+This module runs a single collector under cProfile and/or tracemalloc on
+request of the debug endpoint /debug/profile of the api-collector, e.g.
+
+    curl 'http://localhost:8000/debug/profile?collector=ws_ips&cpu=1&memory=1&top=30'
+
+It returns the top functions by cumulative time and the top allocation
+sites as text, so slow collectors can be investigated in production
+without redeploying. The endpoint is disabled unless the environment
+variable API_COLLECTOR_PROFILING is set to 1.
+
+The allocation sites are those of the memory still held at the end of
+the run, including the result, along with the peak of the run.
+
+cProfile only sees the thread running the collector. The work of
+threads started by the collector, e.g. the parallel ranges of a Workload
+Security search, shows up as waiting for them.
+"""
+
+import os
+import io
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+PROFILING = os.environ.get('API_COLLECTOR_PROFILING', '0') == '1'
+
+_LOCK = threading.Lock()
+
+class ProfilingBusy(Exception):
+    """Raised if another profile is running"""
+
+def profile(run, cpu=True, memory=False, top=25) -> str:
+    """
+    Runs a function under the profilers and returns their report
+
+    Parameters
+    ----------
+    run
+        Callable() to profile, e.g. running a collector
+    cpu
+        Profile the functions by cProfile
+    memory
+        Trace the allocations by tracemalloc
+    top
+        Number of functions and allocation sites reported
+
+    Raises
+    ------
+    ProfilingBusy
+        Another profile is running
+
+    Returns
+    -------
+    The report as text
+    """
+
+    if not _LOCK.acquire(blocking=False):
+        raise ProfilingBusy("Another profile is running")
+
+    try:
+        profiler = cProfile.Profile() if cpu else None
+        tracing = memory and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(10)
+
+        error, result = None, None
+        start = time.monotonic()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            # keep the result while the allocations are traced
+            result = run()
+        except BaseException as err:
+            error = err
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            elapsed = time.monotonic() - start
+            snapshot = tracemalloc.take_snapshot() if memory else None
+            peak = tracemalloc.get_traced_memory()[1] if memory else 0
+            if tracing:
+                tracemalloc.stop()
+            del result
+
+        report = io.StringIO()
+        report.write("Run took {:.3f}s\n".format(elapsed))
+        if error is not None:
+            report.write(f"Run failed with {error=}, {type(error)=}\n")
+
+        if profiler is not None:
+            report.write("\nTop {} functions by cumulative time\n\n".format(top))
+            pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(top)
+
+        if snapshot is not None:
+            report.write("\nTop {} allocation sites, peak {:.1f} MB traced\n\n".format(top, peak / 1024 / 1024))
+            snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+            for statistic in snapshot.statistics('lineno')[:top]:
+                report.write("{}\n".format(statistic))
+
+        return report.getvalue()
+    finally:
+        _LOCK.release()
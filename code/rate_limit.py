@@ -0,0 +1,259 @@
+"""Adaptive Rate Control
+
+This module limits the requests sent to an API host. Every host gets a
+token bucket, limiting the rate of the requests, and a limit of the
+requests in flight. The limit adapts to the API by additive increase,
+multiplicative decrease (AIMD): it grows by one after a limit's worth of
+successful responses and is halved when the API throttles with a 429 or
+503. A Retry-After sent with it pauses all requests to the host, the
+further throttled responses to requests sent before the pause don't
+decrease the limit again. The throughput thereby settles at what the API
+allows, instead of alternating between floods of requests and failures.
+"""
+
+import time
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+
+_LOGGER = logging.getLogger(__name__)
+
+# Status codes the APIs throttle with
+THROTTLED = (429, 503)
+
+def retry_after(response, default=1.0, maximum=60.0) -> float:
+    """
+    Returns the seconds to wait as requested by a throttled response
+
+    Parameters
+    ----------
+    response
+        The requests.Response
+    default
+        Seconds to wait without a valid Retry-After header
+    maximum
+        Seconds to wait at most
+
+    Returns
+    -------
+    Seconds to wait
+    """
+
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return default
+
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return default
+    return min(max(seconds, 0.0), maximum)
+
+class TokenBucket():
+    """
+    This class represents a token bucket
+
+    Methods
+    -------
+    acquire
+        Takes a token, waiting for it if the bucket is empty
+    try_acquire
+        Takes a token if the bucket holds one
+    """
+
+    def __init__(self, rate, burst):
+        """
+        Parameters
+        ----------
+        rate
+            Tokens added per second, 0 for unlimited
+        burst
+            Tokens the bucket holds at most
+        """
+
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._tokens = self._burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None) -> bool:
+        """Takes a token, waiting at most timeout seconds for it
+
+        Returns
+        -------
+        False if no token was available in time
+        """
+
+        end = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if end is not None and time.monotonic() + wait > end:
+                return False
+            time.sleep(wait)
+
+    def try_acquire(self) -> float:
+        """Takes a token if the bucket holds one
+
+        Returns
+        -------
+        0 if a token was taken, otherwise the seconds until the next one
+        """
+
+        if self._rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self._rate
+
+class RateController():
+    """
+    This class represents the rate control of a single API host
+
+    Methods
+    -------
+    acquire
+        Waits until a request may be sent
+    try_acquire
+        Tells if a request may be sent now, without waiting
+    release
+        Reports the outcome of a request
+    """
+
+    def __init__(self, host, rate=0, burst=10, concurrency=10):
+        """
+        Parameters
+        ----------
+        host
+            The API host, used for logging
+        rate
+            Requests per second, 0 for unlimited
+        burst
+            Requests sent at once after an idle period
+        concurrency
+            Requests in flight at most
+        """
+
+        self.host = host
+        self._bucket = TokenBucket(rate, burst)
+        self._max_limit = max(concurrency, 1)
+        self.limit = float(self._max_limit)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._listeners = []
+
+    def acquire(self, timeout=None) -> bool:
+        """Waits until a request may be sent
+
+        A request needs a free slot within the limit of requests in
+        flight, no pause requested by the API and a token of the bucket.
+
+        Parameters
+        ----------
+        timeout
+            Seconds to wait at most, None to wait without limit
+
+        Returns
+        -------
+        False if the request may not be sent in time, it must not be
+        released then
+        """
+
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                left = None if end is None else end - now
+                pause = self._paused_until - now
+                if pause > 0 or self._in_flight >= int(self.limit):
+                    if left is not None and left <= 0:
+                        return False
+                    wait = pause if pause > 0 else left
+                    self._condition.wait(wait if left is None else min(wait, left))
+                else:
+                    self._in_flight += 1
+                    break
+
+        if not self._bucket.acquire(None if end is None else end - time.monotonic()):
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+                listeners, self._listeners = self._listeners, []
+            for listener in listeners:
+                listener()
+            return False
+        return True
+
+    def try_acquire(self, listener=None):
+        """Tells if a request may be sent now, without waiting
+
+        For callers which can't block, like coroutines. A request which
+        may be sent is to be released like an acquired one.
+
+        Parameters
+        ----------
+        listener
+            Callable without arguments, called once by the thread freeing
+            the next slot if all slots are taken
+
+        Returns
+        -------
+        0 if the request may be sent, otherwise the seconds to wait before
+        trying again, or None if all slots are taken
+        """
+
+        with self._condition:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                return pause
+            if self._in_flight >= int(self.limit):
+                if listener is not None:
+                    self._listeners.append(listener)
+                return None
+            wait = self._bucket.try_acquire()
+            if wait > 0:
+                return wait
+            self._in_flight += 1
+            return 0.0
+
+    def release(self, status=None, pause=0.0):
+        """Reports the outcome of a request
+
+        Parameters
+        ----------
+        status
+            HTTP status of the response, None if the request failed
+        pause
+            Seconds the API asked to pause, for a throttled response
+        """
+
+        with self._condition:
+            self._in_flight -= 1
+            if status in THROTTLED:
+                # the responses throttled during a pause were sent before
+                # it, the limit is decreased once per pause
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self.limit = max(1.0, self.limit / 2)
+                self._paused_until = max(self._paused_until, now + pause)
+                _LOGGER.info("{} throttled, limiting to {} requests in flight for {:.1f}s".format(
+                    self.host, int(self.limit), pause))
+            elif status is not None and status < 400:
+                self.limit = min(self._max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+            listeners, self._listeners = self._listeners, []
+
+        for listener in listeners:
+            listener()
@@ -0,0 +1,193 @@
+"""Workload Security IPS Rule Catalogue Cache
+
+This module caches the intrusion prevention rule catalogue of Workload
+Security. The catalogue only changes when Trend Micro ships rule updates,
+so instead of downloading it on every collector run it is kept in memory
+and persisted to local disk to survive restarts. Once the catalogue is
+older than it's TTL, only the rules changed since the last sync are
+fetched and merged into it.
+
+The cache is configured by environment variables:
+
+API_COLLECTOR_CACHE_DIR
+    Directory the catalogue is persisted to, default /var/cache/api-collector
+API_COLLECTOR_IPS_RULES_TTL
+    Seconds until the catalogue is synced again, default 3600
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+import ws_search
+
+_LOGGER = logging.getLogger(__name__)
+
+_CACHE_DIR = os.environ.get('API_COLLECTOR_CACHE_DIR', '/var/cache/api-collector')
+_TTL = float(os.environ.get('API_COLLECTOR_IPS_RULES_TTL', 3600))
+_RESULT_SET_SIZE = 5000
+
+# Rule changes are synced with this overlap in milliseconds, to be safe
+# against clock differences to the API
+_SYNC_OVERLAP = 3600 * 1000
+
+# Attributes of a rule kept in the catalogue
+_ATTRIBUTES = ('priority', 'severity', 'type', 'detectOnly')
+
+class IpsRuleCache():
+    """
+    This class represents the cached IPS rule catalogue of a Workload
+    Security account
+
+    Methods
+    -------
+    rules
+        Returns the catalogue, synced with the API if required
+    """
+
+    def __init__(self, c1_url, api_key, cache_dir=_CACHE_DIR, ttl=_TTL):
+        """
+        Parameters
+        ----------
+        c1_url
+            Cloud One endpoint, e.g. us-1.cloudone.trendmicro.com
+        api_key
+            Workload Security API key
+        cache_dir
+            Directory the catalogue is persisted to
+        ttl
+            Seconds until the catalogue is synced again
+        """
+
+        self._c1_url = c1_url
+        self._api_key = api_key
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+        # one file per account, without exposing the key in the file name
+        account = hashlib.sha256((c1_url + api_key).encode()).hexdigest()[:16]
+        self._path = os.path.join(cache_dir, "ips_rules_" + account + ".json")
+
+        self._rules = {}
+        self._synced = 0
+        self._checked = 0
+        self._load()
+
+    def rules(self, required=()) -> dict:
+        """Returns the rule catalogue
+
+        The catalogue is synced with the API if it is older than the TTL or
+        if any of the required rule IDs is unknown.
+
+        Parameters
+        ----------
+        required
+            Rule IDs which need to be contained in the catalogue
+
+        Raises
+        ------
+        ValueError
+            Invalid API Key
+
+        Returns
+        -------
+        {
+            ID:
+            {
+                "priority",
+                "severity",
+                "type",
+                "detectOnly"
+            },
+        }
+        """
+
+        with self._lock:
+            expired = time.time() - self._checked >= self._ttl
+            missing = any(rule_id not in self._rules for rule_id in required)
+            if expired or missing:
+                self._sync()
+            return self._rules
+
+    def _sync(self):
+        started = int(time.time() * 1000)
+
+        if self._synced == 0:
+            _LOGGER.info("Downloading IPS rule catalogue")
+            criteria = []
+        else:
+            _LOGGER.info("Syncing IPS rules changed since {}".format(self._synced))
+            criteria = [{
+                "fieldName": "lastUpdated",
+                "firstDate": self._synced - _SYNC_OVERLAP,
+                "firstDateInclusive": True,
+            }]
+
+        rules = dict(self._rules)
+        changed = 0
+        for rule in ws_search.search(self._c1_url, self._api_key, 'intrusionpreventionrules',
+                                     'intrusionPreventionRules', criteria, max_items=_RESULT_SET_SIZE):
+            rules[rule['ID']] = {attribute: rule[attribute] for attribute in _ATTRIBUTES}
+            changed += 1
+
+        # publish the new catalogue only once it is complete
+        self._rules = rules
+        self._synced = started
+        self._checked = time.time()
+        _LOGGER.debug("IPS rules changed: {}, in catalogue: {}".format(changed, len(rules)))
+
+        self._save()
+
+    def _load(self):
+        try:
+            with open(self._path, 'r') as file:
+                cached = json.load(file)
+            # JSON object keys are strings, the rule IDs are integers
+            self._rules = {int(rule_id): rule for rule_id, rule in cached['rules'].items()}
+            self._synced = cached['synced']
+            self._checked = cached['synced'] / 1000
+            _LOGGER.info("Loaded {} IPS rules from {}".format(len(self._rules), self._path))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as err:
+            _LOGGER.warning(f"Ignoring IPS rule cache {self._path}: {err=}")
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self._path), exist_ok=True)
+            temp = self._path + ".tmp"
+            with open(temp, 'w') as file:
+                json.dump({"synced": self._synced, "rules": self._rules}, file)
+            # replace atomically, a crash never leaves a truncated cache
+            os.replace(temp, self._path)
+        except OSError as err:
+            _LOGGER.warning(f"Unable to persist IPS rule cache {self._path}: {err=}")
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+def get_ips_rules(c1_url, api_key, required=()) -> dict:
+    """
+    Returns the IPS rule catalogue of a Workload Security account
+
+    Parameters
+    ----------
+    c1_url
+        Cloud One endpoint, e.g. us-1.cloudone.trendmicro.com
+    api_key
+        Workload Security API key
+    required
+        Rule IDs which need to be contained in the catalogue
+
+    Returns
+    -------
+    Dictionary of the rule attributes by rule ID, see IpsRuleCache.rules
+    """
+
+    with _CACHES_LOCK:
+        cache = _CACHES.get((c1_url, api_key))
+        if cache is None:
+            cache = _CACHES[(c1_url, api_key)] = IpsRuleCache(c1_url, api_key)
+    return cache.rules(required)
@@ -0,0 +1,146 @@
+"""Background Collection Scheduler
+
+This module runs the collectors on their own timer, independent of the
+Prometheus scrapes. The results of the latest runs are kept as an
+immutable snapshot, which the CustomCollector serves on every scrape.
+Scrapes therefore return immediately, no matter how slow the APIs are,
+and multiple Prometheus replicas do not multiply the load on the APIs.
+"""
+
+import os
+import time
+import threading
+import logging
+from collections import namedtuple
+from types import MappingProxyType
+from prometheus_client.core import GaugeMetricFamily
+
+_LOGGER = logging.getLogger(__name__)
+
+# A single collector result, timestamp is the start of the collector run
+CollectorResult = namedtuple('CollectorResult', ['collector', 'family', 'timestamp'])
+
+class Snapshot(namedtuple('Snapshot', ['generation', 'results'])):
+    """
+    This class represents an immutable set of collector results
+
+    Attributes
+    ----------
+    generation
+        Increasing number of the snapshot, starting with 0 for the empty one
+    results
+        Read-only mapping of the collector path to it's CollectorResult
+
+    Methods
+    -------
+    collect
+        Yields the metric families of the snapshot together with their age
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, generation=0, results=None):
+        return super().__new__(cls, generation, MappingProxyType(dict(results or {})))
+
+    def collect(self):
+        """Yields the metric families of this snapshot
+
+        An additional gauge family reports the age of each metric family
+        in seconds at the time of the scrape.
+        """
+
+        now = time.time()
+        age = GaugeMetricFamily('api_collector_snapshot_age_seconds',
+                                'Age of the collector results served for a metric family',
+                                labels=['family'])
+
+        for result in self.results.values():
+            age.add_metric([result.family.name], now - result.timestamp)
+            yield result.family
+
+        yield age
+
+class CollectorScheduler():
+    """
+    This class represents the background collection scheduler
+
+    Methods
+    -------
+    start
+        Starts the background thread running the collectors
+    stop
+        Stops the background thread
+    run_once
+        Runs all collectors and publishes a new snapshot
+    snapshot
+        Returns the latest published snapshot
+    """
+
+    def __init__(self, run, interval):
+        """
+        Parameters
+        ----------
+        run
+            Callable returning an iterable of CollectorResults for all
+            collectors which succeeded
+        interval
+            Seconds between the starts of two collection runs
+        """
+
+        self._run = run
+        self._interval = interval
+        self._snapshot = Snapshot()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='scheduler', daemon=True)
+
+    def start(self):
+        _LOGGER.info("Starting scheduler with an interval of {}s".format(self._interval))
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def run_once(self) -> Snapshot:
+        """Runs all collectors and publishes a new snapshot
+
+        Results of collectors which failed in this run are carried over
+        from the previous snapshot, their age keeps increasing. Results of
+        collectors which were removed are dropped.
+
+        Returns
+        -------
+        The newly published snapshot
+        """
+
+        previous = self._snapshot
+        results = {collector: result for collector, result in previous.results.items()
+                   if os.path.exists(collector)}
+
+        for result in self._run():
+            results[result.collector] = result
+
+        # publishing is a single reference assignment, scrapes either see
+        # the previous or the new snapshot
+        self._snapshot = Snapshot(previous.generation + 1, results)
+        return self._snapshot
+
+    def _loop(self):
+        next_run = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as err:
+                _LOGGER.error(f"Unexpected {err=}, {type(err)=}")
+
+            next_run += self._interval
+            delay = next_run - time.monotonic()
+            if delay < 0:
+                # the run took longer than the interval, skip the missed runs
+                _LOGGER.warning("Collector run exceeded the interval of {}s".format(self._interval))
+                next_run = time.monotonic()
+                delay = 0
+            self._stopped.wait(delay)
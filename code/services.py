@@ -0,0 +1,308 @@
+"""Service Registry
+
+This module implements the dependency injection of the api-collector. A
+collector declares the services it needs as parameters of it's collect()
+function, e.g. collect(workload, cache). The services are long-lived
+objects, built once and injected by their parameter name on every run,
+so the collectors reuse pooled, pre-authenticated clients instead of
+reading credentials and building headers on every run.
+
+The following services are available:
+
+credentials
+    CredentialProvider for the mounted Cloud One credentials
+http
+    The shared HttpClient
+async_http
+    The shared AsyncHttpClient for async collectors
+workload, container, filestorage, application
+    ApiClient of the Cloud One service, authenticated by the credentials
+cache
+    Cache handle for data kept across runs, like the IPS rule catalogue
+"""
+
+import os
+import inspect
+import functools
+import threading
+import logging
+from datetime import timedelta
+import http_client
+import async_runtime
+import rule_cache
+import ws_search
+import event_window
+import http_replay
+
+_LOGGER = logging.getLogger(__name__)
+
+_CREDENTIALS_DIR = os.environ.get('API_COLLECTOR_CREDENTIALS_DIR', '/etc/cloudone-credentials')
+
+class CredentialProvider():
+    """
+    This class represents the Cloud One credentials mounted from a secret
+
+    The credential files are read on first access and again only after
+    they changed, e.g. when the secret was updated.
+
+    Methods
+    -------
+    get
+        Returns a credential by it's file name
+    """
+
+    def __init__(self, directory=_CREDENTIALS_DIR):
+        self._directory = directory
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, name) -> str:
+        """Returns a credential by it's file name, e.g. api_key"""
+
+        path = os.path.join(self._directory, name)
+        version = os.stat(path).st_mtime_ns
+
+        cached = self._values.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            with open(path, 'r') as file:
+                value = file.read().rstrip('\n')
+            self._values[name] = (version, value)
+            return value
+
+    @property
+    def c1_url(self) -> str:
+        return self.get('c1_url')
+
+    @property
+    def api_key(self) -> str:
+        return self.get('api_key')
+
+    @property
+    def ws_key(self) -> str:
+        return self.get('ws_key')
+
+class ApiClient():
+    """
+    This class represents the authenticated client of a Cloud One service
+
+    The methods take the path of the API resource and the same further
+    arguments as the HttpClient.
+
+    Methods
+    -------
+    url
+        Returns the URL of an API resource
+    headers
+        Returns the authentication headers
+    request
+        Sends a request to the service
+    get
+        Sends a GET request
+    post
+        Sends a POST request
+    """
+
+    def __init__(self, service, credentials, http):
+        """
+        Parameters
+        ----------
+        service
+            Name of the Cloud One service, e.g. container
+        credentials
+            The CredentialProvider
+        http
+            The HttpClient to send the requests with
+        """
+
+        self.service = service
+        self._credentials = credentials
+        self._http = http
+
+    @property
+    def base_url(self) -> str:
+        return "https://" + self.service + "." + self._credentials.c1_url
+
+    def url(self, path) -> str:
+        return self.base_url + path
+
+    def headers(self) -> dict:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": "ApiKey " + self._credentials.api_key,
+            "api-version": "v1",
+        }
+
+    def request(self, method, path, **kwargs):
+        headers = self.headers()
+        headers.update(kwargs.pop('headers', None) or {})
+        kwargs.setdefault('verify', True)
+        return self._http.request(method, self.url(path), headers=headers, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+class WorkloadClient(ApiClient):
+    """
+    This class represents the authenticated client of Workload Security
+
+    Workload Security is authenticated by it's own API key.
+
+    Methods
+    -------
+    search
+        Pages through a /search endpoint, see ws_search.search
+    """
+
+    def __init__(self, credentials, http):
+        super().__init__('workload', credentials, http)
+
+    def headers(self) -> dict:
+        return {
+            "Content-type": "application/json",
+            "api-secret-key": self._credentials.ws_key,
+            "api-version": "v1",
+        }
+
+    def search(self, resource, key, criteria=(), **kwargs):
+        return ws_search.search(self._credentials.c1_url, self._credentials.ws_key,
+                                resource, key, criteria, **kwargs)
+
+class Cache():
+    """
+    This class represents the handle to the data kept across runs
+
+    Methods
+    -------
+    ips_rules
+        Returns the cached Workload Security IPS rule catalogue
+    event_window
+        Returns a named EventWindow of the account
+    """
+
+    def __init__(self, credentials):
+        self._credentials = credentials
+
+    def ips_rules(self, required=()) -> dict:
+        return rule_cache.get_ips_rules(self._credentials.c1_url, self._credentials.ws_key, required)
+
+    def event_window(self, name, window=timedelta(minutes=5)) -> event_window.EventWindow:
+        # the clock is recorded and replayed with the API responses
+        return event_window.get_window("{} {}".format(name, self._credentials.c1_url), window,
+                                       clock=functools.partial(http_replay.clock, name))
+
+class ServiceRegistry():
+    """
+    This class represents the registry of the named services
+
+    Methods
+    -------
+    register
+        Registers the factory of a service
+    get
+        Returns a service, built on first use
+    build
+        Builds all registered services
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, factory):
+        """Registers the factory of a service
+
+        Parameters
+        ----------
+        name
+            Name of the service, which is the parameter name it is
+            injected by
+        factory
+            Callable(registry) returning the service
+        """
+
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def get(self, name):
+        """Returns a service, built on first use
+
+        Raises
+        ------
+        KeyError
+            Unknown service
+        """
+
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if name not in self._instances:
+                if name not in self._factories:
+                    raise KeyError("Unknown service {}".format(name))
+                self._instances[name] = self._factories[name](self)
+            return self._instances[name]
+
+    def build(self):
+        """Builds all registered services"""
+
+        for name in list(self._factories):
+            try:
+                self.get(name)
+            except Exception as err:
+                _LOGGER.error(f"Unexpected {err=}, {type(err)=} building service {name}")
+
+SERVICES = ServiceRegistry()
+SERVICES.register('credentials', lambda registry: CredentialProvider())
+SERVICES.register('http', lambda registry: http_client.get_client())
+SERVICES.register('async_http', lambda registry: async_runtime.get_async_client())
+SERVICES.register('workload', lambda registry: WorkloadClient(registry.get('credentials'), registry.get('http')))
+for _service in ('container', 'filestorage', 'application'):
+    SERVICES.register(_service, lambda registry, service=_service: ApiClient(
+        service, registry.get('credentials'), registry.get('http')))
+SERVICES.register('cache', lambda registry: Cache(registry.get('credentials')))
+
+def get_service_instance(name):
+    """
+    Returns the service injected for a parameter name
+
+    Parameters
+    ----------
+    name
+        Parameter name of a collect() function
+
+    Raises
+    ------
+    KeyError
+        Unknown service
+
+    Returns
+    -------
+    The service instance
+    """
+
+    return SERVICES.get(name)
+
+def inject(function) -> dict:
+    """
+    Returns the services to call a function with
+
+    Parameters
+    ----------
+    function
+        Function taking services as parameters, e.g. collect()
+
+    Returns
+    -------
+    Dictionary of the services by parameter name
+    """
+
+    return {name: get_service_instance(name) for name in inspect.signature(function).parameters}
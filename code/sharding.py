@@ -0,0 +1,125 @@
+"""Collector Sharding
+
+This module distributes the collectors across the replicas of the
+api-collector. Every replica runs only the collectors assigned to it,
+Prometheus scrapes all replicas.
+
+The assignment uses rendezvous hashing. Each replica scores a collector
+by a hash of the collector and it's own ordinal, the replica with the
+highest score owns the collector. All replicas agree on the assignment
+without talking to each other, and adding or removing a replica only
+moves the collectors it wins or owned, about 1/count of them.
+
+The replica is configured by the environment variables
+API_COLLECTOR_REPLICA_COUNT (default 1) and API_COLLECTOR_REPLICA_ORDINAL.
+Without the ordinal, it is taken from the trailing number of the host
+name, e.g. api-collector-2 of a StatefulSet. With a single replica, the
+ordinal is ignored.
+
+Run this module with the collector names to print their assignment:
+
+    python3 sharding.py 3 ws_ips ws_ips_rules cs_eps
+"""
+
+import os
+import re
+import sys
+import socket
+import hashlib
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+def _ordinal_from_hostname(hostname) -> int:
+    match = re.search(r'-(\d+)$', hostname)
+    return int(match.group(1)) if match else 0
+
+def _replica_ordinal(count) -> int:
+    """Returns the ordinal of this replica
+
+    A single replica is always 0. Otherwise the ordinal is taken from
+    API_COLLECTOR_REPLICA_ORDINAL or the host name. A host name not ending
+    with an ordinal in range, e.g. of a Deployment's pod, is logged and
+    taken as 0.
+    """
+
+    ordinal = os.environ.get('API_COLLECTOR_REPLICA_ORDINAL')
+    if ordinal is not None:
+        return int(ordinal)
+    if count <= 1:
+        return 0
+
+    hostname = os.environ.get('HOSTNAME', socket.gethostname())
+    ordinal = _ordinal_from_hostname(hostname)
+    if not 0 <= ordinal < count:
+        _LOGGER.error("Host name {} has no replica ordinal within {} replicas, "
+                      "set API_COLLECTOR_REPLICA_ORDINAL. Running as replica 0".format(hostname, count))
+        return 0
+    return ordinal
+
+REPLICA_COUNT = int(os.environ.get('API_COLLECTOR_REPLICA_COUNT', 1))
+REPLICA_ORDINAL = _replica_ordinal(REPLICA_COUNT)
+
+def score(key, ordinal) -> int:
+    """Returns the score of a replica for a key"""
+
+    digest = hashlib.blake2b("{}\0{}".format(key, ordinal).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def owner(key, count) -> int:
+    """
+    Returns the ordinal of the replica owning a key
+
+    Parameters
+    ----------
+    key
+        The key to assign, e.g. the name of a collector
+    count
+        Number of replicas
+
+    Returns
+    -------
+    Ordinal of the owning replica
+    """
+
+    return max(range(count), key=lambda ordinal: score(key, ordinal))
+
+class Shard():
+    """
+    This class represents the share of the collectors of a replica
+
+    Methods
+    -------
+    owns
+        Tells if a key is assigned to this replica
+    """
+
+    def __init__(self, ordinal=REPLICA_ORDINAL, count=REPLICA_COUNT):
+        """
+        Parameters
+        ----------
+        ordinal
+            Ordinal of this replica, starting with 0
+        count
+            Number of replicas
+        """
+
+        # a single replica owns everything, whatever it's ordinal
+        if count == 1:
+            ordinal = 0
+        if not 0 <= ordinal < count:
+            raise ValueError("Replica ordinal {} out of range for {} replicas".format(ordinal, count))
+
+        self.ordinal = ordinal
+        self.count = count
+
+    def owns(self, key) -> bool:
+        return self.count == 1 or owner(key, self.count) == self.ordinal
+
+    def __str__(self):
+        return "replica {} of {}".format(self.ordinal, self.count)
+
+if __name__ == '__main__':
+    count = int(sys.argv[1])
+    for key in sys.argv[2:]:
+        print("{} {}".format(owner(key, count), key))
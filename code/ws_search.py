@@ -0,0 +1,279 @@
+"""Workload Security Search Paging
+
+This module pages through the /search endpoints of Workload Security,
+e.g. computers or intrusionpreventionrules. The first page is fetched on
+it's own, which is all a small account needs. For larger accounts, the
+remaining ID space is split into ranges which are fetched concurrently
+with a bounded fan-out. The items are returned as a stream, so no
+single response needs to hold the whole result set.
+
+In streaming mode, the responses are parsed while they are downloaded
+and each item is handed to the collector on it's own. The memory
+required then stays flat, independent of the size of the account.
+
+The paging is configured by environment variables:
+
+API_COLLECTOR_WS_SEARCH_WORKERS
+    Ranges fetched concurrently per search, default 4
+API_COLLECTOR_WS_SEARCH_RANGE
+    Size of the ID ranges, default 5000
+API_COLLECTOR_WS_SEARCH_STREAM
+    Use the streaming mode, default 0
+"""
+
+import os
+import json
+import queue
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+import json_stream
+import deadline
+
+_LOGGER = logging.getLogger(__name__)
+
+_WORKERS = int(os.environ.get('API_COLLECTOR_WS_SEARCH_WORKERS', 4))
+_RANGE_SIZE = int(os.environ.get('API_COLLECTOR_WS_SEARCH_RANGE', 5000))
+_STREAM = os.environ.get('API_COLLECTOR_WS_SEARCH_STREAM', '0') == '1'
+
+class WorkloadSearch():
+    """
+    This class represents a search on a Workload Security /search endpoint
+
+    Methods
+    -------
+    items
+        Returns the stream of the items found
+    """
+
+    def __init__(self, c1_url, api_key, resource, key, criteria=(), params=None,
+                 max_items=1000, range_size=_RANGE_SIZE, workers=_WORKERS, stream=_STREAM):
+        """
+        Parameters
+        ----------
+        c1_url
+            Cloud One endpoint, e.g. us-1.cloudone.trendmicro.com
+        api_key
+            Workload Security API key
+        resource
+            API resource to search, e.g. computers
+        key
+            Key of the item list in the response, e.g. computers
+        criteria
+            Additional search criteria
+        params
+            Query parameters, e.g. {"expand": "intrusionPrevention"}
+        max_items
+            Items per page
+        range_size
+            Size of the ID ranges fetched concurrently
+        workers
+            Ranges fetched concurrently
+        stream
+            Parse the responses while they are downloaded. The items are
+            not held in memory, but the responses are not shared with
+            identical searches of other collectors.
+        """
+
+        self._url = "https://workload." + c1_url + "/api/" + resource + "/search"
+        self._api_key = api_key
+        self._key = key
+        self._criteria = list(criteria)
+        self._params = params
+        self._max_items = max_items
+        self._range_size = range_size
+        self._workers = workers
+        self._stream = stream
+
+    def items(self):
+        """Returns the stream of the items found
+
+        Items of the first page are returned in ID order, the remaining
+        ones in the order they are received from the concurrently fetched
+        ranges.
+
+        Raises
+        ------
+        ValueError
+            Invalid API Key
+        """
+
+        count = 0
+        first = 0
+        for item in self._page(after=0):
+            count += 1
+            first = item['ID']
+            yield item
+        if count < self._max_items:
+            return
+
+        end = self._upper_bound(first)
+
+        # the first range starts after the last item seen, the following
+        # ones include their start ID
+        starts = range(first + 1, end, self._range_size)
+        ranges = iter([(max(first, start - 1), min(start + self._range_size, end)) for start in starts])
+        _LOGGER.debug("Searching {} IDs {} to {} in {} ranges".format(
+            self._url, first, end, len(starts)))
+
+        # the ranges hand their items over through a bounded queue, so only
+        # a bounded number of items is held in memory
+        items = queue.Queue(maxsize=self._max_items)
+        stopped = threading.Event()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+            raise _Stopped()
+
+        def fetch(id_range):
+            try:
+                self._range(*id_range, put)
+                put(_RANGE_DONE)
+            except _Stopped:
+                pass
+            except BaseException as err:
+                put(_RangeFailed(err))
+
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix='ws_search') as executor:
+            try:
+                active = 0
+                for id_range in ranges:
+                    executor.submit(deadline.bind(fetch), id_range)
+                    active += 1
+                    if active >= self._workers:
+                        break
+
+                while active:
+                    item = items.get()
+                    if item is _RANGE_DONE:
+                        active -= 1
+                        id_range = next(ranges, None)
+                        if id_range is not None:
+                            executor.submit(deadline.bind(fetch), id_range)
+                            active += 1
+                    elif isinstance(item, _RangeFailed):
+                        raise item.error
+                    else:
+                        yield item
+            finally:
+                # let the remaining ranges give up, e.g. if the consumer
+                # stopped early or a range failed
+                stopped.set()
+
+    def _upper_bound(self, start) -> int:
+        """Finds an ID above all existing ones by exponential probing"""
+
+        step = max(start, self._range_size)
+        end = start + step
+        while any(True for item in self._page(after=end - 1, max_items=1)):
+            step *= 2
+            end = start + step
+        return end
+
+    def _range(self, after, before, put):
+        """Pages through the IDs after < ID < before"""
+
+        while True:
+            count = 0
+            for item in self._page(after, before):
+                count += 1
+                after = item['ID']
+                put(item)
+            if count < self._max_items:
+                return
+
+    def _page(self, after, before=None, max_items=None):
+        """Returns an iterable of the items of a single page"""
+
+        criteria = self._criteria + [
+            {
+                "fieldName": "ID",
+                "idTest": "greater-than",
+                "idValue": after,
+            }
+        ]
+        if before is not None:
+            criteria.append({
+                "fieldName": "ID",
+                "idTest": "less-than",
+                "idValue": before,
+            })
+        data = {
+            "maxItems": max_items or self._max_items,
+            "searchCriteria": criteria,
+            "sortByObjectID": True,
+        }
+        post_header = {
+            "Content-type": "application/json",
+            "api-secret-key": self._api_key,
+            "api-version": "v1",
+        }
+
+        # searches don't modify anything, identical ones of other
+        # collectors can share the response unless it is streamed
+        response = http_client.get_client().post(
+            self._url, params=self._params, data=json.dumps(data), headers=post_header,
+            verify=True, coalesce=not self._stream, stream=self._stream
+        )
+
+        if self._stream:
+            return self._stream_items(response)
+
+        response = response.json()
+        self._check(response)
+        return response.get(self._key, [])
+
+    def _stream_items(self, response):
+        stream = json_stream.JsonStream(response, self._key)
+        yield from stream.items()
+        self._check(stream.fields)
+
+    def _check(self, response):
+        # Error handling
+        if "message" in response:
+            if response['message'] == "Invalid API Key":
+                _LOGGER.error("API error: {}".format(response['message']))
+                raise ValueError("Invalid API Key")
+
+class _Stopped(Exception):
+    """Raised within a range which is no longer consumed"""
+
+class _RangeFailed():
+    """Hands the error of a range over to the consumer"""
+
+    def __init__(self, error):
+        self.error = error
+
+_RANGE_DONE = object()
+
+def search(c1_url, api_key, resource, key, criteria=(), **kwargs):
+    """
+    Search a Workload Security /search endpoint
+
+    Parameters
+    ----------
+    c1_url
+        Cloud One endpoint, e.g. us-1.cloudone.trendmicro.com
+    api_key
+        Workload Security API key
+    resource
+        API resource to search, e.g. computers
+    key
+        Key of the item list in the response, e.g. computers
+    criteria
+        Additional search criteria
+    kwargs
+        Further arguments of WorkloadSearch
+
+    Returns
+    -------
+    Generator of the items found
+    """
+
+    return WorkloadSearch(c1_url, api_key, resource, key, criteria, **kwargs).items()
@@ -11,9 +11,8 @@ with python3 <FILENAME>. You need to ensure the presence of the
 credentials in the given directory.
 """
 
-import json
-import requests
 import logging
+import services
 import sys
 from datetime import datetime, timedelta
 
@@ -23,13 +22,17 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s (%(threadName)s) [%(funcName)s] %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
-def collect() -> dict:
+# Group settings rarely change, refresh them once an hour
+REFRESH_INTERVAL = 3600
+
+def collect(application) -> dict:
     """
     Query an API, calculate the required metrics and return a JSON object
     
     Parameters
     ----------
-    none
+    application
+        Authenticated client of Application Security
 
     Raises
     ------
@@ -46,11 +49,7 @@ def collect() -> dict:
     }
     """
 
-    # API credentials are mounted to /etc
-    c1_url = open('/etc/cloudone-credentials/c1_url', 'r').read().rstrip('\n')
-    api_key = open('/etc/cloudone-credentials/api_key', 'r').read().rstrip('\n')
-
-    _LOGGER.debug("Cloud One API endpoint: {}".format(c1_url))
+    _LOGGER.debug("Cloud One API endpoint: {}".format(application.base_url))
 
     # Define your metrics here
     result = {
@@ -67,15 +66,7 @@ def collect() -> dict:
     }
 
     # API query and response parsing here
-    url = "https://application." + c1_url + "/accounts/groups"
-    post_header = {
-        "Content-Type": "application/json",
-        "Authorization": "ApiKey " + api_key,
-        "api-version": "v1",
-    }
-    response = requests.get(
-        url, headers=post_header, verify=True
-    ).json()
+    response = application.get("/accounts/groups").json()
 
     # Error handling
     if "message" in response:
@@ -141,4 +132,4 @@ def collect() -> dict:
     return result
 
 if __name__ == '__main__':
-    collect()
\ No newline at end of file
+    collect(**services.inject(collect))
\ No newline at end of file
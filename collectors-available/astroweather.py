@@ -15,7 +15,7 @@ credentials in the given directory.
 """
 
 import json
-import requests
+import services
 import time
 from datetime import datetime, timedelta
 import logging
@@ -25,13 +25,17 @@ _LOGGER = logging.getLogger(__name__)
 LONGITUDE=11.985
 LATITUDE=48.313
 
-def collect() -> dict:
+# 7Timer regenerates the forecast every few hours, refresh it once an hour
+REFRESH_INTERVAL=3600
+
+def collect(http) -> dict:
     """
     Query an API, calculate the required metrics and return a JSON object
     
     Parameters
     ----------
-    none
+    http
+        The shared HTTP client
 
     Raises
     ------
@@ -48,8 +52,6 @@ def collect() -> dict:
     }
     """
 
-    # API credentials are mounted to /etc
-
     # Define your metrics here
     result = {
         "CounterMetricFamilyName": "astroweather",
@@ -64,7 +66,7 @@ def collect() -> dict:
     post_header = {
         "Content-type": "application/json",
     }
-    resp = requests.get(
+    resp = http.get(
         url, data=json.dumps(data), headers=post_header, verify=True
     )
     plain = str(resp.text).replace("\n", " ")
@@ -122,4 +124,4 @@ def collect() -> dict:
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG, format='%(relativeCreated)6d %(threadName)s %(message)s')
-    collect()
\ No newline at end of file
+    collect(**services.inject(collect))
\ No newline at end of file
@@ -5,14 +5,15 @@ information from File Storage Security by it's RESTful API, calculates some
 metrics and creates a dictionary which is feedede into Prometheus
 by the api-collector.
 
-This file has one single funtion collect(), which is called by the
-api-collector. For testing purposes, one can directly run the collector
-with python3 <FILENAME>. You need to ensure the presence of the
+This file has one single async funtion collect(), which is run on the
+event loop of the api-collector. For testing purposes, one can directly
+run the collector with python3 <FILENAME>. You need to ensure the presence of the
 credentials in the given directory.
 """
 
 import json
-import requests
+import asyncio
+import services
 import logging
 import sys
 from datetime import datetime, timedelta
@@ -23,13 +24,20 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s (%(threadName)s) [%(funcName)s] %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
-def collect() -> dict:
+# The statistics are aggregated hourly, refreshing them every 15 minutes
+# is sufficient
+REFRESH_INTERVAL = 900
+
+async def collect(filestorage, async_http) -> dict:
     """
     Query an API, calculate the required metrics and return a JSON object
     
     Parameters
     ----------
-    none
+    filestorage
+        Authenticated client of File Storage Security
+    async_http
+        The shared HTTP client for async collectors
 
     Raises
     ------
@@ -46,10 +54,6 @@ def collect() -> dict:
     }
     """
 
-    # API credentials are mounted to /etc
-    c1_url = open('/etc/cloudone-credentials/c1_url', 'r').read().rstrip('\n')
-    api_key = open('/etc/cloudone-credentials/api_key', 'r').read().rstrip('\n')
-
     # Define your metrics here
     result = {
         "CounterMetricFamilyName": "fss_statistics",
@@ -62,18 +66,18 @@ def collect() -> dict:
     endTime = datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=999).strftime("%Y-%m-%dT%H:%M:%SZ")
     interval = "1h"
 
-    # API query and response parsing here
-    url = "https://filestorage." + c1_url + "/api/statistics/scans?from=" \
+    # API queries, the statistics and the stacks are requested concurrently
+    statistics_url = filestorage.url("/api/statistics/scans?from=" \
         + startTime + "&to=" \
-        + endTime + "&interval=" + interval
-    post_header = {
-        "Content-Type": "application/json",
-        "Authorization": "ApiKey " + api_key,
-        "api-version": "v1",
-    }
-    response = requests.get(
-        url, headers=post_header, verify=True
-    ).json()
+        + endTime + "&interval=" + interval)
+    stacks_url = filestorage.url("/api/stacks")
+    post_header = filestorage.headers()
+    statistics_response, stacks_response = await asyncio.gather(
+        async_http.get(statistics_url, headers=post_header, verify=True),
+        async_http.get(stacks_url, headers=post_header, verify=True),
+    )
+
+    response = statistics_response.json()
 
     # Error handling
     if "message" in response:
@@ -95,15 +99,7 @@ def collect() -> dict:
     result['Metrics'].append([['scans'], scans])
     result['Metrics'].append([['detections'], detections])
 
-    url = "https://filestorage." + c1_url + "/api/stacks" 
-    post_header = {
-        "Content-Type": "application/json",
-        "Authorization": "ApiKey " + api_key,
-        "api-version": "v1",
-    }
-    response = requests.get(
-        url, headers=post_header, verify=True
-    ).json()
+    response = stacks_response.json()
 
     # Error handling
     if "message" in response:
@@ -129,4 +125,4 @@ def collect() -> dict:
     return result
 
 if __name__ == '__main__':
-    collect()
\ No newline at end of file
+    asyncio.run(collect(**services.inject(collect)))
\ No newline at end of file
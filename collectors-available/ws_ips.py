@@ -11,102 +11,36 @@ with python3 <FILENAME>. You need to ensure the presence of the
 credentials in the given directory.
 """
 
-import json
-import requests
+import services
+import columnar
+from array import array
 import sys
 import logging
 
 # Constants
-_RESULT_SET_SIZE = 5000
 _LOGGER = logging.getLogger(__name__)
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s (%(threadName)s) [%(funcName)s] %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
-def create_rules_dict(c1_url, api_key) -> dict:
-    """
-    Build a dictionary of IPS rules and some of their attributes
-    
-    Parameters
-    ----------
-    none
+# Only the heaviest computers keep their own series within the cardinality
+# budget, the others are folded into "other"
+CARDINALITY_LABELS = ['displayName']
 
-    Raises
-    ------
-    ValueError
-        Houston, we have a problem
+# Attributes reported per computer, in the order of their values
+_ATTRIBUTES = ('info', 'rule_count', 'severity_low', 'severity_medium', 'severity_high',
+               'severity_crititcal', 'type_vulnerability', 'type_exploit')
 
-    Returns
-    -------
-    {
-        "ID":
-        {
-            "priority",
-            "severity",
-            "type",
-            "detectOnly"
-        },
-    }
-    """
-
-    result = {}
-    
-    dict_len = 0
-    offset = 0
-    while True:
-
-        # API query and response parsing here
-        url = "https://workload." + c1_url + "/api/intrusionpreventionrules/search"
-        data = {
-            "maxItems": _RESULT_SET_SIZE,
-            "searchCriteria": [
-                {
-                    "fieldName": "ID",
-                    "idTest": "less-than",
-                    "idValue": offset + _RESULT_SET_SIZE,
-                }
-            ],
-        }
-        post_header = {
-            "Content-type": "application/json",
-            "api-secret-key": api_key,
-            "api-version": "v1",
-        }
-        response = requests.post(
-            url, data=json.dumps(data), headers=post_header, verify=True
-        ).json()
-
-        # Error handling
-        if "message" in response:
-            if response['message'] == "Invalid API Key":
-                raise ValueError("Invalid API Key")
-
-        for rule in response['intrusionPreventionRules']:
-            result[rule['ID']] = {
-                "priority": rule['priority'],
-                "severity": rule['severity'],
-                "type": rule['type'],
-                "detectOnly": rule['detectOnly']
-            }
-
-        if len(rule) != 0 and len(rule) == dict_len:
-            dict_len = len(rule)
-            break
-        if len(rule) != 0 and len(rule) != dict_len:
-            dict_len = len(rule)
-
-        offset += _RESULT_SET_SIZE
-
-    _LOGGER.debug("Count of IPS rules in dictionary: {}".format(len(result)))
-    return result
-
-def collect() -> dict:
+def collect(workload, cache) -> dict:
     """
     Query an API, calculate the required metrics and return a JSON object
     
     Parameters
     ----------
-    none
+    workload
+        Authenticated client of Workload Security
+    cache
+        Cache handle holding the IPS rule catalogue
 
     Raises
     ------
@@ -119,15 +53,12 @@ def collect() -> dict:
         "CounterMetricFamilyName": <YOUR METRICS FAMILY NAME>,
         "CounterMetricFamilyHelpText": <DESCRIPTION OF YOUR METRICS>,
         "CounterMetricFamilyLabels": [<LABEL 1>, <LABEL 2>, ...],
-        "Metrics": [<METRIC 1>, <METRIC 2>, ...]
+        "Columns": [<LABEL 1 COLUMN>, <LABEL 2 COLUMN>, ...],
+        "Values": [<VALUE 1>, <VALUE 2>, ...]
     }
     """
 
-    # API credentials are mounted to /etc
-    c1_url = open('/etc/cloudone-credentials/c1_url', 'r').read().rstrip('\n')
-    api_key = open('/etc/cloudone-credentials/ws_key', 'r').read().rstrip('\n')
-
-    _LOGGER.debug("Cloud One API endpoint: {}".format(c1_url))
+    _LOGGER.debug("Cloud One API endpoint: {}".format(workload.base_url))
 
     # Define your metrics here
     result = {
@@ -141,123 +72,93 @@ def collect() -> dict:
             'agentVersion',
             'displayName',
             'arribute'],
-        "Metrics": []
-    }
-
-    # API query and response parsing here
-    url = "https://workload." + c1_url + "/api/computers"
-    data = {}
-    post_header = {
-        "Content-type": "application/json",
-        "api-secret-key": api_key,
-        "api-version": "v1",
+        "Columns": [],
+        "Values": []
     }
-    response = requests.get(
-        url, data=json.dumps(data), headers=post_header, verify=True
-    ).json()
-
-    # Error handling
-    if "message" in response:
-        if response['message'] == "Invalid API Key":
-            _LOGGER.error("API error: {}".format(response['message']))
-            raise ValueError("Invalid API Key")
 
-    _LOGGER.debug("Computer listing received")
+    # API query, the computers are paged through by their IDs
+    computers = workload.search('computers', 'computers')
 
-    rules_dict = create_rules_dict(c1_url, api_key)
+    # The IPS rule catalogue is cached, it is only synced if it expired or
+    # if a computer has a rule assigned which is not known yet
+    rules_dict = cache.ips_rules()
 
     # Calculate your metrics
-    if len(response['computers']) > 0:
-        for computer in response['computers']:
-            rule_count = 0
-            severity_low = 0
-            severity_medium = 0
-            severity_high = 0
-            severity_crititcal = 0
-            type_vulnerability = 0
-            type_exploit = 0
-
-            # Count severities and rule types
-            if "ruleIDs" in computer['intrusionPrevention']:
-                rule_count = len(computer['intrusionPrevention']['ruleIDs'])
-                for ruleId in computer['intrusionPrevention']['ruleIDs']:
-
-                    if rules_dict[ruleId]['severity'] == "low":
-                        severity_low += 1
-                    if rules_dict[ruleId]['severity'] == "medium":
-                        severity_medium += 1
-                    if rules_dict[ruleId]['severity'] == "high":
-                        severity_high += 1
-                    if rules_dict[ruleId]['severity'] == "critical":
-                        severity_crititcal += 1
-                    if rules_dict[ruleId]['type'] == "vulnerability":
-                        type_vulnerability += 1
-                    if rules_dict[ruleId]['type'] == "exploit":
-                        type_exploit += 1
-
-            labels = []
-
-            # Location
-            if "gcpVirtualMachineSummary" in computer:
-                labels.append("GCP")
-                labels.append(computer['gcpVirtualMachineSummary']['state'].title())
-
-            elif "ec2VirtualMachineSummary" in computer:
-                labels.append("AWS")
-                labels.append(computer['ec2VirtualMachineSummary']['state'].title())
-            elif "azureARMVirtualMachineSummary" in computer:
-                labels.append("Azure")
-                labels.append(computer['azureARMVirtualMachineSummary']['state'].title())
-            else:
-                labels.append("On-Prem")
-                labels.append(computer['computerStatus']['agentStatus'].title())
-
-            labels.append(computer['platform'])
-
-            if 'securityUpdates' in computer:
-                labels.append(computer['securityUpdates']['updateStatus']['statusMessage'])
-            else:
-                labels.append("Unmanaged")
-
-            labels.append(computer['agentVersion'])
-            labels.append(computer['displayName'])
-
-            # Specific metrics
-            attlabels = labels[:]
-            attlabels.append("info")
-            result['Metrics'].append([attlabels, 1])
-
-            attlabels = labels[:]
-            attlabels.append("rule_count")
-            result['Metrics'].append([attlabels, rule_count])
-
-            attlabels = labels[:]
-            attlabels.append("severity_low")
-            result['Metrics'].append([attlabels, severity_low])
-
-            attlabels = labels[:]
-            attlabels.append("severity_medium")
-            result['Metrics'].append([attlabels, severity_medium])
-
-            attlabels = labels[:]
-            attlabels.append("severity_high")
-            result['Metrics'].append([attlabels, severity_high])
-
-            attlabels = labels[:]
-            attlabels.append("severity_crititcal")
-            result['Metrics'].append([attlabels, severity_crititcal])
-
-            attlabels = labels[:]
-            attlabels.append("type_vulnerability")
-            result['Metrics'].append([attlabels, type_vulnerability])
-
-            attlabels = labels[:]
-            attlabels.append("type_exploit")
-            result['Metrics'].append([attlabels, type_exploit])
+    computer_columns = tuple([] for _ in range(6))
+    values = array('l')
+    for computer in computers:
+        rule_count = 0
+        severity_low = 0
+        severity_medium = 0
+        severity_high = 0
+        severity_crititcal = 0
+        type_vulnerability = 0
+        type_exploit = 0
+
+        # Count severities and rule types
+        if "ruleIDs" in computer['intrusionPrevention']:
+            rule_count = len(computer['intrusionPrevention']['ruleIDs'])
+            if any(ruleId not in rules_dict for ruleId in computer['intrusionPrevention']['ruleIDs']):
+                rules_dict = cache.ips_rules(computer['intrusionPrevention']['ruleIDs'])
+            for ruleId in computer['intrusionPrevention']['ruleIDs']:
+
+                if rules_dict[ruleId]['severity'] == "low":
+                    severity_low += 1
+                if rules_dict[ruleId]['severity'] == "medium":
+                    severity_medium += 1
+                if rules_dict[ruleId]['severity'] == "high":
+                    severity_high += 1
+                if rules_dict[ruleId]['severity'] == "critical":
+                    severity_crititcal += 1
+                if rules_dict[ruleId]['type'] == "vulnerability":
+                    type_vulnerability += 1
+                if rules_dict[ruleId]['type'] == "exploit":
+                    type_exploit += 1
+
+        labels = []
+
+        # Location
+        if "gcpVirtualMachineSummary" in computer:
+            labels.append("GCP")
+            labels.append(computer['gcpVirtualMachineSummary']['state'].title())
+
+        elif "ec2VirtualMachineSummary" in computer:
+            labels.append("AWS")
+            labels.append(computer['ec2VirtualMachineSummary']['state'].title())
+        elif "azureARMVirtualMachineSummary" in computer:
+            labels.append("Azure")
+            labels.append(computer['azureARMVirtualMachineSummary']['state'].title())
+        else:
+            labels.append("On-Prem")
+            labels.append(computer['computerStatus']['agentStatus'].title())
+
+        labels.append(computer['platform'])
+
+        if 'securityUpdates' in computer:
+            labels.append(computer['securityUpdates']['updateStatus']['statusMessage'])
+        else:
+            labels.append("Unmanaged")
+
+        labels.append(computer['agentVersion'])
+        labels.append(computer['displayName'])
+
+        # Specific metrics, one per attribute
+        for column, label in zip(computer_columns, labels):
+            column.append(label)
+        values.extend((1, rule_count, severity_low, severity_medium, severity_high,
+                       severity_crititcal, type_vulnerability, type_exploit))
+
+    # The metrics are returned column by column. The labels of a computer
+    # are stored once and referenced by all of it's attributes
+    computers = len(computer_columns[0])
+    codes = [index for index in range(computers) for _ in _ATTRIBUTES]
+    result['Columns'] = [columnar.Interned(column, codes) for column in computer_columns]
+    result['Columns'].append(columnar.Interned(_ATTRIBUTES, list(range(len(_ATTRIBUTES))) * computers))
+    result['Values'] = values
 
     # Return results
     _LOGGER.debug("Metrics collected: {}".format(result))
     return result
 
 if __name__ == '__main__':
-    collect()
\ No newline at end of file
+    collect(**services.inject(collect))
\ No newline at end of file
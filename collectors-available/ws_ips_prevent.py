@@ -11,8 +11,7 @@ with python3 <FILENAME>. You need to ensure the presence of the
 credentials in the given directory.
 """
 
-import json
-import requests
+import services
 import logging
 import sys
 
@@ -21,13 +20,14 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s (%(threadName)s) [%(funcName)s] %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
-def collect() -> dict:
+def collect(workload) -> dict:
     """
     Query an API, calculate the required metrics and return a JSON object
     
     Parameters
     ----------
-    none
+    workload
+        Authenticated client of Workload Security
 
     Raises
     ------
@@ -44,11 +44,7 @@ def collect() -> dict:
     }
     """
 
-    # API credentials are mounted to /etc
-    c1_url = open('/etc/cloudone-credentials/c1_url', 'r').read().rstrip('\n')
-    api_key = open('/etc/cloudone-credentials/ws_key', 'r').read().rstrip('\n')
-
-    _LOGGER.debug("Cloud One API endpoint: {}".format(c1_url))
+    _LOGGER.debug("Cloud One API endpoint: {}".format(workload.base_url))
 
     # Define your metrics here
     result = {
@@ -58,42 +54,27 @@ def collect() -> dict:
         "Metrics": []
     }
 
-    # API query and response parsing here
-    url = "https://workload." + c1_url + "/api/computers"
-    data = {}
-    post_header = {
-        "Content-type": "application/json",
-        "api-secret-key": api_key,
-        "api-version": "v1",
-    }
-    response = requests.get(
-        url, data=json.dumps(data), headers=post_header, verify=True
-    ).json()
-
-    # Error handling
-    if "message" in response:
-        if response['message'] == "Invalid API Key":
-            raise ValueError("Invalid API Key")
+    # API query, the computers are paged through by their IDs
+    computers = workload.search('computers', 'computers')
 
     # Calculate your metrics
-    if len(response['computers']) > 0:
-        for computer in response['computers']:
-            labels = []
-            labels.append(computer['displayName'])
-            labels.append(str(computer['lastIPUsed']))
+    for computer in computers:
+        labels = []
+        labels.append(computer['displayName'])
+        labels.append(str(computer['lastIPUsed']))
 
-            metric = 0
+        metric = 0
 
-            if "state" in computer['intrusionPrevention']:
-                if computer['intrusionPrevention']['state'] == "prevent":
-                    metric = 1
+        if "state" in computer['intrusionPrevention']:
+            if computer['intrusionPrevention']['state'] == "prevent":
+                metric = 1
 
-            # Add a single metric
-            result['Metrics'].append([labels, metric])
+        # Add a single metric
+        result['Metrics'].append([labels, metric])
 
     # Return results
     _LOGGER.debug("Metrics collected: {}".format(result))
     return result
 
 if __name__ == '__main__':
-    collect()
\ No newline at end of file
+    collect(**services.inject(collect))
\ No newline at end of file
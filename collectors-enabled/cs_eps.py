@@ -16,9 +16,11 @@ credentials in the given directory.
 """
 
 import requests
+import services
+import functools
 import logging
 import sys
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 # Constants
 _LOGGER = logging.getLogger(__name__)
@@ -26,13 +28,97 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG,
                     format='%(asctime)s %(levelname)s (%(threadName)s) [%(funcName)s] %(message)s',
                     datefmt='%Y-%m-%d %H:%M:%S')
 
-def collect() -> dict:
+# Length of the window the events are counted in
+WINDOW_MINUTES = 5
+
+def fetch_events(container, from_time, to_time, cursor) -> tuple:
+    """
+    Query a single page of evaluation events
+
+    Parameters
+    ----------
+    container
+        Authenticated client of Container Security
+    from_time, to_time
+        Time range of the events
+    cursor
+        Cursor of the page, empty for the first one
+
+    Raises
+    ------
+    ValueError
+        Houston, we have a problem
+    requests.exceptions.RequestException
+        The request failed
+
+    Returns
+    -------
+    (events, cursor of the next page or empty for the last page)
+    """
+
+    path = "/api/events/evaluations?" \
+        + "next=" + cursor \
+        + "&limit=" + str(25) \
+        + "&fromTime=" + from_time.strftime("%Y-%m-%dT%H:%M:%SZ") \
+        + "&toTime=" + to_time.strftime("%Y-%m-%dT%H:%M:%SZ")
+    try:
+        response = container.get(path)
+
+        response.encoding = response.apparent_encoding
+        response.raise_for_status()
+    except requests.exceptions.HTTPError:
+        _LOGGER.error(response.text)
+        raise
+    except requests.exceptions.RequestException as err:
+        # timeout or catastrophic error, the collector's last good result
+        # is served instead
+        _LOGGER.error(err)
+        raise
+
+    response = response.json()
+    # Error handling
+    if "message" in response:
+        if response['message'] == "Invalid API Key":
+            _LOGGER.error("API error: {}".format(response['message']))
+            raise ValueError("Invalid API Key")
+
+    events = response.get('events', [])
+    _LOGGER.debug("Number of events in result set: %d", len(events))
+
+    return events, response.get('next', "")
+
+def event_labels(event) -> list:
+    """
+    Return the label tuples an evaluation event is counted for, one per
+    reason of the evaluation
+    """
+
+    # ['clusterName', 'policyName', 'mitigation', 'operation', 'kind', 'namespace', 'decision', 'type'],
+    labels = (
+        event['clusterName'],
+        event['policyName'],
+        event.get('mitigation', 'n/a'),
+        event.get('operation', 'n/a'),
+        event['kind'],
+        event['namespace'],
+        event['decision'],
+    )
+
+    reasons = event.get('reasons', None)
+    if (reasons):
+        return [labels + (reason['type'],) for reason in reasons]
+    return [labels + ('n/a',)]
+
+def collect(container, cache) -> dict:
     """
     Query an API, calculate the required metrics and return a JSON object
     
     Parameters
     ----------
-    none
+    container
+        Authenticated client of Container Security
+    cache
+        Cache handle holding the event window
 
     Raises
     ------
@@ -45,126 +131,36 @@ def collect() -> dict:
         "CounterMetricFamilyName": <YOUR METRICS FAMILY NAME>,
         "CounterMetricFamilyHelpText": <DESCRIPTION OF YOUR METRICS>,
         "CounterMetricFamilyLabels": [<LABEL 1>, <LABEL 2>, ...],
-        "Metrics": [<METRIC 1>, <METRIC 2>, ...]
+        "Columns": [<LABEL 1 COLUMN>, <LABEL 2 COLUMN>, ...],
+        "Values": [<VALUE 1>, <VALUE 2>, ...]
     }
     """
 
-    # API credentials are mounted to /etc
-    c1_url = open('/etc/cloudone-credentials/c1_url', 'r').read().rstrip('\n')
-    api_key = open('/etc/cloudone-credentials/api_key', 'r').read().rstrip('\n')
-
-    _LOGGER.debug("Cloud One API endpoint: {}".format(c1_url))
+    _LOGGER.debug("Cloud One API endpoint: {}".format(container.base_url))
 
     # Define your metrics here
     result = {
         "CounterMetricFamilyName": "cs_eps",
         "CounterMetricFamilyHelpText": "Container Security Events per Slice",
         "CounterMetricFamilyLabels": ['clusterName', 'policyName', 'mitigation', 'operation', 'kind', 'namespace', 'decision', 'type'],
-        "Metrics": []
+        "Columns": [],
+        "Values": []
     }
 
-    start_time = (datetime.utcnow() - timedelta(minutes=5)).strftime("%Y-%m-%dT%H:%M:%SZ")
-    end_time = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    # mitigation_table = {
-    #     "log": 0,
-    #     "isolate": 1,
-    #     "terminate": 2
-    # }
-
-    # API query and response parsing here
-    cursor = ""
-    events = []
-    while True:
-        url = "https://container." + c1_url + "/api/events/evaluations?" \
-            + "next=" + cursor \
-            + "&limit=" + str(25) \
-            + "&fromTime=" + start_time \
-            + "&toTime=" + end_time
-        post_header = {
-            "Content-Type": "application/json",
-            "Authorization": "ApiKey " + api_key,
-            "api-version": "v1",
-        }
-        try:
-            response = requests.get(
-                url, headers=post_header, verify=True
-            )
-
-            response.encoding = response.apparent_encoding
-            response.raise_for_status()
-        except requests.exceptions.Timeout as err:
-            _LOGGER.error(response.text)
-            raise SystemExit(err)
-        except requests.exceptions.HTTPError as err:
-            _LOGGER.error(response.text)
-            raise SystemExit(err)
-        except requests.exceptions.RequestException as err:
-            # catastrophic error. bail.
-            _LOGGER.error(response.text)
-            raise SystemExit(err)
-
-        response = response.json()
-        # Error handling
-        if "message" in response:
-            if response['message'] == "Invalid API Key":
-                _LOGGER.error("API error: {}".format(response['message']))
-                raise ValueError("Invalid API Key")
-
-        events_count = len(response.get('events', {}))
-        _LOGGER.debug("Number of events in result set: %d", events_count)
-        if events_count > 0:
-            for event in response.get('events', {}):
-                events.append(event)
-
-        cursor = response.get('next', "")
-        if cursor == "":
-            break
-
-    _LOGGER.debug("{} Container Security reasons received".format(str(len(events))))
-
-    # Calculate metrics
-    # ['clusterName', 'policyName', 'mitigation', 'operation', 'kind', 'namespace', 'decision', 'type'],
-    results = {}
-    if len(events) > 0:
-        for event in events:
-            # pprint.pprint(event)
-            labels = []
-            labels.append(event['clusterName'])
-            labels.append(event['policyName'])
-            labels.append(event.get('mitigation', 'n/a'))
-            labels.append(event.get('operation', 'n/a'))
-            labels.append(event['kind'])
-            labels.append(event['namespace'])
-            labels.append(event['decision'])
-
-            reasons = event.get('reasons', None)
-            if (reasons):
-                for reason in reasons:
-                    temp = labels.copy()
-                    temp.append(reason['type'])
-                    labelss = '#'.join(temp)
-                    if (labelss in results):
-                        results[labelss] = results[labelss] + 1
-                    else:
-                        results[labelss] = 1
-                    _LOGGER.debug("{},{}".format(labelss, results[labelss]))
-            else:
-                labels.append('n/a')
-                labelss = '#'.join(labels)
-                if (labelss in results):
-                    results[labelss] = results[labelss] + 1
-                else:
-                    results[labelss] = 1
-                _LOGGER.debug("{},{}".format(labelss, results[labelss]))
-
-    # Convert to [[,,,],]
-    for entry in results:
-        result['Metrics'].append([entry.split('#'), results[entry]])
+    # Only the events since the last run are fetched, the window is
+    # computed from the per-minute buckets of the previous runs
+    window = cache.event_window(__name__, timedelta(minutes=WINDOW_MINUTES))
+    window.update(functools.partial(fetch_events, container), event_labels)
+    counts = window.counts()
+
+    _LOGGER.debug("{} Container Security label sets counted".format(str(len(counts))))
+
+    # The counts are returned column by column
+    counts.to_result(result)
 
     # Return results
     _LOGGER.debug("Metrics collected: {}".format(result))
     return result
 
 if __name__ == '__main__':
-    collect()
+    collect(**services.inject(collect))
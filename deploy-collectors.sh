@@ -5,6 +5,7 @@ set -e
 NAMESPACE="$(jq -r '.namespace' config.json)"
 
 # create configmaps containing the python scripts
+SOURCES=""
 for collector in collectors-enabled/*.py; do
     name_configmap=$(basename -s '.py' ${collector//_/-})
     name_collector=$(basename ${collector})
@@ -12,25 +13,27 @@ for collector in collectors-enabled/*.py; do
     echo Creating collector ${name_collector} as ${name_configmap}
     kubectl -n ${NAMESPACE} create configmap ${name_configmap} \
         --from-file=${collector} --dry-run=client -o yaml | kubectl apply -f -
-    
-    # patch the api-collector deployment and set annotations to make
-    # potential changes in the collectors effective
-    kubectl -n ${NAMESPACE} patch deployment api-collector --patch "
+
+    SOURCES="${SOURCES}
+          - configMap:
+              name: ${name_configmap}"
+done
+
+# patch the api-collector deployment to mount all collectors into a single
+# projected volume. kubelet updates the mounted files when a configmap
+# changes and the api-collector reloads changed collectors at runtime, so
+# the pod is only restarted if the set of collectors changes
+kubectl -n ${NAMESPACE} patch deployment api-collector --patch "
 spec:
   template:
-    metadata:
-      annotations:
-        ${name_configmap}Hash: $(kubectl -n ${NAMESPACE} get configmap ${name_configmap} -oyaml | sha256sum)
     spec:
       containers:
         - name: api-collector
           volumeMounts:
-          - name: ${name_configmap}
-            mountPath: "/code/${collector//-enabled//}"
-            subPath: ${name_collector}
+          - name: collectors
+            mountPath: /code/collectors
       volumes:
-        - name: ${name_configmap}
-          configMap:
-            name: ${name_configmap}
+        - name: collectors
+          projected:
+            sources:${SOURCES}
 "
-done